@@ -0,0 +1,187 @@
+"""
+Audio decoding and in-memory encoding for Whisper uploads.
+
+Audio is decoded to 16 kHz mono int16 PCM (from the video, or sliced from the
+raw PCM sidecar extracted at ingest) and encoded over an ffmpeg pipe to
+CLIPBUILDER_TRANSCRIPT_AUDIO_FORMAT: opus (default), flac or wav.
+
+    samples = decode_pcm(video_path, start, duration)   # or a slice of load_track(video_path)
+    filename, payload = encode(samples)                  # ("audio.ogg", b"OggS...")
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import subprocess
+import threading
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from env_config import env_flag
+
+logger = logging.getLogger("clipbuilder.audio_codec")
+
+SAMPLE_RATE = 16000  # Whisper resamples to 16 kHz mono anyway
+
+TRACK_ON_INGEST = env_flag("CLIPBUILDER_AUDIO_TRACK_ON_INGEST", True)
+
+FORMAT = (os.getenv("CLIPBUILDER_TRANSCRIPT_AUDIO_FORMAT") or "opus").strip().lower()
+if FORMAT not in {"flac", "opus", "wav"}:
+    FORMAT = "opus"
+OPUS_BITRATE = (os.getenv("CLIPBUILDER_TRANSCRIPT_AUDIO_BITRATE") or "24k").strip()
+
+_ENCODERS: dict[str, tuple[list[str], str]] = {
+    "flac": (["-c:a", "flac", "-compression_level", "5", "-f", "flac"], "audio.flac"),
+    "opus": (["-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg"], "audio.ogg"),
+}
+
+
+def decode_pcm(video_path: Path, start: float, duration: float, *, ffmpeg: str = "ffmpeg") -> np.ndarray | None:
+    """Decode [start, start + duration] of the audio track to 16 kHz mono int16 samples."""
+    cmd = [
+        ffmpeg,
+        "-v", "error",
+        "-ss", str(start),
+        "-i", str(video_path),
+        "-t", str(duration),
+        "-vn",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "-f", "s16le",
+        "pipe:1",
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, check=True)
+    except Exception as exc:
+        logger.warning("Failed to extract audio: %s", exc)
+        return None
+    if len(proc.stdout) < 1000:
+        return None  # no audio track
+    return np.frombuffer(proc.stdout[: len(proc.stdout) // 2 * 2], dtype="<i2")
+
+
+def _wav(samples: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(SAMPLE_RATE)
+        writer.writeframes(samples.astype("<i2", copy=False).tobytes())
+    return buf.getvalue()
+
+
+def encode(samples: np.ndarray, *, fmt: str = FORMAT, ffmpeg: str = "ffmpeg") -> tuple[str, bytes]:
+    """(upload filename, encoded bytes) for 16 kHz mono int16 samples, encoded in memory."""
+    if fmt in _ENCODERS:
+        args, filename = _ENCODERS[fmt]
+        cmd = [
+            ffmpeg,
+            "-v", "error",
+            "-f", "s16le",
+            "-ac", "1",
+            "-ar", str(SAMPLE_RATE),
+            "-i", "pipe:0",
+            *args,
+            "pipe:1",
+        ]
+        try:
+            proc = subprocess.run(
+                cmd, input=samples.astype("<i2", copy=False).tobytes(), capture_output=True, check=True
+            )
+            if proc.stdout:
+                return filename, proc.stdout
+        except Exception as exc:
+            logger.warning("audio encode (%s) failed, sending WAV: %s", fmt, exc)
+    return "audio.wav", _wav(samples)
+
+
+def track_path(video_path: Path) -> Path:
+    return video_path.with_name(f"{video_path.stem}.audio.pcm")
+
+
+_track_lock = threading.Lock()
+_tracks: dict[str, tuple[int, np.memmap]] = {}
+
+
+# video path -> (lock, callers using it); entries are dropped when the last caller finishes.
+_extract_locks_lock = threading.Lock()
+_extract_locks: dict[str, tuple[threading.Lock, int]] = {}
+
+
+def extract_track(video_path: Path, *, ffmpeg: str = "ffmpeg") -> Path | None:
+    """Decode the whole audio track once to the raw PCM sidecar; None when the video has no audio."""
+    key = str(video_path.resolve())
+    with _extract_locks_lock:
+        lock, users = _extract_locks.get(key, (threading.Lock(), 0))
+        _extract_locks[key] = (lock, users + 1)
+    try:
+        with lock:  # ingest jobs asking for the same track wait for one decode
+            return _extract_track(video_path, ffmpeg=ffmpeg)
+    finally:
+        with _extract_locks_lock:
+            lock, users = _extract_locks[key]
+            if users <= 1:
+                del _extract_locks[key]
+            else:
+                _extract_locks[key] = (lock, users - 1)
+
+
+def _extract_track(video_path: Path, *, ffmpeg: str) -> Path | None:
+    path = track_path(video_path)
+    if path.exists() and path.stat().st_mtime_ns >= video_path.stat().st_mtime_ns:
+        return path
+    tmp = path.with_suffix(".tmp")
+    cmd = [
+        ffmpeg,
+        "-v", "error",
+        "-y",
+        "-i", str(video_path),
+        "-vn",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "-f", "s16le",
+        str(tmp),
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True)
+        if tmp.stat().st_size < 1000:
+            tmp.unlink(missing_ok=True)
+            return None  # no audio track
+        tmp.replace(path)
+    except Exception as exc:
+        logger.warning("audio track extraction failed (%s): %s", video_path.name, exc)
+        tmp.unlink(missing_ok=True)
+        return None
+    with _track_lock:
+        _tracks.pop(str(path), None)
+    logger.info("audio track: %s (%.0fs)", path.name, path.stat().st_size / 2 / SAMPLE_RATE)
+    return path
+
+
+def load_track(video_path: Path) -> np.memmap | None:
+    """Memory map of the PCM sidecar (cached per file version), or None if it was not extracted."""
+    path = track_path(video_path)
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    if stat.st_size < 2:
+        return None
+    with _track_lock:
+        cached = _tracks.get(str(path))
+        if cached and cached[0] == stat.st_mtime_ns:
+            return cached[1]
+        track = np.memmap(path, dtype="<i2", mode="r", shape=(stat.st_size // 2,))
+        _tracks[str(path)] = (stat.st_mtime_ns, track)
+        return track
+
+
+def remove_track(video_path: Path) -> None:
+    path = track_path(video_path)
+    with _track_lock:
+        _tracks.pop(str(path), None)
+    path.unlink(missing_ok=True)
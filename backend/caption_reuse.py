@@ -0,0 +1,143 @@
+"""
+Reuse of smart-text captions for captures of an unchanged screen.
+
+Users often capture the same screen state a few seconds apart (re-capturing
+after editing a step, or stepping through a paused video). Each capture gets
+a visual signature: perceptual hashes (frame_hash.py) of a few frames around
+the timestamp. A new request whose signature is within
+CLIPBUILDER_CAPTION_REUSE_DISTANCE bits of a cached one, for the same video
+and the same caption options (model, prompt, include_timestamp), gets the
+cached caption instead of a fresh provider call.
+
+    if cache.has_candidates(video_id, options_key):
+        hit = cache.lookup(video_id, options_key, signature)
+    ...
+    cache.store(video_id, options_key, signature, caption, timestamp)   # after the response
+
+Entries are scoped per video (never shared across uploads/users), expire after
+CLIPBUILDER_CAPTION_REUSE_TTL_SECONDS and are bounded per video.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from env_config import env_flag, env_float
+from frame_hash import distance_matrix
+
+logger = logging.getLogger("clipbuilder.caption_reuse")
+
+
+REUSE_ENABLED = env_flag("CLIPBUILDER_CAPTION_REUSE", True)
+# Max Hamming distance (bits of 64) between matching frames of two signatures.
+MAX_DISTANCE = int(env_float("CLIPBUILDER_CAPTION_REUSE_DISTANCE", 4))
+TTL_SECONDS = env_float("CLIPBUILDER_CAPTION_REUSE_TTL_SECONDS", 3600.0)
+MAX_ENTRIES_PER_VIDEO = int(env_float("CLIPBUILDER_CAPTION_REUSE_MAX_ENTRIES", 200))
+# Signature frames are taken within +/- this many seconds of the timestamp.
+WINDOW_SECONDS = env_float("CLIPBUILDER_CAPTION_REUSE_WINDOW_SECONDS", 3.0)
+
+
+@dataclass(frozen=True)
+class ReusedCaption:
+    caption: str
+    timestamp: str  # timestamp of the request that produced the caption
+    distance: int
+
+
+@dataclass
+class _Entry:
+    options_key: str
+    signature: np.ndarray
+    caption: str
+    timestamp: str
+    created_at: float
+
+
+def signature_distance(a: np.ndarray, b: np.ndarray) -> int:
+    """Symmetric worst-case distance: every frame of each signature must have a close match in the other."""
+    if len(a) == 0 or len(b) == 0:
+        return 64
+    distances = distance_matrix(a, b)
+    return int(max(distances.min(axis=1).max(), distances.min(axis=0).max()))
+
+
+class CaptionReuseCache:
+    """Per-video caption entries matched by visual signature + caption options."""
+
+    def __init__(self, *, max_distance: int, ttl_seconds: float, max_entries_per_video: int) -> None:
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_video = max(1, max_entries_per_video)
+        self._lock = threading.Lock()
+        self._entries: dict[str, list[_Entry]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def has_candidates(self, video_id: str, options_key: str) -> bool:
+        """Whether a lookup could match at all (lets callers skip computing a signature)."""
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                e.options_key == options_key and now - e.created_at <= self.ttl_seconds
+                for e in self._entries.get(video_id) or []
+            )
+
+    def lookup(self, video_id: str, options_key: str, signature: np.ndarray) -> ReusedCaption | None:
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(video_id) or []
+            entries[:] = [e for e in entries if now - e.created_at <= self.ttl_seconds]
+            best: tuple[int, _Entry] | None = None
+            for e in entries:
+                if e.options_key != options_key:
+                    continue
+                distance = signature_distance(signature, e.signature)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, e)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return ReusedCaption(caption=best[1].caption, timestamp=best[1].timestamp, distance=best[0])
+
+    def store(self, video_id: str, options_key: str, signature: np.ndarray, caption: str, timestamp: str) -> None:
+        if len(signature) == 0 or not caption.strip():
+            return
+        with self._lock:
+            entries = self._entries.setdefault(video_id, [])
+            entries.append(
+                _Entry(
+                    options_key=options_key,
+                    signature=signature,
+                    caption=caption,
+                    timestamp=timestamp,
+                    created_at=time.monotonic(),
+                )
+            )
+            if len(entries) > self.max_entries_per_video:
+                del entries[: len(entries) - self.max_entries_per_video]
+
+    def forget_video(self, video_id: str) -> None:
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": sum(len(entries) for entries in self._entries.values()),
+            }
+
+
+cache = CaptionReuseCache(
+    max_distance=MAX_DISTANCE,
+    ttl_seconds=TTL_SECONDS,
+    max_entries_per_video=MAX_ENTRIES_PER_VIDEO,
+)
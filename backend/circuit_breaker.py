@@ -0,0 +1,302 @@
+"""
+Per (provider, model) circuit breakers for Gemini / Groq calls.
+
+When a provider is degraded, every smart-text request would otherwise encode a
+clip, upload it, poll and generate before failing tens of seconds later, tying
+up a worker thread and an ffmpeg process each time. The breaker tracks the
+error rate (server faults and slow calls) over a sliding window:
+
+- closed:    calls flow; the breaker opens once the failure rate crosses the threshold.
+- open:      `check()` raises `CircuitOpenError` immediately, so endpoints can fail
+             fast or reroute *before* doing any local work.
+- half-open: after the cool-down a limited number of probe calls go through; a
+             success closes the breaker, a failure re-opens it with a longer cool-down.
+
+Client-side errors (bad key, invalid arguments) and 429s do not count: those are
+per-key conditions handled by `rate_limiter`/`key_pool`, not provider outages.
+
+Model names may come from requests, so closed circuits with nothing in the window
+are dropped once idle for a window, and at most CLIPBUILDER_BREAKER_MAX_CIRCUITS
+are kept (closed ones evicted least recently used first).
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, TypeVar
+
+from env_config import env_float, env_int
+from rate_limiter import is_rate_limit_error, limiter
+
+logger = logging.getLogger("clipbuilder.circuit_breaker")
+
+T = TypeVar("T")
+
+
+FAILURE_RATE = env_float("CLIPBUILDER_BREAKER_FAILURE_RATE", 0.5)
+MIN_CALLS = int(env_float("CLIPBUILDER_BREAKER_MIN_CALLS", 5))
+WINDOW_SECONDS = env_float("CLIPBUILDER_BREAKER_WINDOW_SECONDS", 60.0)
+SLOW_CALL_SECONDS = env_float("CLIPBUILDER_BREAKER_SLOW_CALL_SECONDS", 90.0)
+OPEN_SECONDS = env_float("CLIPBUILDER_BREAKER_OPEN_SECONDS", 30.0)
+MAX_OPEN_SECONDS = 300.0
+HALF_OPEN_PROBES = 1
+MAX_CIRCUITS = env_int("CLIPBUILDER_BREAKER_MAX_CIRCUITS", 64)
+
+_FAULT_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "GatewayTimeout",
+    "BadGateway",
+    "ServerError",
+    "RetryError",
+    "TransportError",
+    "ConnectError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "WriteTimeout",
+    "PoolTimeout",
+    "RemoteProtocolError",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """The provider/model breaker is open; the call was not attempted."""
+
+    def __init__(self, provider: str, model: str, retry_after: float) -> None:
+        self.provider = provider
+        self.model = model
+        self.retry_after = max(1.0, retry_after)
+        super().__init__(
+            f"Provedor {provider} ({model}) indisponível no momento (falhas recentes). "
+            f"Tente novamente em ~{int(round(self.retry_after))}s."
+        )
+
+
+def is_provider_fault(exc: BaseException) -> bool:
+    """True for server-side / transport failures (5xx, timeouts, connection errors)."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    for attr in ("status_code", "code"):
+        status = getattr(exc, attr, None)
+        if isinstance(status, int) and 500 <= status < 600:
+            return True
+    return any(cls.__name__ in _FAULT_NAMES for cls in type(exc).__mro__)
+
+
+@dataclass
+class _Circuit:
+    state: str = "closed"  # closed | open | half_open
+    outcomes: deque[tuple[float, bool]] = field(default_factory=deque)  # (ts, failed)
+    opened_at: float = 0.0
+    open_seconds: float = OPEN_SECONDS
+    probes_in_flight: int = 0
+    times_opened: int = 0
+    last_latency: float = 0.0
+    last_used: float = 0.0
+
+    def prune(self, now: float, window: float) -> None:
+        while self.outcomes and now - self.outcomes[0][0] > window:
+            self.outcomes.popleft()
+
+    def failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, failed in self.outcomes if failed) / len(self.outcomes)
+
+
+class CircuitBreakerRegistry:
+    def __init__(
+        self,
+        *,
+        failure_rate: float,
+        min_calls: int,
+        window_seconds: float,
+        slow_call_seconds: float,
+        open_seconds: float,
+        max_circuits: int = MAX_CIRCUITS,
+    ) -> None:
+        self.failure_rate = failure_rate
+        self.min_calls = max(1, min_calls)
+        self.window_seconds = window_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.max_circuits = max(1, max_circuits)
+        self._lock = threading.Lock()
+        self._circuits: OrderedDict[tuple[str, str], _Circuit] = OrderedDict()
+
+    def _circuit_locked(self, provider: str, model: str) -> _Circuit:
+        key = (provider, model or "")
+        now = time.monotonic()
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            self._evict_locked(now)
+            circuit = _Circuit(open_seconds=self.open_seconds)
+            self._circuits[key] = circuit
+        else:
+            self._circuits.move_to_end(key)
+        circuit.last_used = now
+        return circuit
+
+    def _evict_locked(self, now: float) -> None:
+        """Drop closed circuits idle for a window, then the least recently used closed ones beyond max_circuits."""
+        overflow = len(self._circuits) + 1 - self.max_circuits
+        for key, c in list(self._circuits.items()):  # oldest first
+            if c.state != "closed" or c.probes_in_flight:
+                continue
+            c.prune(now, self.window_seconds)
+            idle = not c.outcomes and now - c.last_used > self.window_seconds
+            if idle or overflow > 0:
+                del self._circuits[key]
+                overflow -= 1
+
+    def check(self, provider: str, model: str) -> None:
+        """Raise `CircuitOpenError` if calls to provider/model would be rejected right now.
+
+        Does not consume a half-open probe: use it to gate local work (ffmpeg,
+        uploads) before the actual provider call.
+        """
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuit_locked(provider, model)
+            if circuit.state == "open":
+                remaining = circuit.opened_at + circuit.open_seconds - now
+                if remaining > 0:
+                    raise CircuitOpenError(provider, model, remaining)
+            elif circuit.state == "half_open" and circuit.probes_in_flight >= HALF_OPEN_PROBES:
+                raise CircuitOpenError(provider, model, circuit.open_seconds / 2)
+
+    def is_open(self, provider: str, model: str) -> bool:
+        try:
+            self.check(provider, model)
+        except CircuitOpenError:
+            return True
+        return False
+
+    def _acquire(self, provider: str, model: str) -> bool:
+        """Admit a call; returns True if it is a half-open probe."""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuit_locked(provider, model)
+            if circuit.state == "open":
+                remaining = circuit.opened_at + circuit.open_seconds - now
+                if remaining > 0:
+                    raise CircuitOpenError(provider, model, remaining)
+                circuit.state = "half_open"
+                circuit.probes_in_flight = 0
+                logger.info("circuit half-open: %s/%s", provider, model)
+            if circuit.state == "half_open":
+                if circuit.probes_in_flight >= HALF_OPEN_PROBES:
+                    raise CircuitOpenError(provider, model, circuit.open_seconds / 2)
+                circuit.probes_in_flight += 1
+                return True
+            return False
+
+    def _record(self, provider: str, model: str, *, probe: bool, failed: bool | None, latency: float) -> None:
+        """Record an outcome. failed=None means neutral (client error / 429): only frees the probe."""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuit_locked(provider, model)
+            if probe:
+                circuit.probes_in_flight = max(0, circuit.probes_in_flight - 1)
+            if failed is None:
+                return
+            circuit.last_latency = latency
+            if circuit.state == "half_open" and probe:
+                if failed:
+                    circuit.state = "open"
+                    circuit.opened_at = now
+                    circuit.open_seconds = min(MAX_OPEN_SECONDS, circuit.open_seconds * 2)
+                    circuit.times_opened += 1
+                    logger.warning("circuit re-opened: %s/%s for %.0fs", provider, model, circuit.open_seconds)
+                else:
+                    circuit.state = "closed"
+                    circuit.outcomes.clear()
+                    circuit.open_seconds = self.open_seconds
+                    logger.info("circuit closed: %s/%s", provider, model)
+                return
+            circuit.outcomes.append((now, failed))
+            circuit.prune(now, self.window_seconds)
+            if (
+                circuit.state == "closed"
+                and len(circuit.outcomes) >= self.min_calls
+                and circuit.failure_rate() >= self.failure_rate
+            ):
+                circuit.state = "open"
+                circuit.opened_at = now
+                circuit.times_opened += 1
+                logger.warning(
+                    "circuit opened: %s/%s (failure rate %.0f%% over %s calls) for %.0fs",
+                    provider,
+                    model,
+                    circuit.failure_rate() * 100,
+                    len(circuit.outcomes),
+                    circuit.open_seconds,
+                )
+
+    def call(self, provider: str, model: str, fn: Callable[[], T]) -> T:
+        """Run `fn` through the breaker, classifying its outcome."""
+        probe = self._acquire(provider, model)
+        start = time.monotonic()
+        try:
+            result = fn()
+        except Exception as exc:
+            latency = time.monotonic() - start
+            if is_rate_limit_error(exc) or not is_provider_fault(exc):
+                self._record(provider, model, probe=probe, failed=None, latency=latency)
+            else:
+                self._record(provider, model, probe=probe, failed=True, latency=latency)
+            raise
+        except BaseException:
+            self._record(provider, model, probe=probe, failed=None, latency=0.0)
+            raise
+        latency = time.monotonic() - start
+        self._record(provider, model, probe=probe, failed=latency > self.slow_call_seconds, latency=latency)
+        return result
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            out: list[dict[str, Any]] = []
+            for (provider, model), c in self._circuits.items():
+                c.prune(now, self.window_seconds)
+                out.append(
+                    {
+                        "provider": provider,
+                        "model": model,
+                        "state": c.state,
+                        "failure_rate": round(c.failure_rate(), 3),
+                        "calls_in_window": len(c.outcomes),
+                        "open_remaining_seconds": round(max(0.0, c.opened_at + c.open_seconds - now), 1)
+                        if c.state == "open"
+                        else 0.0,
+                        "times_opened": c.times_opened,
+                        "last_latency_seconds": round(c.last_latency, 2),
+                    }
+                )
+            return out
+
+
+breakers = CircuitBreakerRegistry(
+    failure_rate=FAILURE_RATE,
+    min_calls=MIN_CALLS,
+    window_seconds=WINDOW_SECONDS,
+    slow_call_seconds=SLOW_CALL_SECONDS,
+    open_seconds=OPEN_SECONDS,
+)
+
+
+def call_provider(provider: str, model: str, api_key: str, fn: Callable[[], T]) -> T:
+    """Breaker + rate limiter around a single provider call.
+
+    Each attempt (including 429 retries) is timed individually, so queueing
+    in the limiter never counts as provider latency.
+    """
+    breakers.check(provider, model)
+    return limiter.run(provider, model, api_key, lambda: breakers.call(provider, model, fn))
@@ -0,0 +1,131 @@
+"""
+Contact sheets: many frames in few images.
+
+Vision providers cap the number of images per request (Groq: 5), which
+undersamples longer actions. Beyond that cap, frames are packed into grid
+"contact sheets", each cell labelled with its moment (timestamp / order), so
+16+ moments still fit one request:
+
+    images = pack(frames, labels=["00:01:05", ...])   # <= MAX_IMAGES images
+
+Sheets are at most CLIPBUILDER_CONTACT_SHEET_MAX_SIDE px on their longest
+side (by default the vision payload's MAX_SIDE, so they are not downscaled
+again) and are encoded as fast, unoptimized PNG: vision_payload re-encodes
+them for the request anyway. Frames are never upscaled, and with MAX_IMAGES
+frames or fewer they are returned untouched.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import math
+
+import vision_payload
+from env_config import env_int
+
+logger = logging.getLogger("clipbuilder.contact_sheet")
+
+
+MAX_IMAGES = 5  # Groq vision: max images per request
+SHEET_MAX_SIDE = env_int("CLIPBUILDER_CONTACT_SHEET_MAX_SIDE", vision_payload.MAX_SIDE)
+_GAP = 4
+_BACKGROUND = (24, 24, 24)
+
+
+def _label_font(size: int):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size=size)  # Pillow >= 10.1 (scalable)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def _sheet(images: list, labels: list[str], max_side: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    count = len(images)
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    src_w = max(image.width for image in images)
+    src_h = max(image.height for image in images)
+    scale = min(
+        1.0,
+        (max_side - _GAP * (cols - 1)) / (cols * src_w),
+        (max_side - _GAP * (rows - 1)) / (rows * src_h),
+    )
+    cell_w, cell_h = max(1, int(src_w * scale)), max(1, int(src_h * scale))
+
+    sheet = Image.new("RGB", (cols * cell_w + _GAP * (cols - 1), rows * cell_h + _GAP * (rows - 1)), _BACKGROUND)
+    draw = ImageDraw.Draw(sheet)
+    font = _label_font(max(12, cell_h // 12))
+    for i, (image, label) in enumerate(zip(images, labels)):
+        x = (i % cols) * (cell_w + _GAP)
+        y = (i // cols) * (cell_h + _GAP)
+        cell = image.convert("RGB")
+        cell.thumbnail((cell_w, cell_h))
+        sheet.paste(cell, (x + (cell_w - cell.width) // 2, y + (cell_h - cell.height) // 2))
+        if label:
+            left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+            pad = 4
+            draw.rectangle([x, y, x + (right - left) + 2 * pad, y + (bottom - top) + 2 * pad], fill=(0, 0, 0))
+            draw.text((x + pad - left, y + pad - top), label, fill=(255, 230, 0), font=font)
+
+    buf = io.BytesIO()
+    sheet.save(buf, format="PNG", compress_level=1)  # intermediate: re-encoded by vision_payload
+    return buf.getvalue()
+
+
+def pack(
+    frames: list[bytes],
+    labels: list[str] | None = None,
+    *,
+    max_images: int = MAX_IMAGES,
+    max_side: int = SHEET_MAX_SIDE,
+) -> list[bytes]:
+    """Return at most `max_images` images covering every frame, in order (row-major within a sheet)."""
+    if len(frames) <= max_images:
+        return list(frames)
+
+    from PIL import Image
+
+    labels = list(labels or [])
+    labels += [f"#{i + 1}" for i in range(len(labels), len(frames))]
+    per_sheet = math.ceil(len(frames) / max_images)
+    # Spread frames evenly (17 -> 4, 4, 3, 3, 3) so no sheet is much denser than the others.
+    base, extra = divmod(len(frames), math.ceil(len(frames) / per_sheet))
+    sheets: list[bytes] = []
+    start = 0
+    while start < len(frames):
+        size = base + (1 if len(sheets) < extra else 0)
+        sheets.append(
+            _sheet(
+                [Image.open(io.BytesIO(frame)) for frame in frames[start : start + size]],
+                labels[start : start + size],
+                max_side,
+            )
+        )
+        start += size
+    logger.info("contact sheets: %s frames -> %s images (%s per sheet)", len(frames), len(sheets), per_sheet)
+    return sheets
+
+
+def describe_layout(frame_count: int, *, max_images: int = MAX_IMAGES, ordinal: bool = False) -> str | None:
+    """Prompt sentence explaining the sheets to the model (None when frames are sent as-is).
+
+    `ordinal=True` when the frames were packed without labels (cells numbered #1, #2, ...).
+    """
+    if frame_count <= max_images:
+        return None
+    per_sheet = math.ceil(frame_count / max_images)
+    sheets = math.ceil(frame_count / per_sheet)
+    return (
+        f"As {frame_count} capturas foram organizadas em {sheets} imagens em grade (até {per_sheet} por imagem), "
+        "em ordem cronológica da esquerda para a direita e de cima para baixo; "
+        + (
+            "o rótulo amarelo no canto de cada quadro indica sua posição na sequência (#1, #2, ...)."
+            if ordinal
+            else "o rótulo amarelo no canto de cada quadro indica o momento da captura."
+        )
+    )
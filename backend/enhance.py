@@ -10,7 +10,13 @@ from __future__ import annotations
 import base64
 import logging
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
+
+import contact_sheet
+import vision_payload
+from provider_clients import gemini_client, groq_client
+from circuit_breaker import CircuitOpenError, call_provider
+from rate_limiter import RateLimitTimeout
 
 logger = logging.getLogger("clipbuilder.enhance")
 
@@ -146,6 +152,88 @@ Gere o documento completo agora:'''
     return prompt
 
 
+class MarkdownFenceStripper:
+    """Incremental version of the ```markdown fence cleanup applied to final results.
+
+    Feed chunks as they arrive; a leading "```markdown" / "```" fence is
+    dropped once the first characters are known, and a trailing "```" is
+    held back (only backticks/whitespace are ever delayed) until `finish()`.
+    """
+
+    _OPENERS = ("```markdown", "```")
+    _HOLD_CHARS = " \t\r\n`"
+
+    def __init__(self) -> None:
+        self._head = ""
+        self._decided = False
+        self._fenced = False
+        self._skip_ws = False
+        self._tail = ""
+
+    def feed(self, chunk: str) -> str:
+        if not chunk:
+            return ""
+        if not self._decided:
+            self._head += chunk
+            if any(op.startswith(self._head) for op in self._OPENERS) and len(self._head) < len(self._OPENERS[0]):
+                return ""  # still could be an opening fence
+            chunk, self._head = self._head, ""
+            self._decided = True
+            for opener in self._OPENERS:
+                if chunk.startswith(opener):
+                    chunk = chunk[len(opener):]
+                    self._fenced = self._skip_ws = True
+                    break
+        if self._skip_ws:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return ""
+            self._skip_ws = False
+
+        pending = self._tail + chunk
+        cut = len(pending)
+        while cut > 0 and pending[cut - 1] in self._HOLD_CHARS:
+            cut -= 1
+        self._tail = pending[cut:]
+        return pending[:cut]
+
+    def finish(self) -> str:
+        if not self._decided:
+            # Short response that never got past the opener check.
+            out = self._head
+            for opener in self._OPENERS:
+                if out.startswith(opener):
+                    out, self._fenced = out[len(opener):].strip(), True
+                    break
+            self._head, self._tail = "", out
+        tail, self._tail = self._tail, ""
+        if self._fenced or tail.rstrip().endswith("```"):
+            tail = tail.rstrip()
+            if tail.endswith("```"):
+                tail = tail[:-3].rstrip()
+        return tail
+
+
+def _gemini_runtime_error(exc: Exception) -> RuntimeError:
+    """Map Gemini / limiter failures to the RuntimeError messages the endpoints surface."""
+    if isinstance(exc, (RateLimitTimeout, CircuitOpenError)):
+        return RuntimeError(str(exc))
+    error_msg = str(exc).lower()
+    if "rate" in error_msg or "quota" in error_msg or "429" in error_msg:
+        return RuntimeError(
+            "Quota/limite do Gemini excedido. Verifique billing/limites do projeto e tente novamente."
+        )
+    if "invalid" in error_msg and "api" in error_msg:
+        return RuntimeError(
+            "Chave da API Google inválida. Verifique GOOGLE_API_KEY no .env"
+        )
+    if "permission" in error_msg or "403" in error_msg:
+        return RuntimeError(
+            "Permissão negada pelo Gemini. Verifique se a API está habilitada."
+        )
+    return RuntimeError(f"Erro ao processar com Gemini: {str(exc)[:200]}")
+
+
 def enhance_document_with_gemini(
     title: str,
     steps: list[dict[str, Any]],
@@ -175,8 +263,6 @@ def enhance_document_with_gemini(
             "Dependência 'google-generativeai' não instalada. Execute: pip install google-generativeai"
         ) from exc
     
-    genai.configure(api_key=api_key)
-    
     # Normalizar nome do modelo
     normalized_model = model
     if not model.startswith("models/"):
@@ -186,18 +272,24 @@ def enhance_document_with_gemini(
     user_prompt = build_doc_pro_prompt(title, steps)
     
     try:
-        gen_model = genai.GenerativeModel(
-            model_name=normalized_model,
-            system_instruction=DOC_PRO_SYSTEM_PROMPT,
-        )
-        
-        response = gen_model.generate_content(
-            user_prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                max_output_tokens=8192,
-            ),
-        )
+        with gemini_client(api_key) as gemini:
+            gen_model = gemini.generative_model(
+                model_name=normalized_model,
+                system_instruction=DOC_PRO_SYSTEM_PROMPT,
+            )
+            
+            response = call_provider(
+                "gemini",
+                normalized_model,
+                api_key,
+                lambda: gen_model.generate_content(
+                    user_prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=0.7,
+                        max_output_tokens=8192,
+                    ),
+                ),
+            )
         
         result = response.text or ""
         
@@ -212,20 +304,63 @@ def enhance_document_with_gemini(
         return result
         
     except Exception as exc:
-        error_msg = str(exc).lower()
-        if "rate" in error_msg or "quota" in error_msg or "429" in error_msg:
-            raise RuntimeError(
-                "Quota/limite do Gemini excedido. Verifique billing/limites do projeto e tente novamente."
-            ) from exc
-        if "invalid" in error_msg and "api" in error_msg:
-            raise RuntimeError(
-                "Chave da API Google inválida. Verifique GOOGLE_API_KEY no .env"
-            ) from exc
-        if "permission" in error_msg or "403" in error_msg:
-            raise RuntimeError(
-                "Permissão negada pelo Gemini. Verifique se a API está habilitada."
-            ) from exc
-        raise RuntimeError(f"Erro ao processar com Gemini: {str(exc)[:200]}") from exc
+        raise _gemini_runtime_error(exc) from exc
+
+
+def stream_enhance_document_with_gemini(
+    title: str,
+    steps: list[dict[str, Any]],
+    api_key: str,
+    model: str = "models/gemini-2.5-flash",
+) -> Iterator[str]:
+    """
+    Versão em streaming de `enhance_document_with_gemini`.
+
+    Gera os trechos de Markdown à medida que o Gemini os produz (cercas
+    ```markdown removidas incrementalmente). Bloqueante: consumir fora do
+    event loop.
+    """
+    try:
+        import google.generativeai as genai
+    except ImportError as exc:
+        raise RuntimeError(
+            "Dependência 'google-generativeai' não instalada. Execute: pip install google-generativeai"
+        ) from exc
+
+    normalized_model = model if model.startswith("models/") else f"models/{model}"
+    user_prompt = build_doc_pro_prompt(title, steps)
+    stripper = MarkdownFenceStripper()
+
+    try:
+        with gemini_client(api_key) as gemini:
+            gen_model = gemini.generative_model(
+                model_name=normalized_model,
+                system_instruction=DOC_PRO_SYSTEM_PROMPT,
+            )
+            # The SDK fetches the first chunk eagerly, so limiter/breaker see the
+            # initial request (429s, time to first token); later chunks stream freely.
+            response = call_provider(
+                "gemini",
+                normalized_model,
+                api_key,
+                lambda: gen_model.generate_content(
+                    user_prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=0.7,
+                        max_output_tokens=8192,
+                    ),
+                    stream=True,
+                ),
+            )
+            for chunk in response:
+                piece = stripper.feed(getattr(chunk, "text", "") or "")
+                if piece:
+                    yield piece
+        rest = stripper.finish()
+        if rest:
+            yield rest
+    except Exception as exc:
+        raise _gemini_runtime_error(exc) from exc
 
 
 def build_enhancement_prompt(
@@ -359,11 +494,11 @@ def build_enhancement_prompt_with_images(
     # Construir conteúdo multimodal
     content: list[dict[str, Any]] = [{"type": "text", "text": base_prompt}]
     
-    for i, b64_img in enumerate(images_b64[:10]):  # Max 10 imagens
+    for url in vision_payload.data_urls_from_b64(images_b64[:10]):  # Max 10 imagens
         content.append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/png;base64,{b64_img}",
+                "url": url,
             },
         })
     
@@ -401,14 +536,12 @@ def enhance_document_with_groq(
         Documento Markdown estruturado
     """
     try:
-        from groq import Groq
+        import groq  # noqa: F401
     except ImportError as exc:
         raise RuntimeError(
             "Dependência 'groq' não instalada. Execute: pip install groq"
         ) from exc
     
-    client = Groq(api_key=api_key)
-    
     # Construir prompt
     if images_b64:
         _, content = build_enhancement_prompt_with_images(title, steps, images_b64)
@@ -418,12 +551,18 @@ def enhance_document_with_groq(
         messages = [{"role": "user", "content": prompt}]
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.7,
-            max_completion_tokens=8192,  # Documento longo
-        )
+        with groq_client(api_key) as client:
+            response = call_provider(
+                "groq",
+                model,
+                api_key,
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_completion_tokens=8192,  # Documento longo
+                ),
+            )
         
         result = response.choices[0].message.content or ""
         
@@ -437,6 +576,8 @@ def enhance_document_with_groq(
             
         return result
         
+    except (RateLimitTimeout, CircuitOpenError) as exc:
+        raise RuntimeError(str(exc)) from exc
     except Exception as exc:
         error_msg = str(exc).lower()
         if "rate" in error_msg or "limit" in error_msg or "429" in error_msg:
@@ -515,10 +656,10 @@ Retorne APENAS um objeto JSON válido seguindo EXATAMENTE esta estrutura:
 
 
 
-def _summarize_context_with_groq(text: str, client, model: str) -> str:
+def _summarize_context_with_groq(text: str, client, model: str, api_key: str) -> str:
     """Resume contexto técnico mantendo detalhes cruciais."""
     try:
-        completion = client.chat.completions.create(
+        completion = call_provider("groq", model, api_key, lambda: client.chat.completions.create(
             model=model,
             messages=[
                 {
@@ -532,12 +673,30 @@ def _summarize_context_with_groq(text: str, client, model: str) -> str:
             ],
             temperature=0.3, # Baixa temperatura para precisão
             max_tokens=4096
-        )
+        ))
         return completion.choices[0].message.content
     except Exception as e:
         print(f"Erro ao resumir contexto: {e}")
         return text[:25000] # Fallback: truncar
 
+def _tile_step_images(images_b64: list[str], steps: list[dict[str, Any]]) -> list[str]:
+    """Pack more than contact_sheet.MAX_IMAGES step images into labelled contact sheets."""
+    if len(images_b64) <= contact_sheet.MAX_IMAGES:
+        return images_b64
+    step_numbers = [n for n, step in enumerate(steps, 1) if step.get("has_image")]
+    if len(step_numbers) == len(images_b64):
+        labels = [f"Passo {n}" for n in step_numbers]
+    else:
+        labels = [f"Imagem {i}" for i in range(1, len(images_b64) + 1)]
+    try:
+        frames = [base64.b64decode(str(b64_img).split(",", 1)[-1]) for b64_img in images_b64]
+        sheets = contact_sheet.pack(frames, labels)
+    except Exception as exc:
+        logger.warning("contact sheets failed, sending the first images only: %s", exc)
+        return images_b64[: contact_sheet.MAX_IMAGES]
+    return [base64.b64encode(sheet).decode("ascii") for sheet in sheets]
+
+
 def generate_structured_documentation(
     title: str,
     steps: list[dict[str, Any]],
@@ -567,14 +726,12 @@ def generate_structured_documentation(
     import re
     
     try:
-        from groq import Groq
+        import groq  # noqa: F401
     except ImportError as exc:
         raise RuntimeError(
             "Dependência 'groq' não instalada. Execute: pip install groq"
         ) from exc
     
-    client = Groq(api_key=api_key)
-    
     # Formatar os passos para o prompt
     steps_text = ""
     for i, step in enumerate(steps, 1):
@@ -592,7 +749,8 @@ def generate_structured_documentation(
     MAX_CONTEXT_LENGTH = 25000  # Caracteres (~6k tokens)
     if len(steps_text) > MAX_CONTEXT_LENGTH:
         print(f"Contexto muito longo ({len(steps_text)} chars). Resumindo com IA...")
-        steps_text = _summarize_context_with_groq(steps_text, client, model)
+        with groq_client(api_key) as client:
+            steps_text = _summarize_context_with_groq(steps_text, client, model, api_key)
 
     user_prompt = f'''TÍTULO DO DOCUMENTO: {title}
 
@@ -614,12 +772,16 @@ Retorne APENAS o JSON válido:'''
 
     # Build message content
     if images_b64:
+        layout = contact_sheet.describe_layout(len(images_b64))
+        images_b64 = _tile_step_images(images_b64, steps)
+        if layout and len(images_b64) < len(steps):
+            user_prompt += "\n\n" + layout
         content: list[dict[str, Any]] = [{"type": "text", "text": user_prompt}]
-        for i, b64_img in enumerate(images_b64[:5]):  # Max 5 imagens
+        for url in vision_payload.data_urls_from_b64(images_b64[: contact_sheet.MAX_IMAGES]):
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/png;base64,{b64_img}",
+                    "url": url,
                 },
             })
         messages = [
@@ -633,12 +795,18 @@ Retorne APENAS o JSON válido:'''
         ]
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.5,  # Menor temperatura para JSON mais consistente
-            max_completion_tokens=8192,
-        )
+        with groq_client(api_key) as client:
+            response = call_provider(
+                "groq",
+                model,
+                api_key,
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.5,  # Menor temperatura para JSON mais consistente
+                    max_completion_tokens=8192,
+                ),
+            )
         
         result = response.choices[0].message.content or ""
         
@@ -705,6 +873,8 @@ Retorne APENAS o JSON válido:'''
                 "_raw_response": result  # Para debug
             }
             
+    except (RateLimitTimeout, CircuitOpenError) as exc:
+        raise RuntimeError(str(exc)) from exc
     except Exception as exc:
         error_msg = str(exc).lower()
         if "rate" in error_msg or "limit" in error_msg or "429" in error_msg:
@@ -735,25 +905,30 @@ def format_document_like_template(
         Markdown formatado (título, pré-requisitos, passos numerados, checklist, notas).
     """
     try:
-        from groq import Groq
+        import groq  # noqa: F401
     except ImportError as exc:
         raise RuntimeError(
             "Dependência 'groq' não instalada. Execute: pip install groq"
         ) from exc
 
-    client = Groq(api_key=api_key)
     messages = [
         {"role": "system", "content": TEMPLATE_SYSTEM_PROMPT},
         {"role": "user", "content": raw_text.strip() or "(Texto vazio.)"},
     ]
 
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.5,
-            max_completion_tokens=8192,
-        )
+        with groq_client(api_key) as client:
+            response = call_provider(
+                "groq",
+                model,
+                api_key,
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.5,
+                    max_completion_tokens=8192,
+                ),
+            )
         result = response.choices[0].message.content or ""
 
         # Limpar possíveis blocos de código markdown
@@ -766,6 +941,8 @@ def format_document_like_template(
 
         return result
 
+    except (RateLimitTimeout, CircuitOpenError) as exc:
+        raise RuntimeError(str(exc)) from exc
     except Exception as exc:
         error_msg = str(exc).lower()
         if "rate" in error_msg or "limit" in error_msg or "429" in error_msg:
@@ -0,0 +1,52 @@
+"""
+Environment readers shared by the backend modules (CLIPBUILDER_* settings).
+
+Each module reads its settings once at import time:
+
+    MAX_ENTRIES = env_int("CLIPBUILDER_RESULT_CACHE_MAX_ENTRIES", 5000)
+    ENABLED = env_flag("CLIPBUILDER_RESULT_CACHE", True)
+
+Empty or unparsable values fall back to the default, as do non-positive
+numbers unless `allow_negative=True`.
+"""
+
+from __future__ import annotations
+
+import os
+
+_TRUE = {"1", "true", "yes", "on"}
+_FALSE = {"0", "false", "no", "off"}
+
+
+def truthy(value: str | None) -> bool:
+    return (value or "").strip().lower() in _TRUE
+
+
+def env_flag(name: str, default: bool) -> bool:
+    """On-by-default flags are only turned off by 0/false/no/off, and vice versa."""
+    raw = (os.getenv(name) or "").strip().lower()
+    if not raw:
+        return default
+    return raw not in _FALSE if default else raw in _TRUE
+
+
+def env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+
+def env_float(name: str, default: float, *, allow_negative: bool = False) -> float:
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        return default
+    return value if allow_negative or value > 0 else default
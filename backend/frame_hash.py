@@ -0,0 +1,99 @@
+"""
+Perceptual hashes for sampled frames.
+
+Screen recordings are mostly static, so evenly spaced samples are often the
+same screenshot several times. Each frame is reduced to a 64-bit DCT
+perceptual hash (pHash): 32x32 grayscale -> 2D DCT -> the 8x8 lowest
+frequencies compared against their median. Frames whose hashes differ in only
+a few bits look the same to a person (and to a vision model), whatever the
+cursor or compression noise did.
+
+    hashes = phash(gray)                     # gray: (n, 32, 32) uint8/float array
+    keep = select_distinct(hashes, limit=5, anchor=2, min_distance=6)
+
+Everything is vectorized over the batch; hashing a few dozen frames costs
+well under a millisecond.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+
+from env_config import env_flag, env_int
+
+HASH_SIDE = 32  # input side expected by phash()
+_LOW_FREQ = 8  # 8x8 coefficients -> 64-bit hash
+
+
+DEDUP_ENABLED = env_flag("CLIPBUILDER_FRAME_DEDUP", True)
+# Frames within this many differing bits (of 64) count as the same screen.
+DEDUP_DISTANCE = env_int("CLIPBUILDER_FRAME_DEDUP_DISTANCE", 6)
+# Candidates hashed per requested frame, so duplicates can be swapped for frames that changed.
+OVERSAMPLE = env_int("CLIPBUILDER_FRAME_DEDUP_OVERSAMPLE", 3)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SIDE)
+
+
+def phash(gray: np.ndarray) -> np.ndarray:
+    """64-bit perceptual hashes (uint64, shape (n,)) of (n, 32, 32) grayscale frames."""
+    frames = np.asarray(gray, dtype=np.float64).reshape(-1, HASH_SIDE, HASH_SIDE)
+    coeffs = _DCT @ frames @ _DCT.T  # batched 2D DCT
+    low = coeffs[:, :_LOW_FREQ, :_LOW_FREQ].reshape(len(frames), -1)
+    # Median without the DC term, which only tracks overall brightness.
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def phash_images(images: list[Any]) -> np.ndarray:
+    """Hash PIL images (any mode/size)."""
+    from PIL import Image
+
+    if not images:
+        return np.zeros(0, dtype=np.uint64)
+    gray = np.stack(
+        [np.asarray(image.convert("L").resize((HASH_SIDE, HASH_SIDE), Image.Resampling.BILINEAR)) for image in images]
+    )
+    return phash(gray)
+
+
+def distance_matrix(a: np.ndarray, b: np.ndarray | None = None) -> np.ndarray:
+    """Pairwise Hamming distances (bits) between two hash vectors."""
+    a = np.asarray(a, dtype=np.uint64)
+    b = a if b is None else np.asarray(b, dtype=np.uint64)
+    xor = a[:, None] ^ b[None, :]
+    return np.unpackbits(xor.view(np.uint8).reshape(*xor.shape, 8), axis=-1).sum(axis=-1)
+
+
+def select_distinct(hashes: np.ndarray, *, limit: int, anchor: int | None = None, min_distance: int) -> list[int]:
+    """Indices (sorted) of up to `limit` frames that are visibly different from each other.
+
+    Starts from `anchor` (the frame the caller cares most about) and greedily
+    adds the frame farthest from everything selected so far, stopping once
+    every remaining frame is within `min_distance` bits of a selected one. A
+    static screen therefore yields a single frame.
+    """
+    count = len(hashes)
+    if count == 0 or limit <= 0:
+        return []
+    distances = distance_matrix(hashes)
+    first = anchor if anchor is not None and 0 <= anchor < count else 0
+    selected = [first]
+    nearest = distances[first].astype(np.int64)
+    while len(selected) < min(limit, count):
+        candidate = int(np.argmax(nearest))
+        if nearest[candidate] <= min_distance:
+            break
+        selected.append(candidate)
+        nearest = np.minimum(nearest, distances[candidate])
+    return sorted(selected)
@@ -0,0 +1,149 @@
+"""
+Hedged smart-text requests across providers.
+
+A few smart-text calls take far longer than the rest (slow clip upload, a
+Gemini file stuck in PROCESSING, a cold model). When hedging is enabled and
+the primary provider has not answered after its usual latency (a percentile
+of recent successful calls), the same request is started on the other
+provider; whichever answers first wins and the other is cancelled.
+
+    text, hedged = await race(primary, secondary, delay=hedge_delay("gemini", model))
+
+Latencies are tracked per (provider, model), end to end (clip/frames
+extraction included), since that is what the user waits for.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+import anyio
+
+from env_config import env_flag, env_float
+
+logger = logging.getLogger("clipbuilder.hedging")
+
+
+HEDGE_BY_DEFAULT = env_flag("CLIPBUILDER_SMART_TEXT_HEDGE", False)
+HEDGE_PERCENTILE = min(99.9, env_float("CLIPBUILDER_HEDGE_PERCENTILE", 95.0))
+# Used until enough samples exist for a meaningful percentile.
+HEDGE_DEFAULT_DELAY_SECONDS = env_float("CLIPBUILDER_HEDGE_DEFAULT_DELAY_SECONDS", 30.0)
+HEDGE_MIN_DELAY_SECONDS = env_float("CLIPBUILDER_HEDGE_MIN_DELAY_SECONDS", 5.0)
+HEDGE_MAX_DELAY_SECONDS = env_float("CLIPBUILDER_HEDGE_MAX_DELAY_SECONDS", 120.0)
+MIN_SAMPLES = 10
+MAX_SAMPLES = 200
+
+
+class LatencyTracker:
+    """Recent successful latencies per (provider, model)."""
+
+    def __init__(self, max_samples: int = MAX_SAMPLES) -> None:
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples: dict[tuple[str, str], deque[float]] = {}
+
+    def record(self, provider: str, model: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get((provider, model))
+            if samples is None:
+                samples = deque(maxlen=self.max_samples)
+                self._samples[(provider, model)] = samples
+            samples.append(max(0.0, seconds))
+
+    def percentile(self, provider: str, model: str, pct: float) -> float | None:
+        """Nearest-rank percentile, or None with fewer than MIN_SAMPLES samples."""
+        with self._lock:
+            samples = sorted(self._samples.get((provider, model)) or ())
+        if len(samples) < MIN_SAMPLES:
+            return None
+        rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+        return samples[rank - 1]
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            keys = list(self._samples)
+        out: list[dict[str, Any]] = []
+        for provider, model in keys:
+            with self._lock:
+                count = len(self._samples[(provider, model)])
+            p50 = self.percentile(provider, model, 50.0)
+            p95 = self.percentile(provider, model, 95.0)
+            out.append(
+                {
+                    "provider": provider,
+                    "model": model,
+                    "samples": count,
+                    "p50_seconds": round(p50, 2) if p50 is not None else None,
+                    "p95_seconds": round(p95, 2) if p95 is not None else None,
+                    "hedge_delay_seconds": round(hedge_delay(provider, model), 2),
+                }
+            )
+        return out
+
+
+latencies = LatencyTracker()
+
+
+def hedge_delay(provider: str, model: str) -> float:
+    """How long to wait on the primary before starting the hedge."""
+    observed = latencies.percentile(provider, model, HEDGE_PERCENTILE)
+    delay = HEDGE_DEFAULT_DELAY_SECONDS if observed is None else observed
+    return min(HEDGE_MAX_DELAY_SECONDS, max(HEDGE_MIN_DELAY_SECONDS, delay))
+
+
+async def race(
+    primary: Callable[[], Awaitable[str]],
+    secondary: Callable[[], Awaitable[str]],
+    *,
+    delay: float,
+) -> tuple[str, bool]:
+    """Run `primary`; start `secondary` after `delay` (or as soon as primary fails).
+
+    Returns (text, hedged) where hedged is True when the secondary answered
+    first. The loser is cancelled. If both fail, the primary's error is raised.
+    """
+    outcome: dict[str, Any] = {}
+    errors: dict[str, BaseException] = {}
+    state = {"secondary_started": False, "pending": 1}
+
+    async with anyio.create_task_group() as tg:
+
+        def start_secondary() -> None:
+            if state["secondary_started"]:
+                return
+            state["secondary_started"] = True
+            state["pending"] += 1
+            tg.start_soon(attempt, "secondary", secondary)
+
+        async def attempt(name: str, fn: Callable[[], Awaitable[str]]) -> None:
+            try:
+                text = await fn()
+            except Exception as exc:
+                errors[name] = exc
+                state["pending"] -= 1
+                if name == "primary" and not state["secondary_started"]:
+                    logger.info("hedge: primary failed (%s), starting secondary now", exc.__class__.__name__)
+                    start_secondary()
+                elif state["pending"] <= 0:
+                    tg.cancel_scope.cancel()
+                return
+            outcome.setdefault("text", text)
+            outcome.setdefault("hedged", name == "secondary")
+            tg.cancel_scope.cancel()
+
+        async def timer() -> None:
+            await anyio.sleep(delay)
+            if not state["secondary_started"]:
+                logger.info("hedge: primary slower than %.1fs, starting secondary", delay)
+                start_secondary()
+
+        tg.start_soon(attempt, "primary", primary)
+        tg.start_soon(timer)
+
+    if "text" in outcome:
+        return outcome["text"], outcome["hedged"]
+    raise errors.get("primary") or errors["secondary"]
@@ -0,0 +1,124 @@
+"""
+Server-side API key pools for Gemini and Groq.
+
+A single key caps throughput at one project's quota. Configure several keys
+per provider and requests are spread across them with smooth weighted
+round-robin; keys that were just throttled (429 / quota exhausted, as seen by
+`rate_limiter`) are skipped until their cooldown ends.
+
+    GOOGLE_API_KEYS=key-a,key-b:2      # ":2" = weight (default 1)
+    GROQ_API_KEYS=gsk-1,gsk-2
+
+The single-key variables (GOOGLE_API_KEY / GROQ_API_KEY) still work and are
+merged into the pool.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+from provider_clients import key_fingerprint
+from rate_limiter import limiter
+
+logger = logging.getLogger("clipbuilder.key_pool")
+
+
+@dataclass
+class _PoolKey:
+    api_key: str
+    weight: int
+    current: int = 0  # smooth WRR state
+    picks: int = 0
+
+
+def parse_keys(*raw_values: str | None) -> list[tuple[str, int]]:
+    """Parse "key[:weight],key2" lists; duplicates are dropped, order kept."""
+    out: list[tuple[str, int]] = []
+    seen: set[str] = set()
+    for raw in raw_values:
+        for item in (raw or "").replace("\n", ",").split(","):
+            item = item.strip()
+            if not item:
+                continue
+            key, weight = item, 1
+            head, sep, tail = item.rpartition(":")
+            if sep and tail.isdigit() and head:
+                key, weight = head.strip(), max(1, int(tail))
+            if key and key not in seen:
+                seen.add(key)
+                out.append((key, weight))
+    return out
+
+
+class KeyPool:
+    """Weighted round-robin over one provider's keys, skipping keys in cooldown."""
+
+    def __init__(self, provider: str, keys: list[tuple[str, int]]) -> None:
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._keys = [_PoolKey(api_key=k, weight=w) for k, w in keys]
+
+    def __bool__(self) -> bool:
+        return bool(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def pick(self) -> str | None:
+        """Next key by smooth WRR among healthy keys (or the one recovering soonest)."""
+        if not self._keys:
+            return None
+        cooldowns = {k.api_key: limiter.cooldown_remaining(self.provider, k.api_key) for k in self._keys}
+        with self._lock:
+            healthy = [k for k in self._keys if cooldowns[k.api_key] <= 0]
+            if not healthy:
+                chosen = min(self._keys, key=lambda k: cooldowns[k.api_key])
+                chosen.picks += 1
+                return chosen.api_key
+            total = sum(k.weight for k in healthy)
+            for k in healthy:
+                k.current += k.weight
+            chosen = max(healthy, key=lambda k: k.current)
+            chosen.current -= total
+            chosen.picks += 1
+            return chosen.api_key
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            keys = [(k.api_key, k.weight, k.picks) for k in self._keys]
+        out: list[dict[str, Any]] = []
+        for api_key, weight, picks in keys:
+            cooldown = limiter.cooldown_remaining(self.provider, api_key)
+            out.append(
+                {
+                    "key": key_fingerprint(api_key),
+                    "weight": weight,
+                    "picks": picks,
+                    "healthy": cooldown <= 0,
+                    "cooldown_seconds": round(cooldown, 1),
+                }
+            )
+        return out
+
+
+pools: dict[str, KeyPool] = {
+    "gemini": KeyPool("gemini", parse_keys(os.getenv("GOOGLE_API_KEYS"), os.getenv("GOOGLE_API_KEY"))),
+    "groq": KeyPool("groq", parse_keys(os.getenv("GROQ_API_KEYS"), os.getenv("GROQ_API_KEY"))),
+}
+for _provider, _pool in pools.items():
+    if len(_pool) > 1:
+        logger.info("config: %s key pool with %s keys", _provider, len(_pool))
+
+
+def pick_key(provider: str) -> str | None:
+    """Server-side key for `provider`, or None when no server keys are configured."""
+    pool = pools.get(provider)
+    return pool.pick() if pool else None
+
+
+def snapshot() -> dict[str, list[dict[str, Any]]]:
+    return {provider: pool.snapshot() for provider, pool in pools.items()}
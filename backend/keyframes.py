@@ -0,0 +1,94 @@
+"""
+Motion-aware keyframe selection for short UI recordings (GIF steps, video ranges).
+
+Consecutive small grayscale frames are differenced; the frames kept are the
+first and last, and where each burst of change starts, peaks and settles.
+Frames held for HOLD_MS or more also end a burst.
+
+    indices = select(gray, limit=5, durations_ms=durations)   # gray: (n, h, w) uint8 -> sorted indices
+"""
+
+from __future__ import annotations
+
+
+import numpy as np
+
+from env_config import env_flag, env_float
+
+
+MOTION_ENABLED = env_flag("CLIPBUILDER_GIF_MOTION", True)
+# A transition is "motion" when at least this fraction of pixels changed noticeably.
+MOTION_THRESHOLD = env_float("CLIPBUILDER_GIF_MOTION_THRESHOLD", 0.002)
+ANALYSIS_WIDTH = 96
+MAX_ANALYSIS_FRAMES = 600  # longer GIFs are analysed on an evenly strided subset
+_PIXEL_DELTA = 12  # luminance levels; ignores GIF dithering noise
+HOLD_MS = 400
+
+
+def analysis_positions(frame_count: int, max_frames: int = MAX_ANALYSIS_FRAMES) -> list[int]:
+    """Frame indices to analyse: all of them, or an even subset of `max_frames`."""
+    if frame_count <= max_frames:
+        return list(range(frame_count))
+    return sorted({int(round(i)) for i in np.linspace(0, frame_count - 1, max_frames)})
+
+
+def motion_energy(gray: np.ndarray) -> np.ndarray:
+    """Fraction of changed pixels between consecutive frames: shape (n - 1,)."""
+    frames = np.asarray(gray, dtype=np.int16)
+    if len(frames) < 2:
+        return np.zeros(0, dtype=np.float32)
+    changed = np.abs(np.diff(frames, axis=0)) > _PIXEL_DELTA
+    return changed.reshape(len(frames) - 1, -1).mean(axis=1).astype(np.float32)
+
+
+def _bursts(active: np.ndarray) -> list[tuple[int, int]]:
+    """[(first, last)] transition indices of each run of consecutive active transitions."""
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _split_at_holds(bursts: list[tuple[int, int]], held: np.ndarray) -> list[tuple[int, int]]:
+    out: list[tuple[int, int]] = []
+    for first, last in bursts:
+        for frame in range(first + 1, last + 1):
+            if held[frame]:  # the screen paused on this frame: the change before it is complete
+                out.append((first, frame - 1))
+                first = frame
+        out.append((first, last))
+    return out
+
+
+def select(
+    gray: np.ndarray,
+    *,
+    limit: int,
+    durations_ms: list[float] | None = None,
+    threshold: float = MOTION_THRESHOLD,
+) -> list[int]:
+    """Up to `limit` keyframe indices (into `gray`), in order."""
+    n = len(gray)
+    if n <= 1 or limit <= 1:
+        return [0][: max(1, min(n, limit))]
+    energy = motion_energy(gray)
+    bursts = _bursts(energy >= threshold)
+    if durations_ms is not None and len(durations_ms) == n:
+        bursts = _split_at_holds(bursts, np.asarray(durations_ms, dtype=np.float32) >= HOLD_MS)
+    if not bursts:
+        return [0]
+
+    # Strongest bursts first when there are more than the limit can cover.
+    bursts.sort(key=lambda b: float(energy[b[0] : b[1] + 1].sum()), reverse=True)
+    ranked: list[int] = [0, n - 1]
+    ranked += [last + 1 for _first, last in bursts]  # settled state after each burst
+    ranked += [first + int(np.argmax(energy[first : last + 1])) + 1 for first, last in bursts]  # peak
+    ranked += [first for first, _last in bursts]  # just before the change
+
+    chosen: list[int] = []
+    for index in ranked:
+        if index not in chosen:
+            chosen.append(index)
+        if len(chosen) >= limit:
+            break
+    return sorted(chosen)
@@ -5,7 +5,10 @@ import json
 import logging
 import logging.handlers
 import os
+import re
 import base64
+import hashlib
+import inspect
 import shutil
 import subprocess
 import sys
@@ -14,13 +17,16 @@ import threading
 import time
 import uuid
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from errno import ENOSPC
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator, Iterator
 from urllib.parse import urlparse
 
 import anyio
+import numpy as np
 from fastapi import BackgroundTasks, Depends, FastAPI, File, Form, Header, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, StreamingResponse
@@ -41,6 +47,29 @@ try:
 except Exception:
     pass
 
+# These modules read their CLIPBUILDER_* settings at import time, so import after .env is loaded.
+import audio_codec  # noqa: E402
+import caption_reuse  # noqa: E402
+import contact_sheet  # noqa: E402
+import frame_hash  # noqa: E402
+import hedging  # noqa: E402
+import key_pool  # noqa: E402
+import keyframes  # noqa: E402
+import result_cache  # noqa: E402
+import scene_index  # noqa: E402
+import step_render  # noqa: E402
+import transcript  # noqa: E402
+import vad  # noqa: E402
+import vision_payload  # noqa: E402
+from circuit_breaker import CircuitOpenError, breakers, call_provider  # noqa: E402
+from env_config import env_flag, env_int  # noqa: E402
+from provider_clients import gemini_client, groq_client  # noqa: E402
+from provider_clients import registry as provider_registry  # noqa: E402
+from rate_limiter import RateLimitTimeout, parse_retry_seconds  # noqa: E402
+from rate_limiter import limiter as provider_limits  # noqa: E402
+from warmup import budget as warmup_budget  # noqa: E402
+import warmup  # noqa: E402
+
 
 LOG_DIR = Path(os.getenv("CLIPBUILDER_LOG_DIR", Path(__file__).resolve().parent / "logs"))
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -93,7 +122,11 @@ def _http_exception_handler(_request: Request, exc: StarletteHTTPException):
         logger.error("http error %s: %s", exc.status_code, exc.detail, exc_info=True)
     elif exc.status_code >= 400:
         logger.warning("http %s: %s", exc.status_code, exc.detail)
-    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None),
+    )
 
 
 def _unhandled_exception_handler(_request: Request, exc: Exception):
@@ -103,26 +136,16 @@ def _unhandled_exception_handler(_request: Request, exc: Exception):
 
 MAX_TOTAL_IMAGE_BYTES = 50 * 1024 * 1024  # 50MB
 MAX_SINGLE_IMAGE_BYTES = 15 * 1024 * 1024  # 15MB
+MAX_GIF_BYTES = 20 * 1024 * 1024  # 20MB
 
 
-def _env_int(name: str, default: int) -> int:
-    raw = (os.getenv(name) or "").strip()
-    if not raw:
-        return default
-    try:
-        value = int(raw)
-    except ValueError:
-        return default
-    return value if value > 0 else default
-
-
-MAX_VIDEO_BYTES = _env_int("CLIPBUILDER_MAX_VIDEO_BYTES", 700 * 1024 * 1024)  # default 700MB
+MAX_VIDEO_BYTES = env_int("CLIPBUILDER_MAX_VIDEO_BYTES", 700 * 1024 * 1024)  # default 700MB
 MAX_VIDEO_MB = max(1, int(MAX_VIDEO_BYTES / (1024 * 1024)))
 
 logger.info("config: CLIPBUILDER_MAX_VIDEO_BYTES=%s (~%s MB)", MAX_VIDEO_BYTES, MAX_VIDEO_MB)
 
-GEMINI_CLIP_SECONDS = _env_int("CLIPBUILDER_GEMINI_CLIP_SECONDS", 90)
-GEMINI_PROXY_HEIGHT = _env_int("CLIPBUILDER_GEMINI_PROXY_HEIGHT", 720)
+GEMINI_CLIP_SECONDS = env_int("CLIPBUILDER_GEMINI_CLIP_SECONDS", 90)
+GEMINI_PROXY_HEIGHT = env_int("CLIPBUILDER_GEMINI_PROXY_HEIGHT", 720)
 
 DEFAULT_GEMINI_MODEL = os.getenv("CLIPBUILDER_GEMINI_MODEL", "models/gemini-2.5-flash")
 GEMINI_POLL_TIMEOUT_SECONDS = 300
@@ -130,11 +153,27 @@ GEMINI_POLL_INTERVAL_SECONDS = 2
 
 AI_LANGUAGE = (os.getenv("CLIPBUILDER_AI_LANGUAGE") or "pt-BR").strip() or "pt-BR"
 
-# Groq API configuration (Llama 4 Vision + Whisper Turbo)
-GROQ_API_KEY = (os.getenv("GROQ_API_KEY") or "").strip()
+# Batch smart-text: concurrent provider calls per batch request and max timestamps per batch.
+SMART_TEXT_BATCH_CONCURRENCY = env_int("CLIPBUILDER_SMART_TEXT_BATCH_CONCURRENCY", 4)
+SMART_TEXT_BATCH_MAX_ITEMS = env_int("CLIPBUILDER_SMART_TEXT_BATCH_MAX_ITEMS", 200)
+# "per_tile" batch mode: max timestamps captioned by one Gemini call.
+SMART_TEXT_TILE_MAX_STEPS = env_int("CLIPBUILDER_SMART_TEXT_TILE_MAX_STEPS", 12)
+
+# Background pre-captioning of detected step candidates (opt-in).
+PRECAPTION_ON_INGEST = env_flag("CLIPBUILDER_PRECAPTION_ON_INGEST", False)
+PRECAPTION_MAX_STEPS = env_int("CLIPBUILDER_PRECAPTION_MAX_STEPS", 20)
+PRECAPTION_CALLS_PER_HOUR = env_int("CLIPBUILDER_PRECAPTION_CALLS_PER_HOUR", 60)
+PRECAPTION_IDLE_SECONDS = env_int("CLIPBUILDER_PRECAPTION_IDLE_SECONDS", 900)
+PRECAPTION_MATCH_SECONDS = env_int("CLIPBUILDER_PRECAPTION_MATCH_SECONDS", 3)
+STEP_MIN_GAP_SECONDS = env_int("CLIPBUILDER_STEP_MIN_GAP_SECONDS", 8)
+
+# Groq API configuration (Llama 4 Vision + Whisper Turbo). Keys: GROQ_API_KEY / GROQ_API_KEYS (see key_pool).
 DEFAULT_GROQ_VISION_MODEL = os.getenv("CLIPBUILDER_GROQ_VISION_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
 DEFAULT_GROQ_WHISPER_MODEL = os.getenv("CLIPBUILDER_GROQ_WHISPER_MODEL", "whisper-large-v3-turbo")
-GROQ_FRAME_COUNT = _env_int("CLIPBUILDER_GROQ_FRAME_COUNT", 5)  # Max 5 images per Groq request
+# Moments sampled per Groq request; beyond 5 (Groq's image cap) they are tiled into contact sheets.
+GROQ_FRAME_COUNT = env_int("CLIPBUILDER_GROQ_FRAME_COUNT", 16)
+# Upper bound for a GIF or video-range step (one short action); the motion keyframes pick within it.
+GIF_FRAME_COUNT = env_int("CLIPBUILDER_GIF_FRAME_COUNT", 5)
 
 YTDLP_COOKIES_FILE = (os.getenv("CLIPBUILDER_YTDLP_COOKIES_FILE") or "").strip()
 YTDLP_COOKIES_FROM_BROWSER = (os.getenv("CLIPBUILDER_YTDLP_COOKIES_FROM_BROWSER") or "").strip()
@@ -162,16 +201,30 @@ app.add_middleware(
 class VideoEntry:
     path: Path
     status: str  # ready|error
-    clip_cache: dict[str, str] = field(default_factory=dict)  # key -> gemini_file_name
+    # key -> (gemini_file_name, api_key that uploaded it; files are scoped to that key's project)
+    clip_cache: dict[str, tuple[str, str]] = field(default_factory=dict)
     error: str | None = None
+    last_access: float = field(default_factory=time.monotonic)
+    # caption options key -> {candidate seconds: caption} filled by background pre-captioning
+    precaptions: dict[str, dict[float, str]] = field(default_factory=dict)
+    precaption_status: str | None = None  # running|done|stopped|error
+    scenes: scene_index.SceneIndex | None = None  # local scene-change index, built on first step detection
+    transcript_status: str | None = None  # running|done|partial|error (whole-video transcript sidecar)
 
 
 DATA_DIR = Path(os.getenv("CLIPBUILDER_DATA_DIR", Path(__file__).resolve().parent / "data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# Exact-match AI results keyed by content hash + options; survives restarts (see result_cache.py).
+result_store = result_cache.ResultCache(
+    DATA_DIR / "result_cache.sqlite3",
+    ttl_seconds=result_cache.TTL_SECONDS,
+    max_entries=result_cache.MAX_ENTRIES,
+)
 logger.info("config: CLIPBUILDER_DATA_DIR=%s", DATA_DIR)
 
 # Maximum number of video files to keep in DATA_DIR (oldest files are removed when exceeded)
-MAX_DATA_FILES = _env_int("CLIPBUILDER_MAX_DATA_FILES", 5)
+MAX_DATA_FILES = env_int("CLIPBUILDER_MAX_DATA_FILES", 5)
 logger.info("config: CLIPBUILDER_MAX_DATA_FILES=%s", MAX_DATA_FILES)
 
 _videos_lock = threading.Lock()
@@ -207,6 +260,12 @@ def _cleanup_old_files() -> None:
                 with _videos_lock:
                     if video_id in _videos:
                         del _videos[video_id]
+                warmup_budget.forget_video(video_id)
+                caption_reuse.cache.forget_video(video_id)
+                scene_index.forget(file_to_delete)
+                transcript.remove(file_to_delete)
+                step_render.remove_all(file_to_delete)
+                audio_codec.remove_track(file_to_delete)
                 
                 file_to_delete.unlink()
                 logger.info("cleanup: removed old video file %s", file_to_delete.name)
@@ -233,46 +292,94 @@ def _restore_video_entry_if_missing(video_id: str) -> VideoEntry | None:
             continue
     return None
 
-def _configure_genai(api_key: str) -> None:
+def _gemini_client(api_key: str):
+    """Lease the pooled Gemini client for this key (isolated from other keys)."""
     try:
-        import google.generativeai as genai
+        import google.generativeai  # noqa: F401
     except Exception as exc:
         raise HTTPException(
             status_code=500,
             detail="Dependência 'google-generativeai' não instalada no backend.",
         ) from exc
 
-    genai.configure(api_key=api_key)
+    return gemini_client(api_key)
 
 
-def _get_api_key(x_google_api_key: str | None) -> str:
-    api_key = (os.getenv("GOOGLE_API_KEY") or "").strip() or (x_google_api_key or "").strip()
-    if not api_key:
+def _check_api_key(x_google_api_key: str | None) -> None:
+    """Fail fast when no Gemini key is available, without consuming a pool pick."""
+    if not key_pool.pools["gemini"] and not (x_google_api_key or "").strip():
         raise HTTPException(
             status_code=400,
             detail="GOOGLE_API_KEY não configurada. Defina no backend (.env) ou envie no header X-Google-Api-Key.",
         )
-    return api_key
+
+
+def _get_api_key(x_google_api_key: str | None) -> str:
+    # Server-side keys (GOOGLE_API_KEY / GOOGLE_API_KEYS) take precedence over the header.
+    _check_api_key(x_google_api_key)
+    return key_pool.pick_key("gemini") or (x_google_api_key or "").strip()
+
+
+def _provider_unavailable(exc: CircuitOpenError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(exc),
+        headers={"Retry-After": str(int(round(exc.retry_after)))},
+    )
+
+
+# anyio >= 4.1 renamed `cancellable` to `abandon_on_cancel`.
+_ABANDON_KWARG = (
+    "abandon_on_cancel" if "abandon_on_cancel" in inspect.signature(anyio.to_thread.run_sync).parameters else "cancellable"
+)
+
+
+async def _run_abandonable(fn: Any, cancel_event: threading.Event | None = None) -> Any:
+    """Run blocking `fn` in a worker thread without blocking cancellation of the caller.
+
+    On cancellation the thread is abandoned (its result discarded) and
+    `cancel_event` is set so the work can stop before its next provider call.
+    """
+    try:
+        return await anyio.to_thread.run_sync(fn, **{_ABANDON_KWARG: True})
+    except anyio.get_cancelled_exc_class():
+        if cancel_event is not None:
+            cancel_event.set()
+        raise
+
+
+def _raise_if_cancelled(cancel_event: threading.Event | None) -> None:
+    if cancel_event is not None and cancel_event.is_set():
+        raise RuntimeError("Requisição cancelada (outro provedor respondeu primeiro)")
+
+
+async def _iterate_in_thread(make_iterator: Any) -> AsyncIterator[Any]:
+    """Drive a blocking iterator (e.g. a provider token stream) from worker threads."""
+    done = object()
+    iterator = await _run_abandonable(lambda: iter(make_iterator()))
+    while True:
+        item = await _run_abandonable(lambda: next(iterator, done))
+        if item is done:
+            return
+        yield item
 
 
 def _upload_video_to_gemini(video_path: Path, api_key: str) -> str:
-    _configure_genai(api_key)
-    import google.generativeai as genai
-
-    uploaded = genai.upload_file(path=str(video_path))
-    file_name = getattr(uploaded, "name", None)
-    if not file_name:
-        raise RuntimeError("Falha ao fazer upload do vídeo para o Gemini")
-
-    deadline = time.time() + GEMINI_POLL_TIMEOUT_SECONDS
-    while time.time() < deadline:
-        current = genai.get_file(file_name)
-        state = getattr(getattr(current, "state", None), "name", None) or str(getattr(current, "state", ""))
-        if state == "ACTIVE":
-            return file_name
-        if state in {"FAILED", "ERROR"}:
-            raise RuntimeError("Gemini falhou ao processar o arquivo de vídeo")
-        time.sleep(GEMINI_POLL_INTERVAL_SECONDS)
+    with _gemini_client(api_key) as gemini:
+        uploaded = call_provider("gemini", "files", api_key, lambda: gemini.upload_file(video_path))
+        file_name = getattr(uploaded, "name", None)
+        if not file_name:
+            raise RuntimeError("Falha ao fazer upload do vídeo para o Gemini")
+
+        deadline = time.time() + GEMINI_POLL_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            current = gemini.get_file(file_name)
+            state = getattr(getattr(current, "state", None), "name", None) or str(getattr(current, "state", ""))
+            if state == "ACTIVE":
+                return file_name
+            if state in {"FAILED", "ERROR"}:
+                raise RuntimeError("Gemini falhou ao processar o arquivo de vídeo")
+            time.sleep(GEMINI_POLL_INTERVAL_SECONDS)
 
     raise RuntimeError("Timeout aguardando o Gemini processar o arquivo (ACTIVE)")
 
@@ -502,24 +609,35 @@ def _make_gemini_clip(*, source_path: Path, timestamp_seconds: float, clip_secon
     return start, duration
 
 
-def _describe_at_timestamp(*, gemini_file_name: str, timestamp: str, clip_seconds: int, api_key: str, model_name: str, user_prompt: str | None = None, include_timestamp: bool = True) -> str:
-    _configure_genai(api_key)
-    import google.generativeai as genai
-    from google.api_core import exceptions as gexc  # type: ignore
-
+def _normalize_gemini_model(model_name: str | None) -> str:
     # Accept either "gemini-2.0-flash" or "models/gemini-2.0-flash".
-    normalized_model = (model_name or "").strip()
-    if normalized_model and not normalized_model.startswith("models/"):
-        normalized_model = f"models/{normalized_model}"
+    normalized = (model_name or "").strip()
+    if normalized and not normalized.startswith("models/"):
+        normalized = f"models/{normalized}"
+    return normalized or DEFAULT_GEMINI_MODEL
+
 
-    file_ref = genai.get_file(gemini_file_name)
+# Persona and output rules shared by the single- and multi-timestamp Gemini caption prompts.
+_CAPTION_SYSTEM_INSTRUCTION = (
+    f"Você é um especialista em Documentação Técnica de Software. "
+    f"Seu objetivo é criar tutoriais passo a passo claros e diretos. "
+    f"Responda sempre em português do Brasil (pt-BR). Idioma preferido: {AI_LANGUAGE}."
+)
+_CAPTION_OUTPUT_RULES = (
+    "1. Identifique a ação macro (ex: 'Cadastrando um novo usuário').\n"
+    "2. Gere APENAS os passos imperativos necessários para realizar essa ação.\n"
+    "3. Ignore movimentos de mouse erráticos ou tentativas falhas.\n"
+    "4. Não use narração (ex: 'O usuário clica...'). Use imperativo (ex: 'Clique em Salvar').\n"
+    "5. Seja conciso (3 a 10 passos).\n"
+    "6. Evite detalhes técnicos visuais (coordenadas X/Y, posições específicas como 'célula A1') a menos que cruciais.\n"
+    "7. Não mencione 'vídeo', 'clipe', 'cena', 'tela', 'o usuário' ou 'o mouse'.\n"
+    "8. Foque nos comandos, menus e opções relevantes para reproduzir o processo."
+)
 
+
+def _timestamp_prompt(*, timestamp: str, user_prompt: str | None = None, include_timestamp: bool = True, clip_start_seconds: float | None = None) -> str:
     # 1. Instrução de Sistema / Persona
-    system_instruction = (
-        f"Você é um especialista em Documentação Técnica de Software. "
-        f"Seu objetivo é criar tutoriais passo a passo claros e diretos. "
-        f"Responda sempre em português do Brasil (pt-BR). Idioma preferido: {AI_LANGUAGE}."
-    )
+    system_instruction = _CAPTION_SYSTEM_INSTRUCTION
 
     # 2. Definição de Contexto Temporal (análise expandida)
     time_instruction = (
@@ -531,17 +649,7 @@ def _describe_at_timestamp(*, gemini_file_name: str, timestamp: str, clip_second
     )
 
     # 3. Regras de Formatação e Estilo
-    formatting_instruction = (
-        "REGRAS DE SAÍDA:\n"
-        "1. Identifique a ação macro (ex: 'Cadastrando um novo usuário').\n"
-        "2. Gere APENAS os passos imperativos necessários para realizar essa ação.\n"
-        "3. Ignore movimentos de mouse erráticos ou tentativas falhas.\n"
-        "4. Não use narração (ex: 'O usuário clica...'). Use imperativo (ex: 'Clique em Salvar').\n"
-        "5. Seja conciso (3 a 10 passos).\n"
-        "6. Evite detalhes técnicos visuais (coordenadas X/Y, posições específicas como 'célula A1') a menos que cruciais.\n"
-        "7. Não mencione 'vídeo', 'clipe', 'cena', 'tela', 'o usuário' ou 'o mouse'.\n"
-        "8. Foque nos comandos, menus e opções relevantes para reproduzir o processo."
-    )
+    formatting_instruction = "REGRAS DE SAÍDA:\n" + _CAPTION_OUTPUT_RULES
 
     base_parts: list[str] = [
         system_instruction,
@@ -549,6 +657,17 @@ def _describe_at_timestamp(*, gemini_file_name: str, timestamp: str, clip_second
         formatting_instruction,
     ]
 
+    if clip_start_seconds is not None:
+        # Shared clip tiles are not centered on the timestamp: tell the model where to look.
+        try:
+            offset = max(0.0, _parse_timestamp_to_seconds(timestamp) - float(clip_start_seconds))
+            base_parts.append(
+                f"Este clipe começa em {_format_timestamp(float(clip_start_seconds))} do vídeo original; "
+                f"o momento {timestamp} aparece em {_format_timestamp(offset)} do clipe."
+            )
+        except ValueError:
+            pass
+
     if include_timestamp:
         base_parts.append(f"O procedimento ocorre especificamente ao redor de {timestamp}.")
     else:
@@ -557,39 +676,24 @@ def _describe_at_timestamp(*, gemini_file_name: str, timestamp: str, clip_second
     base = "\n\n".join(base_parts)
 
     if user_prompt and str(user_prompt).strip():
-        prompt = base + "\n\n" + "Contexto extra do usuário (se aplicável):\n" + str(user_prompt).strip()
-    else:
-        prompt = base
+        return base + "\n\n" + "Contexto extra do usuário (se aplicável):\n" + str(user_prompt).strip()
+    return base
 
-    model = genai.GenerativeModel(normalized_model or DEFAULT_GEMINI_MODEL)
 
-    def _extract_retry_seconds(message: str) -> float | None:
-        # Example: "Please retry in 13.644857575s."
-        import re
-
-        m = re.search(r"retry in\s+([0-9]+(?:\.[0-9]+)?)s", message, flags=re.IGNORECASE)
-        if not m:
-            return None
-        try:
-            value = float(m.group(1))
-        except ValueError:
-            return None
-        return value if value > 0 else None
-
-    response = None
-    for attempt in range(2):
-        try:
-            response = model.generate_content([file_ref, prompt])
-            break
-        except (getattr(gexc, "ResourceExhausted", Exception), getattr(gexc, "TooManyRequests", Exception)) as exc:
-            if attempt >= 1:
-                raise
-            retry_seconds = _extract_retry_seconds(str(exc) or "")
-            # Cap to keep requests responsive.
-            sleep_for = min(max(retry_seconds or 2.0, 0.5), 15.0)
-            import time
+def _describe_at_timestamp(*, gemini_file_name: str, timestamp: str, clip_seconds: int, api_key: str, model_name: str, user_prompt: str | None = None, include_timestamp: bool = True, clip_start_seconds: float | None = None) -> str:
+    prompt = _timestamp_prompt(
+        timestamp=timestamp,
+        user_prompt=user_prompt,
+        include_timestamp=include_timestamp,
+        clip_start_seconds=clip_start_seconds,
+    )
 
-            time.sleep(sleep_for)
+    model_name = _normalize_gemini_model(model_name)
+    with _gemini_client(api_key) as gemini:
+        file_ref = gemini.get_file(gemini_file_name)
+        model = gemini.generative_model(model_name)
+        # 429s are queued/retried by the shared limiter instead of sleeping here.
+        response = call_provider("gemini", model_name, api_key, lambda: model.generate_content([file_ref, prompt]))
 
     if response is None:
         return ""
@@ -599,99 +703,477 @@ def _describe_at_timestamp(*, gemini_file_name: str, timestamp: str, clip_second
     return str(text).strip()
 
 
+def _stream_describe_at_timestamp(*, gemini_file_name: str, timestamp: str, api_key: str, model_name: str, user_prompt: str | None = None, include_timestamp: bool = True, clip_start_seconds: float | None = None) -> Iterator[str]:
+    """Like `_describe_at_timestamp`, yielding text chunks as Gemini generates them."""
+    prompt = _timestamp_prompt(
+        timestamp=timestamp,
+        user_prompt=user_prompt,
+        include_timestamp=include_timestamp,
+        clip_start_seconds=clip_start_seconds,
+    )
+
+    model_name = _normalize_gemini_model(model_name)
+    with _gemini_client(api_key) as gemini:
+        file_ref = gemini.get_file(gemini_file_name)
+        model = gemini.generative_model(model_name)
+        # The SDK fetches the first chunk eagerly, so the limiter/breaker cover the initial request.
+        response = call_provider(
+            "gemini", model_name, api_key, lambda: model.generate_content([file_ref, prompt], stream=True)
+        )
+        for chunk in response:
+            text = getattr(chunk, "text", None)
+            if text:
+                yield str(text)
+
+
+def _parse_multi_caption_response(text: str, count: int) -> dict[int, str]:
+    """Parse {"passos": [{"id": 1, "texto": "..."}]} (fences tolerated) into {index: caption}."""
+    raw = (text or "").strip()
+    if raw.startswith("```json"):
+        raw = raw[len("```json"):].strip()
+    if raw.startswith("```"):
+        raw = raw[3:].strip()
+    if raw.endswith("```"):
+        raw = raw[:-3].strip()
+    try:
+        parsed: Any = json.loads(raw)
+    except json.JSONDecodeError:
+        start, end = raw.find("{"), raw.rfind("}")
+        if start < 0 or end <= start:
+            return {}
+        try:
+            parsed = json.loads(raw[start : end + 1])
+        except json.JSONDecodeError:
+            return {}
+
+    entries = parsed.get("passos") if isinstance(parsed, dict) else parsed
+    if not isinstance(entries, list):
+        return {}
+    out: dict[int, str] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = int(entry.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        caption = str(entry.get("texto") or "").strip()
+        if 0 <= index < count and caption:
+            out[index] = caption
+    return out
+
+
+def _describe_timestamps_in_clip(
+    *,
+    gemini_file_name: str,
+    timestamps: list[str],
+    clip_start_seconds: float,
+    api_key: str,
+    model_name: str,
+    user_prompt: str | None = None,
+    include_timestamp: bool = True,
+) -> dict[int, str]:
+    """Caption several timestamps of one uploaded clip with a single generate_content call.
+
+    Returns {position in `timestamps`: caption}; timestamps the model skipped
+    are missing from the result so the caller can retry them individually.
+    """
+    system_instruction = _CAPTION_SYSTEM_INSTRUCTION
+
+    listed: list[str] = []
+    for position, timestamp in enumerate(timestamps, start=1):
+        try:
+            offset = max(0.0, _parse_timestamp_to_seconds(timestamp) - float(clip_start_seconds))
+        except ValueError:
+            offset = 0.0
+        listed.append(f"- id {position}: {timestamp} do vídeo (em {_format_timestamp(offset)} do clipe)")
+    time_instruction = (
+        f"Este clipe começa em {_format_timestamp(float(clip_start_seconds))} do vídeo original. "
+        "Descreva SEPARADAMENTE o procedimento ao redor de cada um destes momentos, "
+        "usando o restante do clipe apenas como contexto:\n" + "\n".join(listed)
+    )
+
+    formatting_instruction = "REGRAS DE SAÍDA (para cada momento):\n" + _CAPTION_OUTPUT_RULES
+    timestamp_instruction = (
+        "Inclua o timestamp do momento no texto de cada passo."
+        if include_timestamp
+        else "Não inclua timestamp nos textos."
+    )
+    output_instruction = (
+        'Responda APENAS com JSON no formato {"passos": [{"id": 1, "texto": "..."}]}, '
+        "com exatamente um item por id listado e o texto em markdown simples."
+    )
+
+    prompt = "\n\n".join(
+        [system_instruction, time_instruction, formatting_instruction, timestamp_instruction, output_instruction]
+    )
+    if user_prompt and str(user_prompt).strip():
+        prompt += "\n\n" + "Contexto extra do usuário (se aplicável):\n" + str(user_prompt).strip()
+
+    model_name = _normalize_gemini_model(model_name)
+    with _gemini_client(api_key) as gemini:
+        file_ref = gemini.get_file(gemini_file_name)
+        model = gemini.generative_model(model_name)
+        response = call_provider(
+            "gemini",
+            model_name,
+            api_key,
+            lambda: model.generate_content(
+                [file_ref, prompt],
+                generation_config={"response_mime_type": "application/json"},
+            ),
+        )
+
+    text = getattr(response, "text", None) if response is not None else None
+    return _parse_multi_caption_response(str(text or ""), len(timestamps))
+
+
+_SILENCE_END_RE = re.compile(r"silence_end:\s*([0-9]+(?:\.[0-9]+)?)")
+_scene_build_lock = threading.Lock()
+
+
+def _video_scene_index(entry: VideoEntry, video_path: Path) -> scene_index.SceneIndex:
+    """Local scene-change index of the video (see scene_index.py), built once per entry."""
+    # One build at a time: each build already keeps every pool worker busy.
+    with _scene_build_lock:
+        with _videos_lock:
+            if entry.scenes is not None:
+                return entry.scenes
+        info = scene_index.probe(video_path)
+        if info is None:
+            raise HTTPException(status_code=400, detail="Não foi possível ler a duração do vídeo (ffprobe).")
+        try:
+            index = scene_index.build_index(video_path, ffmpeg=_ensure_ffmpeg(), info=info)
+        except ImportError as exc:
+            raise HTTPException(
+                status_code=500,
+                detail="Dependência 'numpy' não instalada. Execute: pip install numpy",
+            ) from exc
+        except scene_index.SceneIndexError as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+        with _videos_lock:
+            entry.scenes = index
+        return index
+
+
+def _detect_step_candidates(entry: VideoEntry, video_path: Path, max_steps: int) -> list[float]:
+    """Likely step moments: visible UI changes plus the points where speech resumes.
+
+    UI changes come from the local scene index; silencedetect on the audio track
+    adds weak evidence. Events closer than STEP_MIN_GAP_SECONDS are merged; when
+    there are too many, the best-supported ones are kept.
+    """
+    index = _video_scene_index(entry, video_path)
+    events: list[tuple[float, float]] = [
+        (step.seconds, step.score)
+        for step in scene_index.propose_steps(
+            index, max_steps=max_steps * 3, min_gap_seconds=STEP_MIN_GAP_SECONDS
+        )
+    ]
+
+    silence = subprocess.run(
+        [
+            _ensure_ffmpeg(), "-hide_banner", "-nostats",
+            "-i", str(video_path),
+            "-vn",
+            "-af", "silencedetect=noise=-35dB:d=0.8",
+            "-f", "null", "-",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    for match in _SILENCE_END_RE.finditer(silence.stderr or ""):
+        events.append((float(match.group(1)), 0.01))  # speech boundary: weak signal on its own
+
+    events.sort()
+    # [seconds of the strongest event, its score, total support]
+    clusters: list[list[float]] = []
+    for seconds, score in events:
+        if clusters and seconds - clusters[-1][0] < STEP_MIN_GAP_SECONDS:
+            cluster = clusters[-1]
+            if score > cluster[1]:
+                cluster[0], cluster[1] = seconds, score
+            cluster[2] += score  # corroborating signals strengthen the cluster
+            continue
+        clusters.append([seconds, score, score])
+
+    if len(clusters) > max_steps:
+        clusters = sorted(clusters, key=lambda c: c[2], reverse=True)[:max_steps]
+    return sorted(round(c[0], 2) for c in clusters)
+
+
 # ---------------------------------------------------------------------------
 # Groq API Integration (Llama 4 Vision + Whisper Turbo)
 # ---------------------------------------------------------------------------
 
-def _get_groq_api_key(header_key: str | None = None) -> str:
-    """Get Groq API key from environment or header."""
-    api_key = GROQ_API_KEY or (header_key or "").strip()
-    if not api_key:
+def _check_groq_api_key(header_key: str | None) -> None:
+    """Fail fast when no Groq key is available, without consuming a pool pick."""
+    if not key_pool.pools["groq"] and not (header_key or "").strip():
         raise HTTPException(
             status_code=400,
             detail="GROQ_API_KEY não configurada. Defina no backend (.env) ou envie no header X-Groq-Api-Key.",
         )
-    return api_key
 
 
-def _extract_frames_from_video(
+def _get_groq_api_key(header_key: str | None = None) -> str:
+    """Get Groq API key from the server pool (GROQ_API_KEY / GROQ_API_KEYS) or header."""
+    _check_groq_api_key(header_key)
+    return key_pool.pick_key("groq") or (header_key or "").strip()
+
+
+def _extract_frame_png(video_path: Path, ts: float) -> bytes | None:
+    """Single frame at `ts` (fast seek), scaled to GEMINI_PROXY_HEIGHT, as PNG bytes."""
+    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        ffmpeg_cmd = [
+            "ffmpeg",
+            "-y",
+            "-ss", str(ts),
+            "-i", str(video_path),
+            "-vframes", "1",
+            "-vf", f"scale=-1:{GEMINI_PROXY_HEIGHT}",  # Reuse existing height config
+            "-f", "image2",
+            tmp_path,
+        ]
+        subprocess.run(ffmpeg_cmd, capture_output=True, check=True)
+
+        with open(tmp_path, "rb") as f:
+            return f.read() or None
+    except Exception as exc:
+        logger.warning("Failed to extract frame at %.2fs: %s", ts, exc)
+        return None
+    finally:
+        try:
+            Path(tmp_path).unlink(missing_ok=True)
+        except Exception:
+            pass
+
+
+def _distinct_frame_indices(frames: list[bytes], *, limit: int, anchor: int | None) -> list[int]:
+    """Indices of up to `limit` PNG frames that are not near-duplicates (perceptual hash), in order."""
+    if len(frames) <= 1:
+        return list(range(min(len(frames), limit)))
+    try:
+        from PIL import Image
+
+        images = [Image.open(io.BytesIO(frame)) for frame in frames]
+        hashes = frame_hash.phash_images(images)
+    except Exception as exc:
+        logger.warning("frame dedup skipped: %s", exc)
+        return list(range(0, len(frames), max(1, len(frames) // max(1, limit))))[:limit]
+    return frame_hash.select_distinct(hashes, limit=limit, anchor=anchor, min_distance=frame_hash.DEDUP_DISTANCE)
+
+
+# Upper bound on candidate frames decoded for dedup (one PNG each, from a single ffmpeg pass).
+_MAX_SAMPLED_FRAMES = 32
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _split_png_stream(data: bytes) -> list[bytes]:
+    """Split concatenated PNG files (ffmpeg image2pipe output) by walking their chunks."""
+    images: list[bytes] = []
+    pos = 0
+    while data.startswith(_PNG_SIGNATURE, pos):
+        cursor = pos + len(_PNG_SIGNATURE)
+        while cursor + 8 <= len(data):
+            length = int.from_bytes(data[cursor : cursor + 4], "big")
+            chunk_type = data[cursor + 4 : cursor + 8]
+            cursor += 12 + length  # length + type + data + CRC
+            if chunk_type == b"IEND":
+                break
+        else:
+            break  # truncated image
+        images.append(data[pos:cursor])
+        pos = cursor
+    return images
+
+
+def _extract_window_pngs(video_path: Path, start: float, duration: float, count: int) -> list[bytes]:
+    """`count` evenly spaced PNG frames of [start, start + duration] from a single ffmpeg pass."""
+    fps = (count - 1) / duration if duration > 0 else 1.0
+    cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-ss", f"{start:.3f}",
+        "-t", f"{duration + 0.5 / fps:.3f}",
+        "-i", str(video_path),
+        "-an", "-sn",
+        "-vf", f"fps={fps:.6f},scale=-1:{GEMINI_PROXY_HEIGHT}",
+        "-frames:v", str(count),
+        "-f", "image2pipe", "-c:v", "png",
+        "-",
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True)
+    except OSError as exc:
+        logger.warning("Failed to extract frames at %.2fs: %s", start, exc)
+        return []
+    frames = _split_png_stream(proc.stdout)
+    if not frames:
+        tail = "\n".join(proc.stderr.decode(errors="replace").strip().splitlines()[-3:])
+        logger.warning("Failed to extract frames at %.2fs (single pass): %s", start, tail)
+    return frames
+
+
+def _extract_timed_frames_from_video(
     video_path: Path,
     timestamp_seconds: float,
     window_seconds: int = 40,
     frame_count: int = 5,
-) -> list[bytes]:
-    """Extract frames from video around the timestamp.
-    
-    Extracts `frame_count` frames evenly distributed in a window of
-    `window_seconds` before and after the timestamp.
-    Returns list of PNG image bytes.
-    """
-    ffprobe_cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        str(video_path),
-    ]
-    try:
-        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True, check=True)
-        video_duration = float(result.stdout.strip())
-    except Exception:
-        video_duration = timestamp_seconds + window_seconds + 10
+) -> list[tuple[float, bytes]]:
+    """Like `_extract_frames_from_video`, with the time (seconds) of each frame."""
+    # Probed once at ingest; cached per file version.
+    info = scene_index.probe(video_path)
+    video_duration = info.duration if info else timestamp_seconds + window_seconds + 10
 
     # Calculate frame timestamps
     start_time = max(0, timestamp_seconds - window_seconds)
     end_time = min(video_duration, timestamp_seconds + window_seconds)
     actual_window = end_time - start_time
-    
-    if frame_count <= 1:
+
+    dedup = frame_hash.DEDUP_ENABLED and frame_count > 1
+    sample_count = frame_count
+    if dedup:
+        sample_count = max(frame_count, min(frame_count * frame_hash.OVERSAMPLE, _MAX_SAMPLED_FRAMES))
+    if sample_count <= 1:
         timestamps = [timestamp_seconds]
     else:
-        step = actual_window / (frame_count - 1)
-        timestamps = [start_time + i * step for i in range(frame_count)]
+        step = actual_window / (sample_count - 1)
+        timestamps = [start_time + i * step for i in range(sample_count)]
+
+    if len(timestamps) > 1:
+        extracted = _extract_window_pngs(video_path, start_time, actual_window, len(timestamps))
+    else:
+        extracted = []
+    if not extracted:
+        with ThreadPoolExecutor(max_workers=min(8, len(timestamps))) as pool:
+            extracted = list(pool.map(lambda ts: _extract_frame_png(video_path, ts), timestamps))
+    timed = [(ts, frame) for ts, frame in zip(timestamps, extracted) if frame]
+    if not dedup:
+        return timed
+
+    anchor = min(range(len(timed)), key=lambda i: abs(timed[i][0] - timestamp_seconds), default=None)
+    keep = _distinct_frame_indices([frame for _ts, frame in timed], limit=frame_count, anchor=anchor)
+    logger.info(
+        "frames: %s distinct of %s sampled around %.1fs (%s)",
+        len(keep),
+        len(timed),
+        timestamp_seconds,
+        video_path.name,
+    )
+    return [timed[i] for i in keep]
+
+
+def _extract_frames_from_video(
+    video_path: Path,
+    timestamp_seconds: float,
+    window_seconds: int = 40,
+    frame_count: int = 5,
+) -> list[bytes]:
+    """Extract frames from video around the timestamp.
     
-    frames: list[bytes] = []
-    for ts in timestamps:
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-            tmp_path = tmp.name
-        
-        try:
-            ffmpeg_cmd = [
-                "ffmpeg",
-                "-y",
-                "-ss", str(ts),
-                "-i", str(video_path),
-                "-vframes", "1",
-                "-vf", f"scale=-1:{GEMINI_PROXY_HEIGHT}",  # Reuse existing height config
-                "-f", "image2",
-                tmp_path,
-            ]
-            subprocess.run(ffmpeg_cmd, capture_output=True, check=True)
-            
-            with open(tmp_path, "rb") as f:
-                frame_data = f.read()
-                if frame_data:
-                    frames.append(frame_data)
-        except Exception as exc:
-            logger.warning("Failed to extract frame at %.2fs: %s", ts, exc)
-        finally:
+    Extracts up to `frame_count` frames from a window of `window_seconds`
+    before and after the timestamp. With CLIPBUILDER_FRAME_DEDUP (default), the
+    window is oversampled and near-identical frames are dropped in favor of
+    the moments where the screen actually changed, so static screens send
+    fewer images.
+    Returns list of PNG image bytes.
+    """
+    timed = _extract_timed_frames_from_video(
+        video_path, timestamp_seconds, window_seconds=window_seconds, frame_count=frame_count
+    )
+    return [frame for _ts, frame in timed]
+
+
+def _gif_frame_png(img: Any, index: int, max_side: int) -> bytes:
+    """Decode one GIF frame (seek), downscale to `max_side` and encode it as PNG."""
+    from PIL import Image
+
+    img.seek(index)
+    frame = img.convert("RGB")
+    if max(frame.size) > max_side:
+        frame.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    frame.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _gif_uniform_indices(img: Any, n: int, frame_count: int) -> list[int]:
+    """Evenly spaced GIF frame indices, near-duplicates dropped (perceptual hash)."""
+    from PIL import Image
+
+    dedup = frame_hash.DEDUP_ENABLED and frame_count > 1
+    sample_count = frame_count * frame_hash.OVERSAMPLE if dedup else frame_count
+    if sample_count <= 1 or n <= 1:
+        indices = [0]
+    else:
+        step = (n - 1) / max(1, sample_count - 1)
+        indices = [min(int(round(i * step)), n - 1) for i in range(sample_count)]
+        indices = sorted(set(indices))
+        if dedup:
             try:
-                Path(tmp_path).unlink(missing_ok=True)
-            except Exception:
-                pass
-    
-    return frames
+                # Candidates only as tiny grayscale copies for the perceptual hash.
+                side = frame_hash.HASH_SIDE
+                gray = []
+                for idx in indices:
+                    img.seek(idx)
+                    gray.append(np.asarray(img.convert("L").resize((side, side), Image.Resampling.BILINEAR)))
+                keep = frame_hash.select_distinct(
+                    frame_hash.phash(np.stack(gray)),
+                    limit=frame_count,
+                    anchor=0,
+                    min_distance=frame_hash.DEDUP_DISTANCE,
+                )
+                indices = [indices[i] for i in keep]
+            except Exception as exc:
+                logger.warning("GIF frame dedup skipped: %s", exc)
+                indices = indices[:: frame_hash.OVERSAMPLE]
+        indices = indices[:frame_count]
+    return indices
+
+
+def _gif_motion_keyframes(img: Any, n: int, frame_count: int) -> list[int] | None:
+    """GIF frame indices at the boundaries and peaks of on-screen change (None if analysis failed)."""
+    if n <= 1 or frame_count <= 1:
+        return [0]
+    from PIL import Image
+
+    try:
+        positions = keyframes.analysis_positions(n)
+        width = keyframes.ANALYSIS_WIDTH
+        height = max(1, round(img.height * width / max(1, img.width)))
+        gray = []
+        durations: list[float] = []
+        for idx in positions:
+            img.seek(idx)
+            gray.append(np.asarray(img.convert("L").resize((width, height), Image.Resampling.BILINEAR)))
+            durations.append(float(img.info.get("duration") or 0))
+        # Strided analysis (very long GIFs) loses the per-frame timing.
+        selected = keyframes.select(
+            np.stack(gray), limit=frame_count, durations_ms=durations if len(positions) == n else None
+        )
+    except Exception as exc:
+        logger.warning("GIF motion keyframes skipped: %s", exc)
+        return None
+    logger.info("GIF keyframes: %s of %s frames (analysed %s)", len(selected), n, len(positions))
+    return [positions[i] for i in selected]
 
 
 def _extract_frames_from_gif(gif_bytes: bytes, frame_count: int = 5) -> list[bytes]:
     """Extract frames from a GIF file using Pillow.
     
-    Returns up to `frame_count` frames evenly distributed across the GIF,
-    as PNG bytes for sending to Groq Vision.
+    Returns up to `frame_count` frames as PNG bytes for sending to Groq Vision:
+    keyframes where the screen starts changing, peaks and settles
+    (keyframes.py), or evenly distributed frames when that is disabled.
+
+    Frames are decoded one at a time by seeking to the chosen indices (never
+    the whole sequence), and downscaled to the vision payload size, so memory
+    does not grow with the GIF's length.
     """
     try:
         from PIL import Image
-        from PIL import ImageSequence
     except ImportError as exc:
         raise HTTPException(
             status_code=500,
@@ -712,28 +1194,19 @@ def _extract_frames_from_gif(gif_bytes: bytes, frame_count: int = 5) -> list[byt
             detail="O arquivo não é um GIF válido.",
         )
 
-    # Collect all frames (ImageSequence.Iterator consumes, so we list once)
-    seq_frames: list[Any] = []
-    for frame in ImageSequence.Iterator(img):
-        seq_frames.append(frame.copy())
-    if not seq_frames:
-        seq_frames = [img.copy()]
-
-    n = len(seq_frames)
-    if frame_count <= 1 or n <= 1:
-        indices = [0]
-    else:
-        step = (n - 1) / max(1, frame_count - 1)
-        indices = [min(int(round(i * step)), n - 1) for i in range(frame_count)]
-        indices = sorted(set(indices))[:frame_count]
+    # Frame count from the GIF structure (no frame is kept in memory).
+    try:
+        n = max(1, int(getattr(img, "n_frames", 1)))
+    except Exception:
+        n = 1
+    indices = _gif_motion_keyframes(img, n, frame_count) if keyframes.MOTION_ENABLED else None
+    if indices is None:
+        indices = _gif_uniform_indices(img, n, frame_count)
 
     out: list[bytes] = []
-    for idx in indices:
+    for idx in sorted(indices):
         try:
-            frame_img = seq_frames[idx]
-            buf = io.BytesIO()
-            frame_img.save(buf, format="PNG")
-            data = buf.getvalue()
+            data = _gif_frame_png(img, idx, vision_payload.MAX_SIDE)
             if data:
                 out.append(data)
         except Exception as exc:
@@ -747,81 +1220,77 @@ def _extract_frames_from_gif(gif_bytes: bytes, frame_count: int = 5) -> list[byt
     return out
 
 
+def _extract_audio_range(video_path: Path, start_time: float, duration: float) -> np.ndarray | None:
+    """16 kHz mono int16 samples for [start_time, start_time + duration], or None.
+
+    Sliced from the audio track extracted at ingest when there is one (zero-copy
+    view of a memory map); otherwise the window is decoded from the video.
+    """
+    track = audio_codec.load_track(video_path)
+    if track is not None:
+        first = max(0, int(start_time * audio_codec.SAMPLE_RATE))
+        samples = track[first : first + int(duration * audio_codec.SAMPLE_RATE)]
+        return samples if len(samples) else None
+    return audio_codec.decode_pcm(video_path, start_time, duration)
+
+
 def _extract_audio_clip(
     video_path: Path,
     timestamp_seconds: float,
     window_seconds: int = 40,
-) -> Path | None:
+) -> np.ndarray | None:
     """Extract audio clip from video around the timestamp.
     
-    Returns path to temporary WAV file, or None if extraction fails.
+    Returns 16 kHz mono int16 samples, or None if extraction fails.
     """
-    # Get video duration
-    ffprobe_cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        str(video_path),
-    ]
-    try:
-        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True, check=True)
-        video_duration = float(result.stdout.strip())
-    except Exception:
-        video_duration = timestamp_seconds + window_seconds + 10
+    # Probed once at ingest; cached per file version.
+    info = scene_index.probe(video_path)
+    video_duration = info.duration if info else timestamp_seconds + window_seconds + 10
     
     start_time = max(0, timestamp_seconds - window_seconds)
     end_time = min(video_duration, timestamp_seconds + window_seconds)
-    duration = end_time - start_time
-    
-    # Create temp file for audio
-    audio_path = Path(tempfile.mktemp(suffix=".wav"))
-    
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-y",
-        "-ss", str(start_time),
-        "-i", str(video_path),
-        "-t", str(duration),
-        "-vn",  # No video
-        "-acodec", "pcm_s16le",
-        "-ar", "16000",  # 16kHz for Whisper
-        "-ac", "1",  # Mono
-        str(audio_path),
-    ]
-    
-    try:
-        subprocess.run(ffmpeg_cmd, capture_output=True, check=True)
-        if audio_path.exists() and audio_path.stat().st_size > 1000:
-            return audio_path
-    except Exception as exc:
-        logger.warning("Failed to extract audio: %s", exc)
-    
-    try:
-        audio_path.unlink(missing_ok=True)
-    except Exception:
-        pass
-    return None
+    return _extract_audio_range(video_path, start_time, end_time - start_time)
 
 
-def _transcribe_with_groq(audio_path: Path, api_key: str) -> str:
+def _speech_audio(samples: np.ndarray) -> tuple[str, bytes, float] | None:
+    """Upload (filename, encoded bytes, offset seconds) with silence trimmed; None when there is no speech."""
+    offset = 0.0
+    if vad.ENABLED:
+        trimmed = vad.trim_pcm(samples, audio_codec.SAMPLE_RATE)
+        if trimmed is None:
+            logger.info("vad: no speech in %.1fs of audio, skipping Whisper", len(samples) / audio_codec.SAMPLE_RATE)
+            return None
+        samples, offset = trimmed.samples, trimmed.offset_seconds
+    filename, payload = audio_codec.encode(samples)
+    logger.debug("audio upload: %.1fs as %s (%s bytes)", len(samples) / audio_codec.SAMPLE_RATE, filename, len(payload))
+    return filename, payload, offset
+
+
+def _transcribe_with_groq(samples: np.ndarray, api_key: str) -> str:
     """Transcribe audio using Groq Whisper API."""
     try:
-        from groq import Groq
+        import groq  # noqa: F401
     except ImportError as exc:
         raise HTTPException(
             status_code=500,
             detail="Dependência 'groq' não instalada. Execute: pip install groq",
         ) from exc
     
-    client = Groq(api_key=api_key)
-    
     try:
-        with open(audio_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                file=(audio_path.name, audio_file.read()),
-                model=DEFAULT_GROQ_WHISPER_MODEL,
-                language="pt",  # Portuguese
+        speech = _speech_audio(samples)
+        if speech is None:
+            return ""
+        filename, payload, _offset = speech
+        with groq_client(api_key) as client:
+            transcription = call_provider(
+                "groq",
+                DEFAULT_GROQ_WHISPER_MODEL,
+                api_key,
+                lambda: client.audio.transcriptions.create(
+                    file=(filename, payload),
+                    model=DEFAULT_GROQ_WHISPER_MODEL,
+                    language="pt",  # Portuguese
+                ),
             )
         return transcription.text or ""
     except Exception as exc:
@@ -829,102 +1298,297 @@ def _transcribe_with_groq(audio_path: Path, api_key: str) -> str:
         return ""
 
 
-def _analyze_frames_with_groq(
-    frames: list[bytes],
-    prompt: str,
-    api_key: str,
-    model: str | None = None,
-) -> str:
-    """Analyze frames using Groq Vision API (Llama 4)."""
-    try:
-        from groq import Groq
-    except ImportError as exc:
-        raise HTTPException(
-            status_code=500,
-            detail="Dependência 'groq' não instalada. Execute: pip install groq",
-        ) from exc
-    
-    if not frames:
+def _transcribe_segments_with_groq(samples: np.ndarray, api_key: str) -> list[transcript.Segment]:
+    """Timestamped Whisper segments (seconds relative to the samples). Raises on failure."""
+    speech = _speech_audio(samples)
+    if speech is None:
+        return []
+    filename, payload, offset = speech
+    with groq_client(api_key) as client:
+        response = call_provider(
+            "groq",
+            DEFAULT_GROQ_WHISPER_MODEL,
+            api_key,
+            lambda: client.audio.transcriptions.create(
+                file=(filename, payload),
+                model=DEFAULT_GROQ_WHISPER_MODEL,
+                language="pt",  # Portuguese
+                response_format="verbose_json",
+                timestamp_granularities=["segment"],
+            ),
+        )
+    raw_segments = getattr(response, "segments", None)
+    if raw_segments is None:
+        raw_segments = (getattr(response, "model_extra", None) or {}).get("segments") or []
+    segments: list[transcript.Segment] = []
+    for raw in raw_segments:
+        item = raw if isinstance(raw, dict) else getattr(raw, "__dict__", {})
+        text = str(item.get("text") or "").strip()
+        if text:
+            segments.append(
+                transcript.Segment(
+                    start=offset + float(item.get("start") or 0.0),
+                    end=offset + float(item.get("end") or 0.0),
+                    text=text,
+                )
+            )
+    return segments
+
+
+def _transcribe_chunk(video_path: Path, start: float, length: float, api_key: str) -> list[transcript.Segment]:
+    """One ingest transcript chunk, retried with backoff (429s are also queued by the limiter)."""
+    samples = _extract_audio_range(video_path, start, length)
+    if samples is None:
+        return []  # no audio track / silence-only container
+    last_exc: Exception | None = None
+    for attempt in range(transcript.RETRIES):
+        try:
+            segments = _transcribe_segments_with_groq(samples, api_key)
+            return [transcript.Segment(start=start + s.start, end=start + s.end, text=s.text) for s in segments]
+        except CircuitOpenError:
+            raise
+        except Exception as exc:
+            last_exc = exc
+            logger.info("transcript: chunk %.0fs attempt %s failed: %s", start, attempt + 1, exc)
+            if attempt < transcript.RETRIES - 1:
+                time.sleep(min(30.0, 2.0 ** attempt))
+    raise last_exc or RuntimeError("transcrição falhou")
+
+
+def _build_video_transcript(video_id: str) -> None:
+    """Transcribe the whole audio track once (parallel chunks) into the video's transcript sidecar."""
+    with _videos_lock:
+        entry = _videos.get(video_id)
+        if not entry or entry.status != "ready" or entry.transcript_status == "running":
+            return
+        entry.transcript_status = "running"
+        video_path = entry.path
+
+    status = "error"
+    try:
+        api_key = key_pool.pick_key("groq")
+        info = scene_index.probe(video_path)
+        if not api_key or info is None:
+            status = None  # nothing to do: no server Groq key, or unreadable video
+            return
+        chunks = transcript.chunk_ranges(info.duration)
+        result = transcript.Transcript(duration=info.duration, model=DEFAULT_GROQ_WHISPER_MODEL)
+        with ThreadPoolExecutor(max_workers=min(transcript.CONCURRENCY, len(chunks) or 1)) as pool:
+            futures = [
+                (start, length, pool.submit(_transcribe_chunk, video_path, start, length, api_key))
+                for start, length in chunks
+            ]
+            for start, length, future in futures:
+                try:
+                    result.segments.extend(future.result())
+                except Exception as exc:
+                    result.gaps.append((start, start + length))
+                    logger.warning("transcript: chunk %.0fs failed (video_id=%s): %s", start, video_id, exc)
+        result.segments.sort(key=lambda seg: seg.start)
+        transcript.save(video_path, result)
+        status = "partial" if result.gaps else "done"
+        logger.info(
+            "transcript: %s segments, %s gaps (video_id=%s)", len(result.segments), len(result.gaps), video_id
+        )
+    except Exception as exc:
+        logger.warning("transcript failed (video_id=%s): %s", video_id, exc, exc_info=True)
+    finally:
+        with _videos_lock:
+            entry.transcript_status = status
+
+
+def _analyze_frames_with_groq(
+    frames: list[bytes],
+    prompt: str,
+    api_key: str,
+    model: str | None = None,
+    *,
+    image_urls: list[str] | None = None,
+) -> str:
+    """Analyze frames using Groq Vision API (Llama 4); `image_urls` are sent as-is instead of `frames`."""
+    try:
+        import groq  # noqa: F401
+    except ImportError as exc:
+        raise HTTPException(
+            status_code=500,
+            detail="Dependência 'groq' não instalada. Execute: pip install groq",
+        ) from exc
+    
+    if not frames and not image_urls:
         raise HTTPException(status_code=400, detail="Nenhum frame extraído do vídeo")
     
-    client = Groq(api_key=api_key)
     vision_model = model or DEFAULT_GROQ_VISION_MODEL
-    
-    # Build message content with images
+    content = _groq_vision_content(frames, prompt, image_urls=image_urls)
+
+    try:
+        with groq_client(api_key) as client:
+            response = call_provider(
+                "groq",
+                vision_model,
+                api_key,
+                lambda: client.chat.completions.create(
+                    model=vision_model,
+                    messages=[{"role": "user", "content": content}],
+                    temperature=0.7,
+                    max_completion_tokens=2048,
+                ),
+            )
+        return response.choices[0].message.content or ""
+    except Exception as exc:
+        raise _groq_http_error(exc) from exc
+
+
+def _groq_vision_content(
+    frames: list[bytes], prompt: str, *, image_urls: list[str] | None = None
+) -> list[dict[str, Any]]:
+    """Chat message content: the prompt followed by the frames as data URLs.
+
+    `image_urls` (already encoded, e.g. by `_prepare_groq_description`) replace `frames`.
+    """
     content: list[dict[str, Any]] = [{"type": "text", "text": prompt}]
     
-    for i, frame_bytes in enumerate(frames[:5]):  # Max 5 images per Groq request
-        b64_image = base64.b64encode(frame_bytes).decode("ascii")
+    # Callers tile beyond the cap; images are resized/re-encoded to fit the request budget.
+    if image_urls is not None:
+        urls = image_urls[: contact_sheet.MAX_IMAGES]
+    else:
+        urls = vision_payload.data_urls(frames[: contact_sheet.MAX_IMAGES])
+    for url in urls:
         content.append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/png;base64,{b64_image}",
+                "url": url,
             },
         })
-    
-    try:
-        response = client.chat.completions.create(
-            model=vision_model,
-            messages=[{"role": "user", "content": content}],
-            temperature=0.7,
-            max_completion_tokens=2048,
+    return content
+
+
+def _groq_http_error(exc: Exception) -> HTTPException:
+    """Map Groq / limiter failures to an HTTPException the frontend understands."""
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, RateLimitTimeout):
+        return HTTPException(status_code=429, detail=str(exc))
+    if isinstance(exc, CircuitOpenError):
+        return _provider_unavailable(exc)
+    error_msg = str(exc).lower()
+    if "rate" in error_msg or "limit" in error_msg or "429" in error_msg:
+        return HTTPException(
+            status_code=429,
+            detail="Limite de requisições do Groq excedido. Tente novamente em alguns segundos.",
         )
-        return response.choices[0].message.content or ""
+    if "invalid" in error_msg and "api" in error_msg:
+        return HTTPException(
+            status_code=401,
+            detail="Chave da API Groq inválida. Verifique GROQ_API_KEY no .env",
+        )
+    return HTTPException(
+        status_code=500,
+        detail=f"Erro ao analisar com Groq: {str(exc)[:200]}",
+    )
+
+
+def _stream_frames_with_groq(
+    frames: list[bytes],
+    prompt: str,
+    api_key: str,
+    model: str | None = None,
+    *,
+    image_urls: list[str] | None = None,
+) -> Iterator[str]:
+    """Like `_analyze_frames_with_groq`, yielding text deltas as they are generated."""
+    if not frames and not image_urls:
+        raise HTTPException(status_code=400, detail="Nenhum frame extraído do vídeo")
+
+    vision_model = model or DEFAULT_GROQ_VISION_MODEL
+    content = _groq_vision_content(frames, prompt, image_urls=image_urls)
+    try:
+        with groq_client(api_key) as client:
+            stream = call_provider(
+                "groq",
+                vision_model,
+                api_key,
+                lambda: client.chat.completions.create(
+                    model=vision_model,
+                    messages=[{"role": "user", "content": content}],
+                    temperature=0.7,
+                    max_completion_tokens=2048,
+                    stream=True,
+                ),
+            )
+            for chunk in stream:
+                choices = getattr(chunk, "choices", None) or []
+                delta = getattr(choices[0], "delta", None) if choices else None
+                text = getattr(delta, "content", None)
+                if text:
+                    yield text
     except Exception as exc:
-        error_msg = str(exc).lower()
-        if "rate" in error_msg or "limit" in error_msg or "429" in error_msg:
-            raise HTTPException(
-                status_code=429,
-                detail="Limite de requisições do Groq excedido. Tente novamente em alguns segundos.",
-            ) from exc
-        if "invalid" in error_msg and "api" in error_msg:
-            raise HTTPException(
-                status_code=401,
-                detail="Chave da API Groq inválida. Verifique GROQ_API_KEY no .env",
-            ) from exc
-        raise HTTPException(
-            status_code=500,
-            detail=f"Erro ao analisar com Groq: {str(exc)[:200]}",
-        ) from exc
+        raise _groq_http_error(exc) from exc
 
 
-def _describe_with_groq(
+def _prepare_groq_description(
     *,
     video_path: Path,
     timestamp: str,
     timestamp_seconds: float,
     api_key: str,
-    model_name: str | None = None,
     user_prompt: str | None = None,
     include_timestamp: bool = True,
-) -> str:
-    """Describe video content using Groq Vision + Whisper.
-    
-    Extracts frames and audio from the video, transcribes audio,
-    and uses vision model to generate description combining both contexts.
+    cancel_event: threading.Event | None = None,
+) -> tuple[list[str], str]:
+    """Frame images (data URLs) and vision prompt (with audio transcription context) for a timestamp.
+
+    Runs as a small pipeline: audio extraction and the Whisper upload run in a
+    worker thread while frames are extracted, tiled and encoded here, so the
+    total is close to the slower of the two stages.
     """
-    # 1. Extract frames
-    frames = _extract_frames_from_video(
-        video_path=video_path,
-        timestamp_seconds=timestamp_seconds,
-        window_seconds=40,
-        frame_count=GROQ_FRAME_COUNT,
-    )
-    
-    if not frames:
-        raise HTTPException(status_code=500, detail="Não foi possível extrair frames do vídeo")
-    
-    # 2. Extract and transcribe audio (in parallel would be better, but keeping simple)
-    audio_context = ""
-    audio_path = _extract_audio_clip(video_path, timestamp_seconds, window_seconds=40)
-    if audio_path:
-        try:
-            audio_context = _transcribe_with_groq(audio_path, api_key)
-        finally:
-            try:
-                audio_path.unlink(missing_ok=True)
-            except Exception:
-                pass
+    abort = threading.Event()  # frames failed: don't start a Whisper call nobody will use
+
+    def audio_stage() -> str:
+        # Whole-video transcript from ingest: slice the window locally, no Whisper call.
+        video_transcript = transcript.load(video_path)
+        if video_transcript is not None:
+            text = video_transcript.window(max(0.0, timestamp_seconds - 40), timestamp_seconds + 40)
+            if text is not None:
+                return text
+        _raise_if_cancelled(cancel_event)
+        samples = _extract_audio_clip(video_path, timestamp_seconds, window_seconds=40)
+        if samples is None:
+            return ""
+        _raise_if_cancelled(cancel_event)
+        if abort.is_set():
+            return ""
+        return _transcribe_with_groq(samples, api_key)
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    # 2. Extract and transcribe audio (concurrently with the frames)
+    audio_future = pool.submit(audio_stage)
+
+    # 1. Extract frames (tiled into labelled contact sheets beyond Groq's image cap) and encode them
+    try:
+        timed_frames = _extract_timed_frames_from_video(
+            video_path=video_path,
+            timestamp_seconds=timestamp_seconds,
+            window_seconds=40,
+            frame_count=GROQ_FRAME_COUNT,
+        )
+        if not timed_frames:
+            raise HTTPException(status_code=500, detail="Não foi possível extrair frames do vídeo")
+        image_urls = vision_payload.data_urls(
+            contact_sheet.pack(
+                [frame for _ts, frame in timed_frames],
+                [_format_timestamp(ts) for ts, _frame in timed_frames],
+            )
+        )
+    except BaseException:
+        # Fail now instead of waiting for a Whisper upload whose result is no longer needed.
+        abort.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    try:
+        audio_context = audio_future.result()
+    finally:
+        pool.shutdown()
     
     # 3. Build prompt (same style as Gemini for consistency)
     system_instruction = (
@@ -935,9 +1599,12 @@ def _describe_with_groq(
     
     time_instruction = (
         f"O foco principal é o timestamp: {timestamp}. "
-        f"Você está vendo {len(frames)} frames extraídos do vídeo ao redor desse momento. "
+        f"Você está vendo {len(timed_frames)} frames extraídos do vídeo ao redor desse momento. "
         "Analise a sequência de imagens para entender o fluxo: O que está sendo feito? Qual o objetivo final?"
     )
+    layout = contact_sheet.describe_layout(len(timed_frames))
+    if layout:
+        time_instruction += " " + layout
     
     formatting_instruction = (
         "REGRAS DE SAÍDA:\n"
@@ -968,8 +1635,39 @@ def _describe_with_groq(
     if user_prompt and str(user_prompt).strip():
         prompt += "\n\n" + "Contexto extra do usuário (se aplicável):\n" + str(user_prompt).strip()
     
+    return image_urls, prompt
+
+
+def _describe_with_groq(
+    *,
+    video_path: Path,
+    timestamp: str,
+    timestamp_seconds: float,
+    api_key: str,
+    model_name: str | None = None,
+    user_prompt: str | None = None,
+    include_timestamp: bool = True,
+    cancel_event: threading.Event | None = None,
+) -> str:
+    """Describe video content using Groq Vision + Whisper.
+
+    Extracts frames and audio from the video, transcribes audio,
+    and uses vision model to generate description combining both contexts.
+    `cancel_event` (hedged requests) stops the work before each provider call.
+    """
+    image_urls, prompt = _prepare_groq_description(
+        video_path=video_path,
+        timestamp=timestamp,
+        timestamp_seconds=timestamp_seconds,
+        api_key=api_key,
+        user_prompt=user_prompt,
+        include_timestamp=include_timestamp,
+        cancel_event=cancel_event,
+    )
+
     # 4. Call vision API
-    return _analyze_frames_with_groq(frames, prompt, api_key, model_name)
+    _raise_if_cancelled(cancel_event)
+    return _analyze_frames_with_groq([], prompt, api_key, model_name, image_urls=image_urls)
 
 
 def _describe_gif_with_groq(
@@ -985,9 +1683,33 @@ def _describe_gif_with_groq(
     Extracts frames from the GIF, sends them to Groq with a prompt asking
     for one imperative step caption, optionally consistent with document_context.
     """
-    frames = _extract_frames_from_gif(gif_bytes, frame_count=min(5, GROQ_FRAME_COUNT))
+    frames = _extract_frames_from_gif(gif_bytes, frame_count=GIF_FRAME_COUNT)
     if not frames:
         raise HTTPException(status_code=400, detail="Nenhum frame extraído do GIF")
+    return _describe_step_frames_with_groq(
+        frames=frames,
+        api_key=api_key,
+        model=model,
+        document_context=document_context,
+        document_title=document_title,
+    )
+
+
+def _describe_step_frames_with_groq(
+    *,
+    frames: list[bytes],
+    api_key: str,
+    model: str | None = None,
+    document_context: str | None = None,
+    document_title: str | None = None,
+    labels: list[str] | None = None,
+) -> str:
+    """One imperative step caption for a short action shown as a sequence of frames (GIF or video range).
+
+    `labels` are the capture timestamps of video-range frames; GIF frames are numbered in order instead.
+    """
+    layout = contact_sheet.describe_layout(len(frames), ordinal=labels is None)
+    frames = contact_sheet.pack(frames, labels)
 
     system_instruction = (
         f"Você é um especialista em Documentação Técnica de Software. "
@@ -1002,6 +1724,8 @@ def _describe_gif_with_groq(
         "3. Qual é a ação específica sendo executada (clique, preenchimento, seleção, navegação).\n"
         "4. Qual é o objetivo final dessa ação."
     )
+    if layout:
+        task_instruction += "\n" + layout
     formatting_instruction = (
         "REGRAS DE SAÍDA:\n"
         "1. Gere UMA instrução completa e contextualizada que descreva o passo/ação mostrada.\n"
@@ -1086,6 +1810,65 @@ def _parse_steps(steps_raw: str) -> list[StepPayload]:
 
 _PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
 _JPEG_MAGIC = b"\xff\xd8\xff"
+_GIF_MAGICS = (b"GIF87a", b"GIF89a")
+
+
+@dataclass
+class AnimatedStepAsset:
+    data: bytes
+    ext: str
+    mime: str
+
+
+def _prepare_animated_step(
+    gif_bytes: bytes, animation_format: str, output_format: str
+) -> tuple[bytes, AnimatedStepAsset | None]:
+    """GIF step for /export -> (poster PNG, compact animation or None for a single-frame GIF).
+
+    The poster is the frame where the strongest on-screen change settles
+    (keyframes.py); the animation is transcoded to WebP/MP4 when that is smaller.
+    Only markdown/html embed the animation: for docx/pdf/plain the asset carries
+    the target extension and no data (no ffmpeg run).
+    """
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise HTTPException(
+            status_code=500,
+            detail="Dependência 'Pillow' não instalada. Execute: pip install Pillow",
+        ) from exc
+
+    try:
+        img = Image.open(io.BytesIO(gif_bytes))
+        n = max(1, int(getattr(img, "n_frames", 1)))
+        if n > 1:
+            chosen = _gif_motion_keyframes(img, n, 3) or [0]
+            interior = [idx for idx in chosen if 0 < idx < n - 1]
+            poster_index = interior[-1] if interior else chosen[-1]
+        else:
+            poster_index = 0
+        poster = _gif_frame_png(img, poster_index, max(img.size))
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="One or more images are invalid (could not read GIF)") from exc
+    if n <= 1:
+        return poster, None
+    if output_format not in {"markdown", "html"}:
+        return poster, AnimatedStepAsset(data=b"", ext=animation_format, mime=step_render.FORMATS[animation_format])
+
+    asset = AnimatedStepAsset(data=gif_bytes, ext="gif", mime="image/gif")
+    if animation_format != "gif":
+        try:
+            converted = step_render.transcode_gif(gif_bytes, animation_format)
+            if len(converted) < len(gif_bytes):
+                asset = AnimatedStepAsset(
+                    data=converted, ext=animation_format, mime=step_render.FORMATS[animation_format]
+                )
+        except step_render.StepRenderError as exc:
+            logger.warning("export: keeping GIF step as GIF: %s", exc)
+    logger.info("export: GIF step %s -> %s %s bytes", len(gif_bytes), asset.ext, len(asset.data))
+    return poster, asset
 
 
 def _normalize_image_to_png(image_bytes: bytes) -> bytes:
@@ -1130,13 +1913,88 @@ def _sanitize_image_prefix(prefix: str | None) -> str:
 
 
 
+@app.on_event("shutdown")
+def _close_provider_clients() -> None:
+    provider_registry.close_all()
+
+
 @app.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics(user: CurrentAuthorizedUser) -> dict[str, Any]:
+    """Provider client pool and rate-limiter state (API keys are fingerprinted); authorized users only."""
+    return {
+        "provider_clients": provider_registry.snapshot(),
+        "rate_limits": provider_limits.snapshot(),
+        "api_keys": key_pool.snapshot(),
+        "circuit_breakers": breakers.snapshot(),
+        "smart_text_latency": hedging.latencies.snapshot(),
+        "clip_warmup": warmup_budget.snapshot(),
+        "caption_reuse": caption_reuse.cache.snapshot(),
+        "result_cache": result_store.snapshot(),
+    }
+
+
+async def _ingest_precaption(video_id: str, x_google_api_key: str | None) -> None:
+    await _precaption_video(
+        video_id=video_id,
+        model=DEFAULT_GEMINI_MODEL,
+        prompt=None,
+        include_timestamp=True,
+        x_google_api_key=x_google_api_key,
+        x_groq_api_key=None,
+    )
+
+
+def _schedule_ingest_precaption(background_tasks: BackgroundTasks, video_id: str, x_google_api_key: str | None) -> None:
+    """CLIPBUILDER_PRECAPTION_ON_INGEST: pre-caption with the default options right after upload."""
+    if PRECAPTION_ON_INGEST:
+        background_tasks.add_task(_ingest_precaption, video_id, x_google_api_key)
+
+
+def _extract_video_audio_track(video_id: str) -> None:
+    with _videos_lock:
+        entry = _videos.get(video_id)
+        if not entry or entry.status != "ready":
+            return
+        video_path = entry.path
+    audio_codec.extract_track(video_path)
+
+
+def _schedule_ingest_audio_track(background_tasks: BackgroundTasks, video_id: str) -> None:
+    """CLIPBUILDER_AUDIO_TRACK_ON_INGEST: decode the audio once so captions and the transcript slice it."""
+    if audio_codec.TRACK_ON_INGEST:
+        background_tasks.add_task(_extract_video_audio_track, video_id)
+
+
+# Whole-video transcripts run on their own worker, not in the request's BackgroundTasks: those run
+# one after another, and a long transcription would hold back pre-captioning queued after it.
+_transcript_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clipbuilder-transcript")
+
+
+@app.on_event("shutdown")
+def _stop_transcript_pool() -> None:
+    _transcript_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ingest_transcript(video_id: str) -> None:
+    if audio_codec.TRACK_ON_INGEST:
+        _extract_video_audio_track(video_id)  # chunks slice the track instead of decoding each window
+    _build_video_transcript(video_id)
+
+
+def _schedule_ingest_transcript(video_id: str) -> None:
+    """CLIPBUILDER_TRANSCRIPT_ON_INGEST: whole-video transcript when the server has a Groq key."""
+    if transcript.ON_INGEST and key_pool.pools["groq"]:
+        _transcript_pool.submit(_ingest_transcript, video_id)
+
+
 @app.post("/videos")
 async def upload_video(
+    background_tasks: BackgroundTasks,
     video: UploadFile = File(...),
     x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
 ):
@@ -1205,13 +2063,21 @@ async def upload_video(
     _cleanup_old_files()
 
     # Validate API key early so the user gets fast feedback.
-    _get_api_key(x_google_api_key)
+    _check_api_key(x_google_api_key)
+    # Ingest probe: cached and reused by frame/audio extraction and step detection.
+    background_tasks.add_task(scene_index.probe, target_path)
+    if result_cache.ENABLED:
+        background_tasks.add_task(result_cache.file_digest, target_path)
+    _schedule_ingest_audio_track(background_tasks, video_id)
+    _schedule_ingest_transcript(video_id)
+    _schedule_ingest_precaption(background_tasks, video_id, x_google_api_key)
     return {"video_id": video_id, "status": "ready"}
 
 
 @app.post("/videos/raw")
 async def upload_video_raw(
     request: Request,
+    background_tasks: BackgroundTasks,
     x_filename: str | None = Header(default=None, alias="X-Filename"),
     x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
 ):
@@ -1265,103 +2131,1506 @@ async def upload_video_raw(
     _cleanup_old_files()
 
     # Validate API key early so the user gets fast feedback.
-    _get_api_key(x_google_api_key)
+    _check_api_key(x_google_api_key)
+    # Ingest probe: cached and reused by frame/audio extraction and step detection.
+    background_tasks.add_task(scene_index.probe, target_path)
+    if result_cache.ENABLED:
+        background_tasks.add_task(result_cache.file_digest, target_path)
+    _schedule_ingest_audio_track(background_tasks, video_id)
+    _schedule_ingest_transcript(video_id)
+    _schedule_ingest_precaption(background_tasks, video_id, x_google_api_key)
     return {"video_id": video_id, "status": "ready"}
 
 
-@app.get("/videos/{video_id}/status")
-def video_status(video_id: str):
-    with _videos_lock:
-        entry = _videos.get(video_id)
-        if not entry:
-            entry = _restore_video_entry_if_missing(video_id)
-        if not entry:
-            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
-        return {"status": entry.status, "error": entry.error}
+@app.get("/videos/{video_id}/status")
+def video_status(video_id: str):
+    with _videos_lock:
+        entry = _videos.get(video_id)
+        if not entry:
+            entry = _restore_video_entry_if_missing(video_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+        result: dict[str, Any] = {"status": entry.status, "error": entry.error}
+        if entry.transcript_status:
+            result["transcript"] = entry.transcript_status
+        if entry.precaption_status:
+            result["precaption"] = {
+                "status": entry.precaption_status,
+                "captions": sum(len(captions) for captions in entry.precaptions.values()),
+            }
+        return result
+
+
+@app.get("/videos/{video_id}/file")
+def video_file(video_id: str):
+    with _videos_lock:
+        entry = _videos.get(video_id)
+        if not entry:
+            entry = _restore_video_entry_if_missing(video_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+        if entry.status != "ready":
+            raise HTTPException(status_code=409, detail=entry.error or "Vídeo não está pronto")
+        path = entry.path
+
+    ext = path.suffix.lower()
+    media_type = "video/mp4" if ext == ".mp4" else "video/x-matroska"
+    return FileResponse(
+        path=path,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'inline; filename="{path.name}"',
+            "Cross-Origin-Resource-Policy": "cross-origin",
+        },
+    )
+
+
+@app.post("/videos/youtube")
+async def upload_youtube(
+    background_tasks: BackgroundTasks,
+    request: Request,
+    x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
+):
+    # Expect JSON: {"url": "https://..."}
+    try:
+        payload = await request.json()
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Body inválido. Envie JSON com campo 'url'.") from exc
+
+    url = (payload.get("url") if isinstance(payload, dict) else "")
+    url = (url or "").strip()
+    if not url:
+        raise HTTPException(status_code=400, detail="Campo 'url' é obrigatório")
+    if not _is_supported_youtube_url(url):
+        raise HTTPException(status_code=400, detail="URL não suportada. Use um link do YouTube (youtube.com / youtu.be).")
+
+    # Validate API key early so the user gets fast feedback.
+    _check_api_key(x_google_api_key)
+
+    video_id = uuid.uuid4().hex
+    target_path = DATA_DIR / f"video_{video_id}.mp4"
+
+    with _videos_lock:
+        _videos[video_id] = VideoEntry(path=target_path, status="processing")
+
+    def job() -> None:
+        try:
+            _download_youtube_video(url=url, out_path=target_path)
+            scene_index.probe(target_path)
+            with _videos_lock:
+                current = _videos.get(video_id)
+                if current:
+                    current.status = "ready"
+                    current.error = None
+            # Cleanup old files to stay within MAX_DATA_FILES limit
+            _cleanup_old_files()
+        except HTTPException as exc:
+            with _videos_lock:
+                current = _videos.get(video_id)
+                if current:
+                    current.status = "error"
+                    current.error = str(exc.detail)
+        except Exception as exc:
+            with _videos_lock:
+                current = _videos.get(video_id)
+                if current:
+                    current.status = "error"
+                    current.error = str(exc)
+            logger.error("youtube download failed (video_id=%s): %s", video_id, exc, exc_info=True)
+
+    background_tasks.add_task(job)
+    # Background tasks run in order, so these start once the download finished (the transcript
+    # is submitted to its worker from a task too: submitting now would find the video still processing).
+    _schedule_ingest_audio_track(background_tasks, video_id)
+    background_tasks.add_task(_schedule_ingest_transcript, video_id)
+    _schedule_ingest_precaption(background_tasks, video_id, x_google_api_key)
+    return {"video_id": video_id, "status": "processing"}
+
+
+def _gemini_http_error(exc: BaseException) -> HTTPException | None:
+    """Map common Gemini/limiter errors to an HTTPException the frontend understands (None if unknown)."""
+    try:
+        from google.api_core import exceptions as gexc  # type: ignore
+    except Exception:
+        gexc = None
+
+    def _retry_hint_from_message(message: str) -> str:
+        # Example: "Please retry in 13.644857575s."
+        seconds = parse_retry_seconds(message)
+        if not seconds:
+            return ""
+        return f" Tente novamente em ~{seconds:.0f}s."
+
+    def _as_list(e: BaseException) -> list[BaseException]:
+        # AnyIO / Python may raise ExceptionGroup with multiple nested exceptions.
+        eg = getattr(e, "exceptions", None)
+        if isinstance(eg, (list, tuple)):
+            return list(eg)
+        return [e]
+
+    candidates: list[BaseException] = []
+    for one in _as_list(exc):
+        candidates.append(one)
+        cause = getattr(one, "__cause__", None)
+        if isinstance(cause, BaseException):
+            candidates.append(cause)
+
+    def _msg(e: BaseException) -> str:
+        try:
+            return str(e) or e.__class__.__name__
+        except Exception:
+            return e.__class__.__name__
+
+    for one in candidates:
+        message = _msg(one)
+        if isinstance(one, CircuitOpenError):
+            return _provider_unavailable(one)
+        if isinstance(one, RateLimitTimeout):
+            return HTTPException(status_code=429, detail=message)
+        if (gexc is not None and isinstance(one, getattr(gexc, "ResourceExhausted", ()))) or (
+            "quota" in message.lower() or "resourceexhausted" in message.lower() or " 429" in message
+        ):
+            return HTTPException(
+                status_code=429,
+                detail=(
+                    "Quota/limite do Gemini excedido (429). Verifique billing/limites do projeto e tente novamente."
+                    + _retry_hint_from_message(message)
+                ),
+            )
+
+    if gexc is None:
+        return None
+
+    if isinstance(exc, getattr(gexc, "TooManyRequests", ())):
+        return HTTPException(
+            status_code=429,
+            detail="Muitas requisições ao Gemini (429). Tente novamente em instantes.",
+        )
+
+    if isinstance(exc, getattr(gexc, "PermissionDenied", ())):
+        return HTTPException(
+            status_code=403,
+            detail="Permissão negada pelo Gemini. Verifique se a API está habilitada e se a chave é válida.",
+        )
+
+    if isinstance(exc, getattr(gexc, "NotFound", ())):
+        return HTTPException(
+            status_code=400,
+            detail="Modelo do Gemini não encontrado/suportado. Ajuste o model para um valor retornado por list_models().",
+        )
+
+    if isinstance(exc, getattr(gexc, "InvalidArgument", ())):
+        return HTTPException(status_code=400, detail="Parâmetros inválidos ao chamar o Gemini.")
+    return None
+
+
+def _check_gemini_circuits(model_name: str) -> None:
+    """Raise CircuitOpenError if the clip upload or generation breaker is open."""
+    breakers.check("gemini", "files")
+    breakers.check("gemini", _normalize_gemini_model(model_name))
+
+
+def _smart_text_fallback(
+    *, use_groq: bool, x_google_api_key: str | None, x_groq_api_key: str | None
+) -> str | None:
+    """Model on the other provider that can serve this request right now, if any."""
+    if use_groq:
+        if not key_pool.pools["gemini"] and not (x_google_api_key or "").strip():
+            return None
+        if breakers.is_open("gemini", "files") or breakers.is_open("gemini", _normalize_gemini_model(DEFAULT_GEMINI_MODEL)):
+            return None
+        return DEFAULT_GEMINI_MODEL
+    if not key_pool.pools["groq"] and not (x_groq_api_key or "").strip():
+        return None
+    if breakers.is_open("groq", DEFAULT_GROQ_VISION_MODEL):
+        return None
+    return DEFAULT_GROQ_VISION_MODEL
+
+
+async def _smart_text_groq(
+    *,
+    video_id: str,
+    source_path: Path,
+    timestamp: str,
+    ts_seconds: float,
+    groq_key: str,
+    model: str,
+    prompt: str | None,
+    include_timestamp: bool,
+    cancel_event: threading.Event | None = None,
+) -> str:
+    def groq_work() -> str:
+        return _describe_with_groq(
+            video_path=source_path,
+            timestamp=timestamp,
+            timestamp_seconds=ts_seconds,
+            api_key=groq_key,
+            model_name=model,
+            user_prompt=prompt,
+            include_timestamp=include_timestamp,
+            cancel_event=cancel_event,
+        )
+
+    try:
+        return await _run_abandonable(groq_work, cancel_event)
+    except HTTPException:
+        raise
+    except CircuitOpenError as exc:
+        raise _provider_unavailable(exc) from exc
+    except Exception as exc:
+        logger.error(
+            "groq smart-text failed (video_id=%s, model=%s, timestamp=%s): %s",
+            video_id,
+            model,
+            timestamp,
+            exc,
+            exc_info=True,
+        )
+        raise HTTPException(status_code=500, detail=f"Falha ao analisar com Groq: {str(exc)[:200]}") from exc
+
+
+def _clip_tile_center(ts_seconds: float) -> int:
+    """Center of the shared clip tile that best covers `ts_seconds`.
+
+    Tiles are GEMINI_CLIP_SECONDS long and start every half clip, so any
+    timestamp sits within a quarter clip of its tile's center and nearby steps
+    share one encoded/uploaded clip.
+    """
+    clip_seconds = max(10, int(GEMINI_CLIP_SECONDS))
+    half = clip_seconds // 2
+    index = max(0, int(round((ts_seconds - half) / half)))
+    return index * half + half
+
+
+# (video_id, clip_key) -> set when the in-flight upload of that clip finishes. Event-loop only.
+_clip_uploads: dict[tuple[str, str], anyio.Event] = {}
+
+
+def _clip_key(center_seconds: float) -> str:
+    return f"{int(center_seconds)}:{int(GEMINI_CLIP_SECONDS)}"
+
+
+def _clip_available(video_id: str, entry: VideoEntry, center_seconds: float) -> bool:
+    """True if the clip around `center_seconds` is uploaded or being uploaded."""
+    clip_key = _clip_key(center_seconds)
+    with _videos_lock:
+        if clip_key in entry.clip_cache:
+            return True
+    return (video_id, clip_key) in _clip_uploads
+
+
+async def _ensure_gemini_clip(
+    *,
+    video_id: str,
+    entry: VideoEntry,
+    source_path: Path,
+    center_seconds: float,
+    timestamp: str,
+    api_key: str,
+    cancel_event: threading.Event | None = None,
+) -> tuple[str, str, int]:
+    """Uploaded Gemini clip around `center_seconds`: (file_name, api_key, clip_start_seconds).
+
+    Clips are cached per video; the returned key is the one that uploaded the
+    clip (Gemini files are not visible to other projects).
+    """
+    clip_seconds = max(10, int(GEMINI_CLIP_SECONDS))
+    clip_start = max(0, int(center_seconds) - clip_seconds // 2)
+    clip_key = _clip_key(center_seconds)
+    flight_key = (video_id, clip_key)
+    while True:
+        with _videos_lock:
+            cached = entry.clip_cache.get(clip_key)
+        if cached:
+            return cached[0], cached[1], clip_start
+        pending = _clip_uploads.get(flight_key)
+        if pending is None:
+            break
+        # Someone (e.g. a warm-up) is already uploading this clip: wait instead of duplicating it.
+        await pending.wait()
+
+    uploaded = _clip_uploads[flight_key] = anyio.Event()
+    clip_path = DATA_DIR / f"clip_{video_id}_{int(center_seconds)}_{int(GEMINI_CLIP_SECONDS)}.mp4"
+
+    def upload_work() -> str:
+        _make_gemini_clip(
+            source_path=source_path,
+            timestamp_seconds=center_seconds,
+            clip_seconds=GEMINI_CLIP_SECONDS,
+            out_path=clip_path,
+        )
+        _raise_if_cancelled(cancel_event)
+        return _upload_video_to_gemini(clip_path, api_key)
+
+    try:
+        file_name = await _run_abandonable(upload_work, cancel_event)
+        with _videos_lock:
+            current = _videos.get(video_id)
+            if current and current.status == "ready":
+                current.clip_cache[clip_key] = (file_name, api_key)
+        return file_name, api_key, clip_start
+    except HTTPException:
+        raise
+    except Exception as exc:
+        mapped = _gemini_http_error(exc)
+        if mapped is not None:
+            raise mapped from exc
+        with _videos_lock:
+            current = _videos.get(video_id)
+            if current:
+                current.error = str(exc)
+        logger.error(
+            "gemini clip upload failed (video_id=%s, timestamp=%s): %s",
+            video_id,
+            timestamp,
+            exc,
+            exc_info=True,
+        )
+        raise HTTPException(status_code=500, detail="Falha ao preparar/enviar clipe para o Gemini") from exc
+    finally:
+        _clip_uploads.pop(flight_key, None)
+        uploaded.set()
+        try:
+            if clip_path.exists():
+                clip_path.unlink()
+        except Exception:
+            pass
+
+
+async def _caption_gemini_clip(
+    *,
+    video_id: str,
+    file_name: str,
+    api_key: str,
+    timestamp: str,
+    model: str,
+    prompt: str | None,
+    include_timestamp: bool,
+    clip_start_seconds: float | None = None,
+    cancel_event: threading.Event | None = None,
+) -> str:
+    def work() -> str:
+        _raise_if_cancelled(cancel_event)
+        return _describe_at_timestamp(
+            gemini_file_name=str(file_name),
+            timestamp=timestamp,
+            clip_seconds=int(GEMINI_CLIP_SECONDS),
+            api_key=api_key,
+            model_name=model,
+            user_prompt=prompt,
+            include_timestamp=include_timestamp,
+            clip_start_seconds=clip_start_seconds,
+        )
+
+    try:
+        return await _run_abandonable(work, cancel_event)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        # Normalize common Gemini errors so the frontend gets a meaningful status.
+        mapped = _gemini_http_error(exc)
+        if mapped is not None:
+            raise mapped from exc
+
+        with _videos_lock:
+            current = _videos.get(video_id)
+            if current:
+                current.error = str(exc)
+        logger.error(
+            "gemini smart-text failed (video_id=%s, model=%s, timestamp=%s): %s",
+            video_id,
+            model,
+            timestamp,
+            exc,
+            exc_info=True,
+        )
+        raise HTTPException(status_code=500, detail="Falha ao analisar com Gemini") from exc
+
+
+async def _caption_gemini_clip_multi(
+    *,
+    video_id: str,
+    file_name: str,
+    api_key: str,
+    timestamps: list[str],
+    clip_start_seconds: float,
+    model: str,
+    prompt: str | None,
+    include_timestamp: bool,
+) -> dict[int, str]:
+    def work() -> dict[int, str]:
+        return _describe_timestamps_in_clip(
+            gemini_file_name=str(file_name),
+            timestamps=timestamps,
+            clip_start_seconds=clip_start_seconds,
+            api_key=api_key,
+            model_name=model,
+            user_prompt=prompt,
+            include_timestamp=include_timestamp,
+        )
+
+    try:
+        return await _run_abandonable(work)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        mapped = _gemini_http_error(exc)
+        if mapped is not None:
+            raise mapped from exc
+        logger.error(
+            "gemini multi-timestamp caption failed (video_id=%s, model=%s, timestamps=%s): %s",
+            video_id,
+            model,
+            ",".join(timestamps),
+            exc,
+            exc_info=True,
+        )
+        raise HTTPException(status_code=500, detail="Falha ao analisar com Gemini") from exc
+
+
+async def _smart_text_gemini(
+    *,
+    video_id: str,
+    entry: VideoEntry,
+    source_path: Path,
+    timestamp: str,
+    ts_seconds: float,
+    api_key: str,
+    model: str,
+    prompt: str | None,
+    include_timestamp: bool,
+    cancel_event: threading.Event | None = None,
+) -> str:
+    # Reuse a shared tile (batch / warm-up) when one covers this timestamp; otherwise
+    # encode a clip centered on it.
+    tile_center = _clip_tile_center(ts_seconds)
+    use_tile = _clip_available(video_id, entry, tile_center)
+    file_name, api_key, clip_start = await _ensure_gemini_clip(
+        video_id=video_id,
+        entry=entry,
+        source_path=source_path,
+        center_seconds=tile_center if use_tile else ts_seconds,
+        timestamp=timestamp,
+        api_key=api_key,
+        cancel_event=cancel_event,
+    )
+    return await _caption_gemini_clip(
+        video_id=video_id,
+        file_name=file_name,
+        api_key=api_key,
+        timestamp=timestamp,
+        model=model,
+        prompt=prompt,
+        include_timestamp=include_timestamp,
+        clip_start_seconds=clip_start if use_tile else None,
+        cancel_event=cancel_event,
+    )
+
+
+def _route_smart_text(
+    model: str, *, x_google_api_key: str | None, x_groq_api_key: str | None
+) -> tuple[str, bool, str | None]:
+    """(model, use_groq, rerouted_from) for a smart-text request.
+
+    Fails fast (or reroutes) before any ffmpeg/upload work when the provider is known to be down.
+    """
+    # Route to Groq if model is Llama 4 / Scout / Maverick
+    use_groq = _is_groq_model(model)
+    try:
+        if use_groq:
+            breakers.check("groq", model)
+        else:
+            _check_gemini_circuits(model)
+    except CircuitOpenError as exc:
+        fallback = _smart_text_fallback(
+            use_groq=use_groq, x_google_api_key=x_google_api_key, x_groq_api_key=x_groq_api_key
+        )
+        if fallback is None:
+            raise _provider_unavailable(exc) from exc
+        logger.warning("smart-text rerouted from %s to %s: %s", model, fallback, exc)
+        return fallback, not use_groq, model
+    return model, use_groq, None
+
+
+def _get_ready_video(video_id: str) -> tuple[VideoEntry, Path]:
+    with _videos_lock:
+        entry = _videos.get(video_id)
+        if not entry:
+            entry = _restore_video_entry_if_missing(video_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+        if entry.status != "ready":
+            raise HTTPException(status_code=409, detail=entry.error or "Vídeo não está pronto")
+        entry.last_access = time.monotonic()
+        return entry, entry.path
+
+
+def _caption_options_key(model: str, prompt: str | None, include_timestamp: bool) -> str:
+    """Stable key for the options that change a caption (pre-caption lookups must match all of them)."""
+    raw = json.dumps(
+        {"model": (model or "").strip(), "prompt": (prompt or "").strip(), "include_timestamp": bool(include_timestamp)},
+        sort_keys=True,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _frame_signature(video_path: Path, ts_seconds: float) -> np.ndarray:
+    """Perceptual hashes of frames around the timestamp (caption reuse signature).
+
+    One ffmpeg pass decodes [ts - window, ts + window] straight to 32x32
+    grayscale at one frame per window, so no PNG is encoded along the way.
+    """
+    window = caption_reuse.WINDOW_SECONDS
+    start = max(0.0, ts_seconds - window)
+    side = frame_hash.HASH_SIDE
+    cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-ss", f"{start:.3f}",
+        "-t", f"{ts_seconds + window - start + 0.1:.3f}",
+        "-i", str(video_path),
+        "-an", "-sn",
+        "-vf", f"fps=1/{window:g},scale={side}:{side}:flags=area,format=gray",
+        "-f", "rawvideo", "-pix_fmt", "gray",
+        "-",
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True)
+    except OSError as exc:
+        logger.warning("caption reuse: signature failed at %.1fs: %s", ts_seconds, exc)
+        return np.zeros(0, dtype=np.uint64)
+    count = len(proc.stdout) // (side * side)
+    if count == 0:
+        return np.zeros(0, dtype=np.uint64)
+    gray = np.frombuffer(proc.stdout[: count * side * side], dtype=np.uint8).reshape(count, side, side)
+    return frame_hash.phash(gray)
+
+
+def _store_reusable_caption(
+    video_id: str,
+    options_key: str,
+    source_path: Path,
+    ts_seconds: float,
+    signature: np.ndarray | None,
+    caption: str,
+    timestamp: str,
+) -> None:
+    """Remember a fresh caption for caption reuse (runs after the response is sent)."""
+    if signature is None:
+        signature = _frame_signature(source_path, ts_seconds)
+    caption_reuse.cache.store(video_id, options_key, signature, caption, timestamp)
+
+
+def _lookup_precaption(entry: VideoEntry, options_key: str, ts_seconds: float) -> str | None:
+    with _videos_lock:
+        captions = entry.precaptions.get(options_key)
+        if not captions:
+            return None
+        nearest = min(captions, key=lambda seconds: abs(seconds - ts_seconds))
+        if abs(nearest - ts_seconds) <= PRECAPTION_MATCH_SECONDS:
+            return captions[nearest]
+    return None
+
+
+@app.get("/videos/{video_id}/steps")
+async def detect_steps(
+    video_id: str,
+    max_steps: int = 20,
+    min_gap: float | None = None,
+    frames: bool = False,
+):
+    """Propose step timestamps from local scene changes (no provider calls).
+
+    The timestamps can be sent as-is to /smart-text or /smart-text/batch; with
+    frames=true each step also carries a representative PNG (base64), taken
+    once the screen has settled after the change.
+    """
+    entry, source_path = _get_ready_video(video_id)
+    max_steps = max(1, min(int(max_steps), SMART_TEXT_BATCH_MAX_ITEMS))
+    min_gap_seconds = float(min_gap) if min_gap and min_gap > 0 else float(STEP_MIN_GAP_SECONDS)
+
+    started = time.monotonic()
+    index = await anyio.to_thread.run_sync(_video_scene_index, entry, source_path)
+    steps = scene_index.propose_steps(index, max_steps=max_steps, min_gap_seconds=min_gap_seconds)
+    info = scene_index.probe(source_path)
+
+    out: list[dict[str, Any]] = []
+    for step in steps:
+        item: dict[str, Any] = {
+            "timestamp": _format_timestamp(step.seconds),
+            "seconds": step.seconds,
+            "score": step.score,
+        }
+        if frames:
+            images = await anyio.to_thread.run_sync(
+                lambda seconds=step.seconds: _extract_frames_from_video(
+                    source_path, seconds, window_seconds=0, frame_count=1
+                )
+            )
+            item["image_base64"] = base64.b64encode(images[0]).decode("ascii") if images else None
+        out.append(item)
+
+    return {
+        "steps": out,
+        "duration": round(info.duration, 2) if info else None,
+        "elapsed_seconds": round(time.monotonic() - started, 2),
+    }
+
+
+async def _validate_step_range(source_path: Path, start: float, end: float) -> tuple[float, float]:
+    info = await anyio.to_thread.run_sync(scene_index.probe, source_path)
+    if info is not None:
+        end = min(end, info.duration)
+    if start < 0 or end <= start:
+        raise HTTPException(status_code=400, detail="Intervalo inválido: informe 0 <= start < end (segundos).")
+    if end - start > step_render.MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervalo muito longo. Máximo: {step_render.MAX_SECONDS} segundos.",
+        )
+    return start, end
+
+
+def _range_keyframe_frames(
+    source_path: Path, start: float, end: float, frame_count: int
+) -> list[tuple[float, bytes]]:
+    """(timestamp, PNG) frames of [start, end] at the moments where the screen changes (keyframes.py)."""
+    info = scene_index.probe(source_path)
+    width = keyframes.ANALYSIS_WIDTH
+    height = max(1, round(info.height * width / max(1, info.width))) if info else max(1, width * 9 // 16)
+    fps = step_render.FPS
+    try:
+        gray = step_render.analysis_frames(source_path, start, end, fps=fps, width=width, height=height)
+        times = [start + i / fps for i in keyframes.select(gray, limit=frame_count)]
+    except step_render.StepRenderError as exc:
+        logger.warning("range keyframes skipped: %s", exc)
+        step = (end - start) / max(1, frame_count - 1)
+        times = [start + i * step for i in range(frame_count)]
+    with ThreadPoolExecutor(max_workers=min(8, len(times))) as pool:
+        frames = list(pool.map(lambda ts: _extract_frame_png(source_path, ts), times))
+    return [(ts, frame) for ts, frame in zip(times, frames) if frame]
+
+
+@app.get("/videos/{video_id}/animation")
+async def render_step_animation(
+    video_id: str,
+    start: float,
+    end: float,
+    output_format: str = "gif",
+    width: int = step_render.WIDTH,
+    fps: int = step_render.FPS,
+):
+    """Animated step (GIF, WebP or MP4) rendered by ffmpeg from [start, end] of the video; cached per range."""
+    _entry, source_path = _get_ready_video(video_id)
+    fmt = (output_format or "").strip().lower()
+    if fmt not in step_render.FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use: gif, webp ou mp4.")
+    start, end = await _validate_step_range(source_path, start, end)
+    try:
+        path = await anyio.to_thread.run_sync(
+            lambda: step_render.render(source_path, start, end, fmt=fmt, width=width, fps=fps)
+        )
+    except step_render.StepRenderError as exc:
+        logger.error("step render failed (video_id=%s): %s", video_id, exc)
+        raise HTTPException(status_code=500, detail=f"Falha ao gerar a animação: {str(exc)[:200]}") from exc
+    return FileResponse(
+        path=path,
+        media_type=step_render.FORMATS[fmt],
+        headers={
+            "Content-Disposition": f'inline; filename="clipbuilder_step_{video_id}.{fmt}"',
+            "Cache-Control": "private, max-age=86400",
+        },
+    )
+
+
+@app.post("/videos/{video_id}/describe-range")
+async def describe_video_range(
+    video_id: str,
+    start: float = Form(...),
+    end: float = Form(...),
+    document_context: str | None = Form(default=None),
+    document_title: str | None = Form(default=None),
+    model: str | None = Form(default=None),
+    x_groq_api_key: str | None = Header(default=None, alias="X-Groq-Api-Key"),
+    x_cache_bypass: str | None = Header(default=None, alias=result_cache.BYPASS_HEADER),
+):
+    """
+    Como /describe-gif, mas para um trecho [start, end] do vídeo já enviado: os quadros são
+    extraídos no servidor (nos momentos de mudança na tela), sem reenviar a animação.
+    Resposta: { "description": "..." } (com "cached": true quando veio do cache)
+    """
+    _entry, source_path = _get_ready_video(video_id)
+    start, end = await _validate_step_range(source_path, start, end)
+    model_name = model or DEFAULT_GROQ_VISION_MODEL
+
+    bypass = result_cache.bypass_requested(x_cache_bypass)
+    cache_key: str | None = None
+    if result_cache.ENABLED:
+        digest = await anyio.to_thread.run_sync(result_cache.file_digest, source_path)
+        cache_key = result_cache.make_key(
+            "describe-range",
+            digest,
+            {
+                "start": round(start, 2),
+                "end": round(end, 2),
+                "model": model_name.strip(),
+                "document_context": " ".join((document_context or "").split()),
+                "document_title": " ".join((document_title or "").split()),
+            },
+        )
+        cached = None if bypass else await anyio.to_thread.run_sync(result_store.get, cache_key)
+        if cached is not None:
+            return {"description": cached.get("description") or "Passo animado", "cached": True}
+
+    api_key = _get_groq_api_key(x_groq_api_key)
+    try:
+        breakers.check("groq", model_name)
+    except CircuitOpenError as exc:
+        raise _provider_unavailable(exc) from exc
+
+    def work() -> str:
+        timed_frames = _range_keyframe_frames(source_path, start, end, GIF_FRAME_COUNT)
+        if not timed_frames:
+            raise HTTPException(status_code=400, detail="Nenhum frame extraído do trecho do vídeo")
+        return _describe_step_frames_with_groq(
+            frames=[frame for _ts, frame in timed_frames],
+            labels=[_format_timestamp(ts) for ts, _frame in timed_frames],
+            api_key=api_key,
+            model=model_name,
+            document_context=document_context,
+            document_title=document_title,
+        )
+
+    try:
+        description = await anyio.to_thread.run_sync(work)
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.error("describe-range failed (video_id=%s): %s", video_id, exc, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Falha ao analisar o trecho com Groq: {str(exc)[:200]}",
+        ) from exc
+
+    description = (description or "").strip()
+    if cache_key is not None and description:
+        await anyio.to_thread.run_sync(result_store.put, cache_key, {"description": description})
+    return {"description": description or "Passo animado"}
+
+
+@app.get("/videos/{video_id}/smart-text")
+async def smart_text(
+    video_id: str,
+    background_tasks: BackgroundTasks,
+    timestamp: str | None = None,
+    t: float | None = None,
+    model: str = DEFAULT_GEMINI_MODEL,
+    prompt: str | None = None,
+    include_timestamp: bool = True,
+    hedge: bool | None = None,
+    reuse: bool = True,
+    x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
+    x_groq_api_key: str | None = Header(default=None, alias="X-Groq-Api-Key"),
+    x_cache_bypass: str | None = Header(default=None, alias=result_cache.BYPASS_HEADER),
+):
+    entry, source_path = _get_ready_video(video_id)
+
+    if timestamp is None:
+        if t is None:
+            raise HTTPException(status_code=400, detail="Informe timestamp (HH:MM:SS) ou t (segundos)")
+        timestamp = _format_timestamp(float(t))
+
+    try:
+        ts_seconds = _parse_timestamp_to_seconds(str(timestamp))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="timestamp inválido. Use HH:MM:SS")
+
+    options_key = _caption_options_key(model, prompt, bool(include_timestamp))
+    # X-Cache-Bypass forces a fresh provider answer: pre-captions, the result cache and caption
+    # reuse are all skipped (the fresh answer is still stored).
+    bypass = result_cache.bypass_requested(x_cache_bypass)
+    precaptioned = None if bypass else _lookup_precaption(entry, options_key, ts_seconds)
+    if precaptioned is not None:
+        return {"text": precaptioned, "precaptioned": True}
+
+    # Exact repeat (same video content, second and options), also across restarts and re-uploads.
+    cache_key: str | None = None
+    if result_cache.ENABLED:
+        digest = await anyio.to_thread.run_sync(result_cache.file_digest, source_path)
+        cache_key = result_cache.make_key("smart-text", digest, {"t": int(ts_seconds), "options": options_key})
+        cached = None if bypass else await anyio.to_thread.run_sync(result_store.get, cache_key)
+        if cached is not None:
+            text = str(cached.get("text") or "")
+            if include_timestamp and cached.get("timestamp"):
+                text = text.replace(str(cached["timestamp"]), str(timestamp))
+            return {"text": text, "cached": True}
+
+    # Same screen captured again (same options): reuse the earlier caption. Opt out with reuse=false.
+    # The signature is only computed up front when there is something to compare it with.
+    signature: np.ndarray | None = None
+    if (
+        caption_reuse.REUSE_ENABLED
+        and reuse
+        and not bypass
+        and caption_reuse.cache.has_candidates(video_id, options_key)
+    ):
+        signature = await anyio.to_thread.run_sync(_frame_signature, source_path, ts_seconds)
+        reused = caption_reuse.cache.lookup(video_id, options_key, signature)
+        if reused is not None:
+            logger.info(
+                "smart-text reused (video_id=%s): %s matches %s (distance=%s)",
+                video_id,
+                timestamp,
+                reused.timestamp,
+                reused.distance,
+            )
+            text = reused.caption
+            if include_timestamp:
+                text = text.replace(reused.timestamp, str(timestamp))
+            return {"text": text, "reused": True, "reused_from": reused.timestamp}
+
+    model, use_groq, rerouted_from = _route_smart_text(
+        model, x_google_api_key=x_google_api_key, x_groq_api_key=x_groq_api_key
+    )
+
+    async def run(on_groq: bool, model_name: str, cancel_event: threading.Event | None = None) -> str:
+        started = time.monotonic()
+        if on_groq:
+            text = await _smart_text_groq(
+                video_id=video_id,
+                source_path=source_path,
+                timestamp=str(timestamp),
+                ts_seconds=ts_seconds,
+                groq_key=_get_groq_api_key(x_groq_api_key),
+                model=model_name,
+                prompt=prompt,
+                include_timestamp=bool(include_timestamp),
+                cancel_event=cancel_event,
+            )
+            hedging.latencies.record("groq", model_name, time.monotonic() - started)
+        else:
+            text = await _smart_text_gemini(
+                video_id=video_id,
+                entry=entry,
+                source_path=source_path,
+                timestamp=str(timestamp),
+                ts_seconds=ts_seconds,
+                api_key=_get_api_key(x_google_api_key),
+                model=model_name,
+                prompt=prompt,
+                include_timestamp=bool(include_timestamp),
+                cancel_event=cancel_event,
+            )
+            hedging.latencies.record("gemini", _normalize_gemini_model(model_name), time.monotonic() - started)
+        return text
+
+    # Hedging (opt-in): if the primary is slower than its usual p95, race the other provider.
+    hedge_model: str | None = None
+    if (hedging.HEDGE_BY_DEFAULT if hedge is None else hedge) and not rerouted_from:
+        hedge_model = _smart_text_fallback(
+            use_groq=use_groq, x_google_api_key=x_google_api_key, x_groq_api_key=x_groq_api_key
+        )
+
+    result: dict[str, Any] = {}
+    if hedge_model is None:
+        result["text"] = await run(use_groq, model)
+    else:
+        primary_model, secondary_model = model, hedge_model
+        delay = hedging.hedge_delay(
+            "groq" if use_groq else "gemini",
+            primary_model if use_groq else _normalize_gemini_model(primary_model),
+        )
+        result["text"], hedged = await hedging.race(
+            lambda: run(use_groq, primary_model, threading.Event()),
+            lambda: run(not use_groq, secondary_model, threading.Event()),
+            delay=delay,
+        )
+        if hedged:
+            logger.info("smart-text hedge won (video_id=%s): %s answered before %s", video_id, hedge_model, model)
+            result["model"] = hedge_model
+            result["hedged_from"] = model
+
+    if rerouted_from:
+        result["model"] = model
+        result["rerouted_from"] = rerouted_from
+    # Only answers from the requested model are stored under its options.
+    if "model" not in result and str(result["text"] or "").strip():
+        if caption_reuse.REUSE_ENABLED and reuse:
+            background_tasks.add_task(
+                _store_reusable_caption,
+                video_id,
+                options_key,
+                source_path,
+                ts_seconds,
+                signature,
+                str(result["text"]),
+                str(timestamp),
+            )
+        if cache_key is not None:
+            await anyio.to_thread.run_sync(
+                result_store.put, cache_key, {"text": result["text"], "timestamp": str(timestamp)}
+            )
+    return result
+
+
+_precaption_lock = threading.Lock()
+_precaption_calls: deque[float] = deque()  # monotonic times of recent pre-caption provider calls
+
+
+def _precaption_take_call(*, peek: bool = False) -> bool:
+    """Consume (or just check) one provider call from the global hourly pre-caption budget."""
+    now = time.monotonic()
+    with _precaption_lock:
+        while _precaption_calls and now - _precaption_calls[0] > 3600:
+            _precaption_calls.popleft()
+        if len(_precaption_calls) >= PRECAPTION_CALLS_PER_HOUR:
+            return False
+        if not peek:
+            _precaption_calls.append(now)
+        return True
+
+
+def _precaption_stop_reason(video_id: str, entry: VideoEntry) -> str | None:
+    with _videos_lock:
+        if _videos.get(video_id) is not entry:
+            return "video_removed"
+        if time.monotonic() - entry.last_access > PRECAPTION_IDLE_SECONDS:
+            return "abandoned"
+    return None
+
+
+async def _precaption_tile(
+    *,
+    video_id: str,
+    entry: VideoEntry,
+    source_path: Path,
+    center: int,
+    members: list[float],
+    model: str,
+    prompt: str | None,
+    include_timestamp: bool,
+    x_google_api_key: str | None,
+    x_groq_api_key: str | None,
+) -> dict[float, str]:
+    timestamps = [_format_timestamp(seconds) for seconds in members]
+    if _is_groq_model(model):
+        out: dict[float, str] = {}
+        for seconds, timestamp in zip(members, timestamps):
+            if not _precaption_take_call():
+                break
+            out[seconds] = await _smart_text_groq(
+                video_id=video_id,
+                source_path=source_path,
+                timestamp=timestamp,
+                ts_seconds=seconds,
+                groq_key=_get_groq_api_key(x_groq_api_key),
+                model=model,
+                prompt=prompt,
+                include_timestamp=include_timestamp,
+            )
+        return out
+
+    if not _precaption_take_call():
+        return {}
+    file_name, api_key, clip_start = await _ensure_gemini_clip(
+        video_id=video_id,
+        entry=entry,
+        source_path=source_path,
+        center_seconds=center,
+        timestamp=timestamps[0],
+        api_key=_get_api_key(x_google_api_key),
+    )
+    captions = await _caption_gemini_clip_multi(
+        video_id=video_id,
+        file_name=file_name,
+        api_key=api_key,
+        timestamps=timestamps,
+        clip_start_seconds=clip_start,
+        model=model,
+        prompt=prompt,
+        include_timestamp=include_timestamp,
+    )
+    return {members[position]: text for position, text in captions.items()}
+
+
+async def _precaption_video(
+    *,
+    video_id: str,
+    model: str,
+    prompt: str | None,
+    include_timestamp: bool,
+    x_google_api_key: str | None,
+    x_groq_api_key: str | None,
+) -> None:
+    """Detect likely steps and caption them at low priority into entry.precaptions."""
+    with _videos_lock:
+        entry = _videos.get(video_id)
+        if not entry or entry.status != "ready" or entry.precaption_status == "running":
+            return
+        entry.precaption_status = "running"
+        source_path = entry.path
+
+    options_key = _caption_options_key(model, prompt, include_timestamp)
+    provider = "groq" if _is_groq_model(model) else "gemini"
+    busy_model = model if provider == "groq" else "files"
+    status = "done"
+    try:
+        candidates = await anyio.to_thread.run_sync(
+            _detect_step_candidates, entry, source_path, PRECAPTION_MAX_STEPS
+        )
+        logger.info("precaption: %s step candidates (video_id=%s)", len(candidates), video_id)
+
+        tiles: dict[int, list[float]] = {}
+        for seconds in candidates:
+            tiles.setdefault(_clip_tile_center(seconds), []).append(seconds)
+
+        for center, members in sorted(tiles.items()):
+            reason = _precaption_stop_reason(video_id, entry)
+            # Low priority: let queued user requests go first.
+            while reason is None and provider_limits.queued(provider, busy_model):
+                await anyio.sleep(2.0)
+                reason = _precaption_stop_reason(video_id, entry)
+            if reason is None and breakers.is_open(provider, busy_model):
+                reason = "provider_unavailable"
+            if reason is None and not _precaption_take_call(peek=True):
+                reason = "hourly_budget"
+            if reason is not None:
+                status = "stopped"
+                logger.info("precaption: stopped (video_id=%s): %s", video_id, reason)
+                break
+
+            try:
+                captions = await _precaption_tile(
+                    video_id=video_id,
+                    entry=entry,
+                    source_path=source_path,
+                    center=center,
+                    members=members,
+                    model=model,
+                    prompt=prompt,
+                    include_timestamp=include_timestamp,
+                    x_google_api_key=x_google_api_key,
+                    x_groq_api_key=x_groq_api_key,
+                )
+            except HTTPException as exc:
+                if exc.status_code in (401, 403, 429, 503):
+                    status = "stopped"
+                    logger.info("precaption: stopped (video_id=%s): %s", video_id, exc.detail)
+                    break
+                logger.warning("precaption: tile %ss failed (video_id=%s): %s", center, video_id, exc.detail)
+                continue
+            with _videos_lock:
+                entry.precaptions.setdefault(options_key, {}).update(captions)
+    except Exception as exc:
+        status = "error"
+        logger.warning("precaption failed (video_id=%s): %s", video_id, exc, exc_info=True)
+    finally:
+        with _videos_lock:
+            entry.precaption_status = status
+
+
+@app.post("/videos/{video_id}/precaption")
+async def precaption_video(
+    video_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
+    x_groq_api_key: str | None = Header(default=None, alias="X-Groq-Api-Key"),
+):
+    """Opt-in: detect likely step moments and pre-compute their smart-text in the background.
+
+    Body (JSON, optional): {"model", "prompt", "include_timestamp"} — the same
+    options later smart-text calls must use to hit the pre-computed captions.
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+
+    entry, _source_path = _get_ready_video(video_id)
+    model = str(body.get("model") or DEFAULT_GEMINI_MODEL)
+    prompt = (str(body.get("prompt") or "").strip()) or None
+    include_timestamp = body.get("include_timestamp", True)
+    if isinstance(include_timestamp, str):
+        include_timestamp = include_timestamp.lower() in ("true", "1", "yes", "sim")
+    include_timestamp = bool(include_timestamp)
+
+    if _is_groq_model(model):
+        _check_groq_api_key(x_groq_api_key)
+    else:
+        _check_api_key(x_google_api_key)
+
+    with _videos_lock:
+        running = entry.precaption_status == "running"
+    if not running:
+        background_tasks.add_task(
+            _precaption_video,
+            video_id=video_id,
+            model=model,
+            prompt=prompt,
+            include_timestamp=include_timestamp,
+            x_google_api_key=x_google_api_key,
+            x_groq_api_key=x_groq_api_key,
+        )
+    return {"status": "running" if running else "scheduled"}
+
+
+# Low-priority lane for speculative uploads (see warmup.py).
+_warmup_slots: anyio.CapacityLimiter | None = None
+
+
+def _warmup_client_id(request: Request) -> str:
+    """Budget identity: JWT subject when the request is authenticated, else client address."""
+    auth = (request.headers.get("authorization") or "").strip()
+    if auth.lower().startswith("bearer "):
+        try:
+            from app.auth.jwt import verify_token
+
+            sub = verify_token(auth[7:].strip()).get("sub")
+            if sub:
+                return f"user:{sub}"
+        except Exception:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def _warm_clip_tile(
+    *, video_id: str, entry: VideoEntry, source_path: Path, tile_center: int, api_key: str
+) -> None:
+    global _warmup_slots
+    if _warmup_slots is None:
+        _warmup_slots = anyio.CapacityLimiter(max(1, warmup.CONCURRENCY))
+    async with _warmup_slots:
+        # Yield to real work: skip if user requests are already waiting on Gemini uploads.
+        if provider_limits.queued("gemini", "files") or breakers.is_open("gemini", "files"):
+            warmup_budget.release(video_id, tile_center)
+            return
+        try:
+            await _ensure_gemini_clip(
+                video_id=video_id,
+                entry=entry,
+                source_path=source_path,
+                center_seconds=tile_center,
+                timestamp=_format_timestamp(tile_center),
+                api_key=api_key,
+            )
+            logger.info("warmup: clip tile ready (video_id=%s, center=%ss)", video_id, tile_center)
+        except Exception as exc:
+            warmup_budget.release(video_id, tile_center)
+            logger.info("warmup: clip tile failed (video_id=%s, center=%ss): %s", video_id, tile_center, exc)
+
+
+@app.post("/videos/{video_id}/warmup")
+async def warmup_clip(
+    video_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
+):
+    """Report the player position so the covering Gemini clip tile is prepared speculatively.
+
+    Body (JSON): {"t": seconds, "paused": bool}; sent on pause/seek and
+    periodically while playing. Never fails the player: budget or provider
+    issues are reported in "status" ("cached", "scheduled", "pending" or
+    "skipped" with a "reason").
+    """
+    try:
+        body = await request.json()
+        seconds = max(0.0, float(body.get("t")))
+        paused = bool(body.get("paused", False))
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Body inválido. Envie JSON com 't' (segundos) e 'paused'.") from exc
+
+    entry, source_path = _get_ready_video(video_id)
+    tile_center = _clip_tile_center(seconds)
+    result: dict[str, Any] = {"tile_center": tile_center}
+
+    if _clip_available(video_id, entry, tile_center):
+        with _videos_lock:
+            result["status"] = "cached" if _clip_key(tile_center) in entry.clip_cache else "pending"
+        return result
+    if not key_pool.pools["gemini"] and not (x_google_api_key or "").strip():
+        return {**result, "status": "skipped", "reason": "no_api_key"}
+    if breakers.is_open("gemini", "files"):
+        return {**result, "status": "skipped", "reason": "provider_unavailable"}
+
+    client_id = _warmup_client_id(request)
+    if not warmup_budget.dwelled(client_id, video_id, tile_center, paused=paused):
+        return {**result, "status": "skipped", "reason": "not_settled"}
+    reason = warmup_budget.reserve(client_id, video_id, tile_center)
+    if reason:
+        return {**result, "status": "skipped", "reason": reason}
+
+    background_tasks.add_task(
+        _warm_clip_tile,
+        video_id=video_id,
+        entry=entry,
+        source_path=source_path,
+        tile_center=tile_center,
+        api_key=_get_api_key(x_google_api_key),
+    )
+    return {**result, "status": "scheduled"}
+
+
+def _parse_batch_timestamps(raw: Any) -> list[tuple[str, float]]:
+    """Normalize a list of "HH:MM:SS" strings / seconds into (timestamp, seconds) pairs."""
+    if not isinstance(raw, list) or not raw:
+        raise HTTPException(
+            status_code=400,
+            detail="Campo 'timestamps' deve ser uma lista não vazia (HH:MM:SS ou segundos).",
+        )
+    if len(raw) > SMART_TEXT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo de {SMART_TEXT_BATCH_MAX_ITEMS} timestamps por requisição.",
+        )
+
+    out: list[tuple[str, float]] = []
+    for item in raw:
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            seconds = max(0.0, float(item))
+            out.append((_format_timestamp(seconds), seconds))
+            continue
+        if isinstance(item, str) and item.strip():
+            try:
+                out.append((item.strip(), _parse_timestamp_to_seconds(item)))
+                continue
+            except ValueError:
+                pass
+        raise HTTPException(status_code=400, detail=f"timestamp inválido: {item!r}. Use HH:MM:SS ou segundos")
+    return out
+
+
+# Streaming responses must not be buffered by proxies (nginx in the Docker setup).
+_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _stream_event(payload: dict[str, Any], *, sse: bool, event: str = "result") -> str:
+    data = json.dumps(payload, ensure_ascii=False)
+    if sse:
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+class _ProducerStreamingResponse(StreamingResponse):
+    """StreamingResponse whose `producer` task runs next to the body, in the response's own task group.
+
+    The body iterator only drains a memory stream, so it never yields inside a
+    cancel scope; the producer is cancelled when the response ends or the
+    client disconnects.
+    """
+
+    def __init__(self, content: Any, *, producer: Any, **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self._producer = producer
 
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(self._producer)
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                tg.cancel_scope.cancel()
 
-@app.get("/videos/{video_id}/file")
-def video_file(video_id: str):
-    with _videos_lock:
-        entry = _videos.get(video_id)
-        if not entry:
-            entry = _restore_video_entry_if_missing(video_id)
-        if not entry:
-            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
-        if entry.status != "ready":
-            raise HTTPException(status_code=409, detail=entry.error or "Vídeo não está pronto")
-        path = entry.path
 
-    ext = path.suffix.lower()
-    media_type = "video/mp4" if ext == ".mp4" else "video/x-matroska"
-    return FileResponse(
-        path=path,
-        media_type=media_type,
-        headers={
-            "Content-Disposition": f'inline; filename="{path.name}"',
-            "Cross-Origin-Resource-Policy": "cross-origin",
-        },
-    )
+def _batch_error(index: int, timestamp: str, exc: BaseException) -> dict[str, Any]:
+    if isinstance(exc, HTTPException):
+        return {"index": index, "timestamp": timestamp, "error": exc.detail, "status_code": exc.status_code}
+    return {"index": index, "timestamp": timestamp, "error": "Falha ao gerar descrição", "status_code": 500}
 
 
-@app.post("/videos/youtube")
-async def upload_youtube(
-    background_tasks: BackgroundTasks,
+@app.post("/videos/{video_id}/smart-text/batch")
+async def smart_text_batch(
+    video_id: str,
     request: Request,
     x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
+    x_groq_api_key: str | None = Header(default=None, alias="X-Groq-Api-Key"),
 ):
-    # Expect JSON: {"url": "https://..."}
+    """Caption many timestamps of one video in a single request.
+
+    Body (JSON): {"timestamps": ["00:01:05", 92.5, ...], "model", "prompt",
+    "include_timestamp", "format": "ndjson" | "sse", "mode": "per_timestamp" | "per_tile"}.
+
+    Work runs with bounded concurrency (CLIPBUILDER_SMART_TEXT_BATCH_CONCURRENCY);
+    on Gemini, nearby timestamps share one uploaded clip tile, and with
+    mode="per_tile" all timestamps of a tile are captioned by a single call
+    (structured per-timestamp output). Each result is
+    streamed as soon as it is ready ({"index", "timestamp", "text"} or
+    {"index", "timestamp", "error", "status_code"}), followed by a final
+    {"done": true, ...} summary.
+    """
     try:
-        payload = await request.json()
+        body = await request.json()
     except Exception as exc:
-        raise HTTPException(status_code=400, detail="Body inválido. Envie JSON com campo 'url'.") from exc
-
-    url = (payload.get("url") if isinstance(payload, dict) else "")
-    url = (url or "").strip()
-    if not url:
-        raise HTTPException(status_code=400, detail="Campo 'url' é obrigatório")
-    if not _is_supported_youtube_url(url):
-        raise HTTPException(status_code=400, detail="URL não suportada. Use um link do YouTube (youtube.com / youtu.be).")
+        raise HTTPException(status_code=400, detail=f"JSON inválido: {exc}") from exc
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Body inválido. Envie um objeto JSON.")
+
+    entry, source_path = _get_ready_video(video_id)
+    items = _parse_batch_timestamps(body.get("timestamps"))
+
+    model = str(body.get("model") or DEFAULT_GEMINI_MODEL)
+    prompt = (str(body.get("prompt") or "").strip()) or None
+    include_timestamp = body.get("include_timestamp", True)
+    if isinstance(include_timestamp, str):
+        include_timestamp = include_timestamp.lower() in ("true", "1", "yes", "sim")
+    include_timestamp = bool(include_timestamp)
+
+    stream_format = str(body.get("format") or "").strip().lower()
+    if not stream_format:
+        stream_format = "sse" if "text/event-stream" in (request.headers.get("accept") or "") else "ndjson"
+    if stream_format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="Campo 'format' deve ser 'ndjson' ou 'sse'.")
+    sse = stream_format == "sse"
+
+    mode = str(body.get("mode") or "per_timestamp").strip().lower()
+    if mode not in ("per_timestamp", "per_tile"):
+        raise HTTPException(status_code=400, detail="Campo 'mode' deve ser 'per_timestamp' ou 'per_tile'.")
+
+    model, use_groq, rerouted_from = _route_smart_text(
+        model, x_google_api_key=x_google_api_key, x_groq_api_key=x_groq_api_key
+    )
+    # Surface missing keys as a plain 400 before the stream starts.
+    if use_groq:
+        _check_groq_api_key(x_groq_api_key)
+    else:
+        _check_api_key(x_google_api_key)
 
-    # Validate API key early so the user gets fast feedback.
-    _get_api_key(x_google_api_key)
+    slots = anyio.CapacityLimiter(SMART_TEXT_BATCH_CONCURRENCY)
+    send, receive = anyio.create_memory_object_stream(max_buffer_size=len(items))
 
-    video_id = uuid.uuid4().hex
-    target_path = DATA_DIR / f"video_{video_id}.mp4"
+    async def emit(index: int, timestamp: str, make_text: Any) -> None:
+        try:
+            payload = {"index": index, "timestamp": timestamp, "text": await make_text()}
+        except Exception as exc:
+            payload = _batch_error(index, timestamp, exc)
+        await send.send(payload)
 
-    with _videos_lock:
-        _videos[video_id] = VideoEntry(path=target_path, status="processing")
+    async def caption_groq(index: int, timestamp: str, seconds: float) -> None:
+        async with slots:
+            await emit(
+                index,
+                timestamp,
+                lambda: _smart_text_groq(
+                    video_id=video_id,
+                    source_path=source_path,
+                    timestamp=timestamp,
+                    ts_seconds=seconds,
+                    groq_key=_get_groq_api_key(x_groq_api_key),
+                    model=model,
+                    prompt=prompt,
+                    include_timestamp=include_timestamp,
+                ),
+            )
 
-    def job() -> None:
+    async def caption_tile(center: int, members: list[tuple[int, str, float]]) -> None:
         try:
-            _download_youtube_video(url=url, out_path=target_path)
-            with _videos_lock:
-                current = _videos.get(video_id)
-                if current:
-                    current.status = "ready"
-                    current.error = None
-            # Cleanup old files to stay within MAX_DATA_FILES limit
-            _cleanup_old_files()
-        except HTTPException as exc:
-            with _videos_lock:
-                current = _videos.get(video_id)
-                if current:
-                    current.status = "error"
-                    current.error = str(exc.detail)
+            async with slots:
+                file_name, api_key, clip_start = await _ensure_gemini_clip(
+                    video_id=video_id,
+                    entry=entry,
+                    source_path=source_path,
+                    center_seconds=center,
+                    timestamp=members[0][1],
+                    api_key=_get_api_key(x_google_api_key),
+                )
         except Exception as exc:
-            with _videos_lock:
-                current = _videos.get(video_id)
-                if current:
-                    current.status = "error"
-                    current.error = str(exc)
-            logger.error("youtube download failed (video_id=%s): %s", video_id, exc, exc_info=True)
-
-    background_tasks.add_task(job)
-    return {"video_id": video_id, "status": "processing"}
+            for index, timestamp, _seconds in members:
+                await send.send(_batch_error(index, timestamp, exc))
+            return
 
+        async def caption_one(index: int, timestamp: str) -> None:
+            async with slots:
+                await emit(
+                    index,
+                    timestamp,
+                    lambda: _caption_gemini_clip(
+                        video_id=video_id,
+                        file_name=file_name,
+                        api_key=api_key,
+                        timestamp=timestamp,
+                        model=model,
+                        prompt=prompt,
+                        include_timestamp=include_timestamp,
+                        clip_start_seconds=clip_start,
+                    ),
+                )
 
-@app.get("/videos/{video_id}/smart-text")
-async def smart_text(
+        async def caption_group(group: list[tuple[int, str, float]]) -> None:
+            # One call for the whole group; timestamps the model skipped (or an unparsable
+            # answer, which yields no captions) fall back to individual calls. A failed call
+            # (throttled, circuit open, provider error) is reported for every item instead of
+            # fanning out into more calls against the same provider.
+            try:
+                async with slots:
+                    captions = await _caption_gemini_clip_multi(
+                        video_id=video_id,
+                        file_name=file_name,
+                        api_key=api_key,
+                        timestamps=[timestamp for _index, timestamp, _seconds in group],
+                        clip_start_seconds=clip_start,
+                        model=model,
+                        prompt=prompt,
+                        include_timestamp=include_timestamp,
+                    )
+            except Exception as exc:
+                for index, timestamp, _seconds in group:
+                    await send.send(_batch_error(index, timestamp, exc))
+                return
+            if len(captions) < len(group):
+                logger.warning(
+                    "per-tile caption covered %s of %s timestamps, retrying the rest individually",
+                    len(captions),
+                    len(group),
+                )
+            async with anyio.create_task_group() as retries:
+                for position, (index, timestamp, _seconds) in enumerate(group):
+                    if position in captions:
+                        await send.send({"index": index, "timestamp": timestamp, "text": captions[position]})
+                    else:
+                        retries.start_soon(caption_one, index, timestamp)
+
+        async with anyio.create_task_group() as tile_tasks:
+            if mode == "per_tile" and len(members) > 1:
+                for start in range(0, len(members), SMART_TEXT_TILE_MAX_STEPS):
+                    tile_tasks.start_soon(caption_group, members[start : start + SMART_TEXT_TILE_MAX_STEPS])
+            else:
+                for index, timestamp, _seconds in members:
+                    tile_tasks.start_soon(caption_one, index, timestamp)
+
+    async def produce() -> None:
+        async with send:
+            async with anyio.create_task_group() as tg:
+                if use_groq:
+                    for index, (timestamp, seconds) in enumerate(items):
+                        tg.start_soon(caption_groq, index, timestamp, seconds)
+                    return
+                tiles: dict[int, list[tuple[int, str, float]]] = {}
+                for index, (timestamp, seconds) in enumerate(items):
+                    tiles.setdefault(_clip_tile_center(seconds), []).append((index, timestamp, seconds))
+                for center, members in tiles.items():
+                    tg.start_soon(caption_tile, center, members)
+
+    async def stream():
+        count = errors = 0
+        async with receive:
+            async for payload in receive:
+                count += 1
+                errors += 1 if "error" in payload else 0
+                yield _stream_event(payload, sse=sse)
+        summary: dict[str, Any] = {"done": True, "count": count, "errors": errors, "model": model}
+        if rerouted_from:
+            summary["rerouted_from"] = rerouted_from
+        yield _stream_event(summary, sse=sse, event="done")
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return _ProducerStreamingResponse(stream(), producer=produce, media_type=media_type, headers=_STREAM_HEADERS)
+
+
+@app.get("/videos/{video_id}/smart-text/stream")
+async def smart_text_stream(
     video_id: str,
     timestamp: str | None = None,
     t: float | None = None,
@@ -1371,208 +3640,92 @@ async def smart_text(
     x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
     x_groq_api_key: str | None = Header(default=None, alias="X-Groq-Api-Key"),
 ):
-    with _videos_lock:
-        entry = _videos.get(video_id)
-        if not entry:
-            entry = _restore_video_entry_if_missing(video_id)
-        if not entry:
-            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
-        if entry.status != "ready":
-            raise HTTPException(status_code=409, detail=entry.error or "Vídeo não está pronto")
-        source_path = entry.path
+    """Server-Sent Events variant of smart-text.
+
+    Events: "token" ({"text": chunk}) as the model generates, then "done"
+    ({"text": full caption, "model"}) or "error" ({"detail", "status_code"}).
+    """
+    entry, source_path = _get_ready_video(video_id)
 
-    api_key = _get_api_key(x_google_api_key)
     if timestamp is None:
         if t is None:
             raise HTTPException(status_code=400, detail="Informe timestamp (HH:MM:SS) ou t (segundos)")
         timestamp = _format_timestamp(float(t))
-
     try:
         ts_seconds = _parse_timestamp_to_seconds(str(timestamp))
     except ValueError:
         raise HTTPException(status_code=400, detail="timestamp inválido. Use HH:MM:SS")
+    timestamp = str(timestamp)
 
-    # Route to Groq if model is Llama 4 / Scout / Maverick
-    if _is_groq_model(model):
-        groq_key = _get_groq_api_key(x_groq_api_key)
-        
-        def groq_work() -> str:
-            return _describe_with_groq(
-                video_path=source_path,
-                timestamp=str(timestamp),
-                timestamp_seconds=ts_seconds,
-                api_key=groq_key,
+    model, use_groq, rerouted_from = _route_smart_text(
+        model, x_google_api_key=x_google_api_key, x_groq_api_key=x_groq_api_key
+    )
+    if use_groq:
+        _check_groq_api_key(x_groq_api_key)
+    else:
+        _check_api_key(x_google_api_key)
+
+    async def tokens() -> AsyncIterator[str]:
+        if use_groq:
+            groq_key = _get_groq_api_key(x_groq_api_key)
+            image_urls, vision_prompt = await _run_abandonable(
+                lambda: _prepare_groq_description(
+                    video_path=source_path,
+                    timestamp=timestamp,
+                    timestamp_seconds=ts_seconds,
+                    api_key=groq_key,
+                    user_prompt=prompt,
+                    include_timestamp=bool(include_timestamp),
+                )
+            )
+            async for piece in _iterate_in_thread(
+                lambda: _stream_frames_with_groq([], vision_prompt, groq_key, model, image_urls=image_urls)
+            ):
+                yield piece
+            return
+
+        tile_center = _clip_tile_center(ts_seconds)
+        use_tile = _clip_available(video_id, entry, tile_center)
+        file_name, api_key, clip_start = await _ensure_gemini_clip(
+            video_id=video_id,
+            entry=entry,
+            source_path=source_path,
+            center_seconds=tile_center if use_tile else ts_seconds,
+            timestamp=timestamp,
+            api_key=_get_api_key(x_google_api_key),
+        )
+        async for piece in _iterate_in_thread(
+            lambda: _stream_describe_at_timestamp(
+                gemini_file_name=file_name,
+                timestamp=timestamp,
+                api_key=api_key,
                 model_name=model,
                 user_prompt=prompt,
                 include_timestamp=bool(include_timestamp),
+                clip_start_seconds=clip_start if use_tile else None,
             )
-        
-        try:
-            text = await anyio.to_thread.run_sync(groq_work)
-        except HTTPException:
-            raise
-        except Exception as exc:
-            logger.error(
-                "groq smart-text failed (video_id=%s, model=%s, timestamp=%s): %s",
-                video_id,
-                model,
-                timestamp,
-                exc,
-                exc_info=True,
-            )
-            raise HTTPException(status_code=500, detail=f"Falha ao analisar com Groq: {str(exc)[:200]}") from exc
-        
-        return {"text": text}
-
-    # Default: Use Gemini
-    api_key = _get_api_key(x_google_api_key)
-    clip_key = f"{int(ts_seconds)}:{int(GEMINI_CLIP_SECONDS)}"
-    with _videos_lock:
-        cached = entry.clip_cache.get(clip_key)
+        ):
+            yield piece
 
-    if not cached:
-        clip_path = DATA_DIR / f"clip_{video_id}_{int(ts_seconds)}_{int(GEMINI_CLIP_SECONDS)}.mp4"
+    async def stream() -> AsyncIterator[str]:
+        parts: list[str] = []
         try:
-            _make_gemini_clip(
-                source_path=source_path,
-                timestamp_seconds=ts_seconds,
-                clip_seconds=GEMINI_CLIP_SECONDS,
-                out_path=clip_path,
-            )
-
-            def upload_work() -> str:
-                return _upload_video_to_gemini(clip_path, api_key)
-
-            cached = await anyio.to_thread.run_sync(upload_work)
-            with _videos_lock:
-                current = _videos.get(video_id)
-                if current and current.status == "ready":
-                    current.clip_cache[clip_key] = cached
-        except HTTPException:
-            raise
+            async for piece in tokens():
+                parts.append(piece)
+                yield _stream_event({"text": piece}, sse=True, event="token")
         except Exception as exc:
-            with _videos_lock:
-                current = _videos.get(video_id)
-                if current:
-                    current.error = str(exc)
-            logger.error(
-                "gemini clip upload failed (video_id=%s, timestamp=%s): %s",
-                video_id,
-                timestamp,
-                exc,
-                exc_info=True,
-            )
-            raise HTTPException(status_code=500, detail="Falha ao preparar/enviar clipe para o Gemini") from exc
-        finally:
-            try:
-                if clip_path.exists():
-                    clip_path.unlink()
-            except Exception:
-                pass
-
-    def work() -> str:
-        return _describe_at_timestamp(
-            gemini_file_name=str(cached),
-            timestamp=str(timestamp),
-            clip_seconds=int(GEMINI_CLIP_SECONDS),
-            api_key=api_key,
-            model_name=model,
-            user_prompt=prompt,
-            include_timestamp=bool(include_timestamp),
-        )
-
-    try:
-        text = await anyio.to_thread.run_sync(work)
-    except Exception as exc:
-        if isinstance(exc, HTTPException):
-            raise
-
-        # Normalize common Gemini errors so the frontend gets a meaningful status.
-        try:
-            import re
-            from google.api_core import exceptions as gexc  # type: ignore
-
-            def _retry_hint_from_message(message: str) -> str:
-                # Example: "Please retry in 13.644857575s."
-                m = re.search(r"retry in\s+([0-9]+(?:\.[0-9]+)?)s", message, flags=re.IGNORECASE)
-                if not m:
-                    return ""
-                seconds = m.group(1)
-                return f" Tente novamente em ~{seconds}s."
-
-            def _as_list(e: BaseException) -> list[BaseException]:
-                # AnyIO / Python may raise ExceptionGroup with multiple nested exceptions.
-                eg = getattr(e, "exceptions", None)
-                if isinstance(eg, list):
-                    return eg
-                return [e]
-
-            candidates: list[BaseException] = []
-            for one in _as_list(exc):
-                candidates.append(one)
-                cause = getattr(one, "__cause__", None)
-                if isinstance(cause, BaseException):
-                    candidates.append(cause)
-
-            def _msg(e: BaseException) -> str:
-                try:
-                    return str(e) or e.__class__.__name__
-                except Exception:
-                    return e.__class__.__name__
-
-            for one in candidates:
-                message = _msg(one)
-                if isinstance(one, getattr(gexc, "ResourceExhausted", ())) or (
-                    "quota" in message.lower() or "resourceexhausted" in message.lower() or " 429" in message
-                ):
-                    raise HTTPException(
-                        status_code=429,
-                        detail=(
-                            "Quota/limite do Gemini excedido (429). Verifique billing/limites do projeto e tente novamente."
-                            + _retry_hint_from_message(message)
-                        ),
-                    ) from exc
-
-            if isinstance(exc, getattr(gexc, "TooManyRequests", ())):
-                raise HTTPException(
-                    status_code=429,
-                    detail="Muitas requisições ao Gemini (429). Tente novamente em instantes.",
-                ) from exc
-
-            if isinstance(exc, getattr(gexc, "PermissionDenied", ())):
-                raise HTTPException(
-                    status_code=403,
-                    detail="Permissão negada pelo Gemini. Verifique se a API está habilitada e se a chave é válida.",
-                ) from exc
-
-            if isinstance(exc, getattr(gexc, "NotFound", ())):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Modelo do Gemini não encontrado/suportado. Ajuste o model para um valor retornado por list_models().",
-                ) from exc
-
-            if isinstance(exc, getattr(gexc, "InvalidArgument", ())):
-                raise HTTPException(status_code=400, detail="Parâmetros inválidos ao chamar o Gemini.") from exc
-        except Exception:
-            # If google-api-core isn't available or anything goes wrong while mapping,
-            # fall back to the generic handler below.
-            pass
-
-        with _videos_lock:
-            current = _videos.get(video_id)
-            if current:
-                current.error = str(exc)
-        logger.error(
-            "gemini smart-text failed (video_id=%s, model=%s, timestamp=%s): %s",
-            video_id,
-            model,
-            timestamp,
-            exc,
-            exc_info=True,
-        )
-        raise HTTPException(status_code=500, detail="Falha ao analisar com Gemini") from exc
+            mapped = exc if isinstance(exc, HTTPException) else (None if use_groq else _gemini_http_error(exc))
+            if mapped is None:
+                logger.error("smart-text stream failed (video_id=%s, model=%s): %s", video_id, model, exc, exc_info=True)
+                mapped = HTTPException(status_code=500, detail=f"Falha ao gerar descrição: {str(exc)[:200]}")
+            yield _stream_event({"detail": mapped.detail, "status_code": mapped.status_code}, sse=True, event="error")
+            return
+        done: dict[str, Any] = {"text": "".join(parts).strip(), "model": model}
+        if rerouted_from:
+            done["rerouted_from"] = rerouted_from
+        yield _stream_event(done, sse=True, event="done")
 
-    return {"text": text}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=_STREAM_HEADERS)
 
 
 @app.post("/export")
@@ -1581,6 +3734,7 @@ async def export_documentation(
     images: list[UploadFile] = File(default=[]),
     image_name_prefix: str | None = Form(default=None),
     output_format: str | None = Form(default="markdown"),
+    animation_format: str | None = Form(default="webp"),
 ):
     parsed_steps = _parse_steps(steps)
 
@@ -1588,6 +3742,11 @@ async def export_documentation(
     if fmt not in {"markdown", "html", "docx", "plain", "pdf"}:
         raise HTTPException(status_code=400, detail="Invalid output_format. Use markdown, html, docx, pdf, or plain.")
 
+    # Animated (GIF) steps: compact animation for markdown/html, poster frame for docx/pdf.
+    anim_fmt = (animation_format or "webp").strip().lower()
+    if anim_fmt not in {"webp", "mp4", "gif"}:
+        raise HTTPException(status_code=400, detail="Invalid animation_format. Use webp, mp4, or gif.")
+
     prefix = _sanitize_image_prefix(image_name_prefix)
 
     expected_images = sum(1 for s in parsed_steps if s.has_image)
@@ -1602,37 +3761,57 @@ async def export_documentation(
 
     total_bytes = 0
     processed_images: list[bytes] = []
+    processed_animations: list[AnimatedStepAsset | None] = []
 
     for upload in images:
         image_bytes = await upload.read()
         if not image_bytes:
             raise HTTPException(status_code=400, detail="One or more images are empty")
 
-        if len(image_bytes) > MAX_SINGLE_IMAGE_BYTES:
+        is_gif = image_bytes[:6] in _GIF_MAGICS
+        if len(image_bytes) > (MAX_GIF_BYTES if is_gif else MAX_SINGLE_IMAGE_BYTES):
             raise HTTPException(status_code=413, detail="One or more images are too large")
 
         total_bytes += len(image_bytes)
         if total_bytes > MAX_TOTAL_IMAGE_BYTES:
             raise HTTPException(status_code=413, detail="Export payload too large")
 
-        processed_images.append(_normalize_image_to_png(image_bytes))
+        if is_gif:
+            poster, animation = await anyio.to_thread.run_sync(_prepare_animated_step, image_bytes, anim_fmt, fmt)
+            processed_images.append(poster)
+            processed_animations.append(animation)
+        else:
+            processed_images.append(_normalize_image_to_png(image_bytes))
+            processed_animations.append(None)
 
     md_lines: list[str] = ["# Tutorial\n"]
 
     step_index_to_image: dict[int, bytes] = {}
+    step_index_to_animation: dict[int, AnimatedStepAsset] = {}
     image_cursor = 0
     for step_idx, step in enumerate(parsed_steps, start=1):
         if step.has_image:
             if image_cursor >= len(processed_images):
                 raise HTTPException(status_code=400, detail="Missing image for one or more steps")
             step_index_to_image[step_idx] = processed_images[image_cursor]
+            animation = processed_animations[image_cursor]
+            if animation is not None:
+                step_index_to_animation[step_idx] = animation
             image_cursor += 1
 
     for i, step in enumerate(parsed_steps, start=1):
         md_lines.append(f"## Passo {i}\n")
         description = step.description.strip() or "(sem descrição)"
         md_lines.append(description + "\n")
-        if step.has_image:
+        animation = step_index_to_animation.get(i)
+        if animation is not None and animation.ext == "mp4":
+            md_lines.append(
+                f'<video src="./img/{prefix}{i:02d}.mp4" poster="./img/{prefix}{i:02d}.png" '
+                'autoplay loop muted playsinline></video>\n'
+            )
+        elif animation is not None:
+            md_lines.append(f"![Passo {i}](./img/{prefix}{i:02d}.{animation.ext})\n")
+        elif step.has_image:
             md_lines.append(f"![Passo {i}](./img/{prefix}{i:02d}.png)\n")
 
     if fmt == "plain":
@@ -1641,7 +3820,9 @@ async def export_documentation(
             lines.append(f"Passo {i}")
             lines.append("-" * 7)
             lines.append((step.description or "").strip() or "(sem descrição)")
-            if step.has_image:
+            if i in step_index_to_animation:
+                lines.append(f"[animação: {prefix}{i:02d}.{step_index_to_animation[i].ext}]")
+            elif step.has_image:
                 lines.append(f"[imagem: {prefix}{i:02d}.png]")
             lines.append("")
 
@@ -1661,7 +3842,7 @@ async def export_documentation(
         parts.append(
             "<style>body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,Arial,sans-serif;max-width:900px;margin:24px auto;padding:0 16px;line-height:1.5}"  # noqa: E501
             "h1{margin:0 0 16px} h2{margin:24px 0 8px} .step{margin-bottom:18px}"  # noqa: E501
-            "img{max-width:100%;height:auto;border:1px solid #ddd;border-radius:8px} pre{background:#f6f8fa;padding:12px;border-radius:8px;overflow:auto}"  # noqa: E501
+            "img,video{max-width:100%;height:auto;border:1px solid #ddd;border-radius:8px} pre{background:#f6f8fa;padding:12px;border-radius:8px;overflow:auto}"  # noqa: E501
             ".muted{color:#666}</style>"
         )
         parts.append("</head>")
@@ -1678,7 +3859,18 @@ async def export_documentation(
                 .replace(">", "&gt;")
             )
             parts.append(f"<p>{esc}</p>")
-            if step.has_image:
+            animation = step_index_to_animation.get(i)
+            if animation is not None:
+                anim_b64 = base64.b64encode(animation.data).decode("ascii")
+                if animation.ext == "mp4":
+                    poster_b64 = base64.b64encode(step_index_to_image[i]).decode("ascii")
+                    parts.append(
+                        f'<video autoplay loop muted playsinline poster="data:image/png;base64,{poster_b64}" '
+                        f'src="data:{animation.mime};base64,{anim_b64}"></video>'
+                    )
+                else:
+                    parts.append(f'<img alt="Passo {i}" src="data:{animation.mime};base64,{anim_b64}"/>')
+            elif step.has_image:
                 img_bytes = step_index_to_image.get(i)
                 if img_bytes:
                     b64 = base64.b64encode(img_bytes).decode("ascii")
@@ -1831,6 +4023,11 @@ async def export_documentation(
     with zipfile.ZipFile(zip_buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
         zf.writestr("tutorial.md", "\n".join(md_lines).strip() + "\n")
         for step_idx, image_bytes in step_index_to_image.items():
+            animation = step_index_to_animation.get(step_idx)
+            if animation is not None:
+                zf.writestr(f"img/{prefix}{step_idx:02d}.{animation.ext}", animation.data)
+                if animation.ext != "mp4":
+                    continue  # the poster is only referenced by <video>
             zf.writestr(f"img/{prefix}{step_idx:02d}.png", image_bytes)
 
     zip_buffer.seek(0)
@@ -1873,9 +4070,83 @@ async def enhance_document(
     - Tabela de Problemas Comuns e Soluções
     """
     from enhance import enhance_document_with_gemini
+
+    api_key, title, validated_steps = await _parse_enhance_request(request, x_google_api_key)
+    
+    # Call enhancement function (Gemini) off the event loop: it may queue on the rate limiter.
+    def work() -> str:
+        return enhance_document_with_gemini(
+            title=title,
+            steps=validated_steps,
+            api_key=api_key,
+            model=DEFAULT_GEMINI_MODEL,
+        )
+
+    try:
+        enhanced_markdown = await anyio.to_thread.run_sync(work)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    except Exception as exc:
+        logger.error("Erro ao gerar documento com Gemini: %s", exc, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao gerar documento: {str(exc)[:200]}"
+        ) from exc
     
+    return {"markdown": enhanced_markdown}
+
+
+@app.post("/enhance-document/stream")
+async def enhance_document_stream(
+    request: Request,
+    user: CurrentAuthorizedUser,
+    x_google_api_key: str | None = Header(default=None, alias="X-Google-Api-Key"),
+):
+    """
+    Versão em streaming (Server-Sent Events) de /enhance-document.
+
+    Mesmo body JSON. Eventos: "token" ({"text": trecho}) à medida que o
+    Gemini gera o documento, depois "done" ({"markdown": documento completo})
+    ou "error" ({"detail", "status_code"}).
+    """
+    from enhance import stream_enhance_document_with_gemini
+
+    api_key, title, validated_steps = await _parse_enhance_request(request, x_google_api_key)
+
+    async def stream() -> AsyncIterator[str]:
+        parts: list[str] = []
+        try:
+            async for piece in _iterate_in_thread(
+                lambda: stream_enhance_document_with_gemini(
+                    title=title,
+                    steps=validated_steps,
+                    api_key=api_key,
+                    model=DEFAULT_GEMINI_MODEL,
+                )
+            ):
+                parts.append(piece)
+                yield _stream_event({"text": piece}, sse=True, event="token")
+        except Exception as exc:
+            if not isinstance(exc, RuntimeError):
+                logger.error("Erro ao gerar documento com Gemini (stream): %s", exc, exc_info=True)
+            detail = str(exc) if isinstance(exc, RuntimeError) else f"Erro ao gerar documento: {str(exc)[:200]}"
+            yield _stream_event({"detail": detail, "status_code": 500}, sse=True, event="error")
+            return
+        yield _stream_event({"markdown": "".join(parts)}, sse=True, event="done")
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=_STREAM_HEADERS)
+
+
+async def _parse_enhance_request(
+    request: Request, x_google_api_key: str | None
+) -> tuple[str, str, list[dict[str, Any]]]:
+    """(api_key, title, validated_steps) for the /enhance-document endpoints."""
     # Get API key (Gemini)
     api_key = _get_api_key(x_google_api_key)
+    try:
+        breakers.check("gemini", _normalize_gemini_model(DEFAULT_GEMINI_MODEL))
+    except CircuitOpenError as exc:
+        raise _provider_unavailable(exc) from exc
     
     # Parse request body
     try:
@@ -1905,25 +4176,7 @@ async def enhance_document(
             })
         else:
             raise HTTPException(status_code=400, detail=f"Passo {i+1} inválido")
-    
-    # Call enhancement function (Gemini)
-    try:
-        enhanced_markdown = enhance_document_with_gemini(
-            title=title,
-            steps=validated_steps,
-            api_key=api_key,
-            model=DEFAULT_GEMINI_MODEL,
-        )
-    except RuntimeError as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
-    except Exception as exc:
-        logger.error("Erro ao gerar documento com Gemini: %s", exc, exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Erro ao gerar documento: {str(exc)[:200]}"
-        ) from exc
-    
-    return {"markdown": enhanced_markdown}
+    return api_key, title, validated_steps
 
 
 
@@ -2124,13 +4377,14 @@ async def describe_gif(
     document_title: str | None = Form(default=None),
     model: str | None = Form(default=None),
     x_groq_api_key: str | None = Header(default=None, alias="X-Groq-Api-Key"),
+    x_cache_bypass: str | None = Header(default=None, alias=result_cache.BYPASS_HEADER),
 ):
     """
     Analisa um GIF e devolve uma legenda/instrução de passo (Passo X) gerada pela IA Groq.
     
     Multipart: file (GIF obrigatório), document_context (opcional), document_title (opcional).
-    Header: X-Groq-Api-Key (ou GROQ_API_KEY no .env).
-    Resposta: { "description": "..." }
+    Header: X-Groq-Api-Key (ou GROQ_API_KEY no .env); X-Cache-Bypass: 1 ignora o cache de resultados.
+    Resposta: { "description": "..." } (com "cached": true quando veio do cache)
     """
     if not file.filename or not file.filename.lower().endswith((".gif",)):
         raise HTTPException(
@@ -2147,7 +4401,27 @@ async def describe_gif(
     if len(gif_bytes) < 100:
         raise HTTPException(status_code=400, detail="Arquivo GIF inválido ou vazio.")
 
+    bypass = result_cache.bypass_requested(x_cache_bypass)
+    cache_key: str | None = None
+    if result_cache.ENABLED:
+        cache_key = result_cache.make_key(
+            "describe-gif",
+            result_cache.bytes_digest(gif_bytes),
+            {
+                "model": (model or DEFAULT_GROQ_VISION_MODEL).strip(),
+                "document_context": " ".join((document_context or "").split()),
+                "document_title": " ".join((document_title or "").split()),
+            },
+        )
+        cached = None if bypass else await anyio.to_thread.run_sync(result_store.get, cache_key)
+        if cached is not None:
+            return {"description": cached.get("description") or "GIF animado", "cached": True}
+
     api_key = _get_groq_api_key(x_groq_api_key)
+    try:
+        breakers.check("groq", model or DEFAULT_GROQ_VISION_MODEL)
+    except CircuitOpenError as exc:
+        raise _provider_unavailable(exc) from exc
 
     def work() -> str:
         return _describe_gif_with_groq(
@@ -2169,7 +4443,10 @@ async def describe_gif(
             detail=f"Falha ao analisar GIF com Groq: {str(exc)[:200]}",
         ) from exc
 
-    return {"description": (description or "").strip() or "GIF animado"}
+    description = (description or "").strip()
+    if cache_key is not None and description:
+        await anyio.to_thread.run_sync(result_store.put, cache_key, {"description": description})
+    return {"description": description or "GIF animado"}
 
 
 # ---------------------------------------------------------------------------
@@ -2200,6 +4477,10 @@ async def format_and_export(
             status_code=400,
             detail="output_format deve ser 'docx' ou 'pdf'.",
         )
+    try:
+        breakers.check("groq", DEFAULT_GROQ_VISION_MODEL)
+    except CircuitOpenError as exc:
+        raise _provider_unavailable(exc) from exc
 
     # Extrair texto (ficheiro ou markdown)
     try:
@@ -2217,11 +4498,14 @@ async def format_and_export(
 
     # Formatar com Groq (template passo a passo)
     api_key = _get_groq_api_key(x_groq_api_key)
-    try:
-        formatted_md = format_document_like_template(
+    def work() -> str:
+        return format_document_like_template(
             raw_text=raw_text,
             api_key=api_key,
         )
+
+    try:
+        formatted_md = await anyio.to_thread.run_sync(work)
     except RuntimeError as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
     except Exception as exc:
@@ -2334,6 +4618,10 @@ async def generate_documentation(
 
     # Get API key
     api_key = _get_groq_api_key(x_groq_api_key)
+    try:
+        breakers.check("groq", DEFAULT_GROQ_VISION_MODEL)
+    except CircuitOpenError as exc:
+        raise _provider_unavailable(exc) from exc
 
     # Generate structured documentation
     def work() -> dict:
@@ -0,0 +1,287 @@
+"""
+Pooled provider clients (Groq and Gemini), keyed by provider + API key.
+
+Building a `Groq(...)` client per call opens a fresh HTTP connection pool (and
+TLS handshake) every time, and `genai.configure` mutates process-global state,
+so two users with different X-Google-Api-Key values race each other. This
+module keeps one long-lived client per (provider, key), with keep-alive pools,
+HTTP/2 when `h2` is installed, and bounded idle/LRU eviction.
+
+Usage:
+
+    with groq_client(api_key) as client:
+        client.chat.completions.create(...)
+
+    with gemini_client(api_key) as gemini:
+        model = gemini.generative_model("models/gemini-2.5-flash")
+        model.generate_content(...)
+
+Leases are reference counted: an evicted client is only closed once the last
+in-flight call that borrowed it finishes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import logging
+import mimetypes
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from env_config import env_int
+
+logger = logging.getLogger("clipbuilder.provider_clients")
+
+
+CLIENT_IDLE_SECONDS = env_int("CLIPBUILDER_PROVIDER_CLIENT_IDLE_SECONDS", 300)
+MAX_CLIENTS = env_int("CLIPBUILDER_PROVIDER_MAX_CLIENTS", 16)
+MAX_CONNECTIONS_PER_CLIENT = env_int("CLIPBUILDER_PROVIDER_MAX_CONNECTIONS", 20)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _check_gemini_private_api() -> None:
+    """GeminiClient relies on google-generativeai internals (tested with 0.8.x); fail at import, not mid-request."""
+    try:
+        from google.generativeai import client as genai_client  # type: ignore
+    except ImportError:
+        return  # Gemini not installed: main reports it per request
+
+    manager = getattr(genai_client, "_ClientManager", None)
+    if manager is None or not all(hasattr(manager, name) for name in ("configure", "get_default_client")):
+        raise ImportError(
+            "google-generativeai sem a API interna _ClientManager usada por provider_clients.GeminiClient; "
+            "instale a versão testada: pip install 'google-generativeai>=0.8.4,<0.9'"
+        )
+
+
+_check_gemini_private_api()
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Short, non-reversible id for an API key (safe for logs and metrics)."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+class GeminiClient:
+    """Per-key Gemini client that never touches `genai.configure`.
+
+    google-generativeai keeps its clients in a module-level `_ClientManager`;
+    we build a private manager per API key and inject its generative client
+    into each `GenerativeModel`, so concurrent requests with different keys
+    stay isolated. The underlying gRPC channel (HTTP/2) is reused across calls.
+    """
+
+    def __init__(self, api_key: str) -> None:
+        from google.generativeai.client import _ClientManager  # type: ignore
+
+        self._manager = _ClientManager()
+        self._manager.configure(api_key=api_key)
+
+    def generative_model(self, model_name: str, **kwargs: Any) -> Any:
+        import google.generativeai as genai
+
+        model = genai.GenerativeModel(model_name, **kwargs)
+        model._client = self._manager.get_default_client("generative")
+        return model
+
+    def upload_file(self, path: Path) -> Any:
+        from google.generativeai.types import file_types  # type: ignore
+
+        path = Path(path)
+        mime_type, _ = mimetypes.guess_type(str(path))
+        proto = self._manager.get_default_client("file").create_file(
+            path=path,
+            mime_type=mime_type,
+            display_name=path.name,
+        )
+        return file_types.File(proto)
+
+    def get_file(self, name: str) -> Any:
+        from google.generativeai.types import file_types  # type: ignore
+
+        return file_types.File(self._manager.get_default_client("file").get_file(name=name))
+
+    def close(self) -> None:
+        for client in list(getattr(self._manager, "clients", {}).values()):
+            transport = getattr(client, "transport", None) or getattr(client, "_transport", None)
+            try:
+                if transport is not None:
+                    transport.close()
+            except Exception:
+                pass
+
+
+def _build_groq_client(api_key: str) -> Any:
+    import httpx
+    from groq import Groq
+
+    http_client = httpx.Client(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS_PER_CLIENT,
+            max_keepalive_connections=MAX_CONNECTIONS_PER_CLIENT,
+            keepalive_expiry=float(CLIENT_IDLE_SECONDS),
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        follow_redirects=True,
+    )
+    # max_retries=0: 429s are retried by rate_limiter, which learns from them; SDK-level
+    # retries would hide throttling and multiply load during provider incidents.
+    return Groq(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def _close_client(client: Any) -> None:
+    try:
+        client.close()
+    except Exception as exc:
+        logger.debug("failed to close provider client: %s", exc)
+
+
+@dataclass
+class _Entry:
+    provider: str
+    client: Any
+    created_at: float
+    last_used: float
+    leases: int = 0
+    uses: int = 0
+    evicted: bool = False
+
+
+class ProviderClientRegistry:
+    """Thread-safe registry of long-lived provider clients.
+
+    Entries idle for more than `idle_seconds` are evicted on the next access,
+    and the registry never holds more than `max_clients` entries (LRU).
+    """
+
+    def __init__(self, *, idle_seconds: int, max_clients: int) -> None:
+        self.idle_seconds = idle_seconds
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._factories: dict[str, Callable[[str], Any]] = {
+            "groq": _build_groq_client,
+            "gemini": GeminiClient,
+        }
+
+    @contextmanager
+    def lease(self, provider: str, api_key: str) -> Iterator[Any]:
+        entry = self._acquire(provider, api_key)
+        try:
+            yield entry.client
+        finally:
+            self._release(entry)
+
+    def _acquire(self, provider: str, api_key: str) -> _Entry:
+        factory = self._factories[provider]
+        cache_key = (provider, key_fingerprint(api_key))
+        now = time.monotonic()
+        with self._lock:
+            to_close = self._evict_locked(now)
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                entry.last_used = now
+                entry.leases += 1
+                entry.uses += 1
+        for old in to_close:
+            _close_client(old)
+        if entry is not None:
+            return entry
+
+        # Build outside the lock: client construction may import modules / do I/O.
+        client = factory(api_key)
+        with self._lock:
+            existing = self._entries.get(cache_key)
+            if existing is not None:
+                # Another thread won the race; keep theirs.
+                existing.last_used = now
+                existing.leases += 1
+                existing.uses += 1
+                self._entries.move_to_end(cache_key)
+                entry = existing
+            else:
+                entry = _Entry(provider=provider, client=client, created_at=now, last_used=now, leases=1, uses=1)
+                self._entries[cache_key] = entry
+                client = None
+            to_close = self._evict_locked(now)
+        if client is not None:
+            _close_client(client)
+        for old in to_close:
+            _close_client(old)
+        return entry
+
+    def _release(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            close_now = entry.evicted and entry.leases <= 0
+        if close_now:
+            _close_client(entry.client)
+
+    def _evict_locked(self, now: float) -> list[Any]:
+        """Drop idle and over-capacity entries; return clients safe to close now."""
+        doomed: list[tuple[str, str]] = [
+            key for key, entry in self._entries.items() if now - entry.last_used > self.idle_seconds and entry.leases <= 0
+        ]
+        overflow = len(self._entries) - len(doomed) - self.max_clients
+        if overflow > 0:
+            for key in self._entries:  # oldest first
+                if overflow <= 0:
+                    break
+                if key not in doomed:
+                    doomed.append(key)
+                    overflow -= 1
+
+        closable: list[Any] = []
+        for key in doomed:
+            entry = self._entries.pop(key)
+            entry.evicted = True
+            if entry.leases <= 0:
+                closable.append(entry.client)
+        return closable
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.evicted = True
+            if entry.leases <= 0:
+                _close_client(entry.client)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "provider": provider,
+                    "key": fingerprint,
+                    "uses": entry.uses,
+                    "in_flight": entry.leases,
+                    "idle_seconds": round(now - entry.last_used, 1),
+                    "age_seconds": round(now - entry.created_at, 1),
+                }
+                for (provider, fingerprint), entry in self._entries.items()
+            ]
+
+
+registry = ProviderClientRegistry(idle_seconds=CLIENT_IDLE_SECONDS, max_clients=MAX_CLIENTS)
+
+
+def groq_client(api_key: str):
+    """Lease the pooled Groq client for `api_key` (context manager)."""
+    return registry.lease("groq", api_key)
+
+
+def gemini_client(api_key: str):
+    """Lease the pooled, per-key Gemini client for `api_key` (context manager)."""
+    return registry.lease("gemini", api_key)
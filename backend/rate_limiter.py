@@ -0,0 +1,325 @@
+"""
+Adaptive token-bucket rate limiting for provider calls (Gemini / Groq).
+
+One bucket per (provider, model, API key). Callers block in FIFO order until a
+token is available instead of failing; a 429 (or a "retry in Xs" hint) halves
+the bucket's rate and pauses it until the hinted time, and successes grow the
+rate back towards the configured ceiling (AIMD). This keeps us close to each
+provider's quota without every worker retrying at once.
+
+Model names and keys may come from request headers, so buckets with no queued
+callers and no active pause are dropped after CLIPBUILDER_RATE_LIMIT_IDLE_SECONDS
+and at most CLIPBUILDER_RATE_LIMIT_MAX_BUCKETS are kept (least recently used first).
+
+Usage (from worker threads, never from the event loop):
+
+    response = limiter.run("groq", model, api_key, lambda: client.chat.completions.create(...))
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, TypeVar
+
+from env_config import env_float, env_int
+from provider_clients import key_fingerprint
+
+logger = logging.getLogger("clipbuilder.rate_limiter")
+
+T = TypeVar("T")
+
+
+# Requests per minute allowed per (provider, model, key) before adaptation.
+PROVIDER_RPM: dict[str, float] = {
+    "gemini": env_float("CLIPBUILDER_GEMINI_RPM", 60.0),
+    "groq": env_float("CLIPBUILDER_GROQ_RPM", 30.0),
+}
+BURST = env_float("CLIPBUILDER_RATE_LIMIT_BURST", 5.0)
+# How long a caller may queue for a token before we give up with a 429.
+MAX_WAIT_SECONDS = env_float("CLIPBUILDER_RATE_LIMIT_MAX_WAIT_SECONDS", 120.0)
+MAX_ATTEMPTS = 3
+IDLE_SECONDS = env_float("CLIPBUILDER_RATE_LIMIT_IDLE_SECONDS", 600.0)
+MAX_BUCKETS = env_int("CLIPBUILDER_RATE_LIMIT_MAX_BUCKETS", 256)
+
+_MIN_RATE_FRACTION = 0.05  # never adapt below 5% of the configured rate
+_RECOVERY_FRACTION = 0.05  # additive increase per success (fraction of ceiling)
+
+_RETRY_IN_RE = re.compile(
+    r"(?:retry|try again) in\s+(?:(\d+)h)?\s*(?:(\d+)m(?!s))?\s*(?:([0-9]+(?:\.[0-9]+)?)(s|ms))?",
+    flags=re.IGNORECASE,
+)
+
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when a call could not get a token within the allowed wait."""
+
+    def __init__(self, provider: str, model: str, retry_after: float) -> None:
+        self.provider = provider
+        self.model = model
+        self.retry_after = max(0.0, retry_after)
+        super().__init__(
+            f"Limite de requisições do provedor {provider} ({model}) atingido. "
+            f"Tente novamente em ~{int(round(self.retry_after)) or 1}s."
+        )
+
+
+def parse_retry_seconds(message: str) -> float | None:
+    """Extract "retry in 13.6s" / "try again in 1m2.5s" style hints from an error message."""
+    m = _RETRY_IN_RE.search(message or "")
+    if not m or not any(m.groups()[:3]):
+        return None
+    hours, minutes, amount, unit = m.groups()
+    seconds = float(hours or 0) * 3600.0 + float(minutes or 0) * 60.0
+    if amount:
+        seconds += float(amount) / (1000.0 if (unit or "").lower() == "ms" else 1.0)
+    return seconds if seconds > 0 else None
+
+
+def retry_after_seconds(exc: BaseException) -> float | None:
+    """Best-effort retry delay from a provider exception (Retry-After header or message)."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            raw = headers.get("retry-after")
+            if raw:
+                value = float(raw)
+                if value > 0:
+                    return value
+        except (TypeError, ValueError):
+            pass
+    return parse_retry_seconds(str(exc))
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """True for 429 / quota-exhausted errors from Groq, Gemini or their HTTP layers."""
+    if getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429:
+        return True
+    name = exc.__class__.__name__
+    if name in {"RateLimitError", "ResourceExhausted", "TooManyRequests"}:
+        return True
+    message = str(exc).lower()
+    return " 429" in message or message.startswith("429") or "rate limit" in message or "resourceexhausted" in message
+
+
+@dataclass
+class _Bucket:
+    ceiling: float  # tokens per second (configured)
+    rate: float  # tokens per second (current, adaptive)
+    capacity: float
+    tokens: float
+    updated_at: float
+    last_used: float = 0.0
+    blocked_until: float = 0.0
+    consecutive_throttles: int = 0
+    queue: deque[int] = field(default_factory=deque)
+    granted: int = 0
+    throttled: int = 0
+    timeouts: int = 0
+    total_wait_seconds: float = 0.0
+
+    def refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+
+class ProviderRateLimiter:
+    """Per (provider, model, key) adaptive token buckets with fair FIFO queueing."""
+
+    def __init__(
+        self,
+        *,
+        rpm: dict[str, float],
+        burst: float,
+        max_wait_seconds: float,
+        idle_seconds: float = IDLE_SECONDS,
+        max_buckets: int = MAX_BUCKETS,
+    ) -> None:
+        self.rpm = dict(rpm)
+        self.burst = max(1.0, burst)
+        self.max_wait_seconds = max_wait_seconds
+        self.idle_seconds = idle_seconds
+        self.max_buckets = max(1, max_buckets)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._buckets: OrderedDict[tuple[str, str, str], _Bucket] = OrderedDict()
+        self._tickets = itertools.count()
+
+    def _bucket_locked(self, provider: str, model: str, api_key: str, now: float) -> _Bucket:
+        key = (provider, model or "", key_fingerprint(api_key))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._evict_locked(now)
+            ceiling = self.rpm.get(provider, 60.0) / 60.0
+            bucket = _Bucket(ceiling=ceiling, rate=ceiling, capacity=self.burst, tokens=self.burst, updated_at=now)
+            self._buckets[key] = bucket
+        else:
+            self._buckets.move_to_end(key)
+        bucket.last_used = now
+        return bucket
+
+    def _evict_locked(self, now: float) -> None:
+        """Drop idle buckets, then the least recently used ones beyond max_buckets (never one in use)."""
+        evictable = [key for key, b in self._buckets.items() if not b.queue and b.blocked_until <= now]
+        overflow = len(self._buckets) + 1 - self.max_buckets
+        for key in evictable:  # oldest first
+            if now - self._buckets[key].last_used > self.idle_seconds or overflow > 0:
+                del self._buckets[key]
+                overflow -= 1
+
+    def acquire(self, provider: str, model: str, api_key: str, *, timeout: float | None = None) -> float:
+        """Block until a token is available (FIFO per bucket). Returns seconds waited."""
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            bucket = self._bucket_locked(provider, model, api_key, start)
+            ticket = next(self._tickets)
+            bucket.queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    bucket.refill(now)
+                    at_head = bucket.queue[0] == ticket
+                    if at_head and now >= bucket.blocked_until and bucket.tokens >= 1.0:
+                        bucket.tokens -= 1.0
+                        bucket.granted += 1
+                        waited = now - start
+                        bucket.total_wait_seconds += waited
+                        return waited
+
+                    if bucket.blocked_until > now:
+                        wait_for = bucket.blocked_until - now
+                    elif at_head:
+                        wait_for = (1.0 - bucket.tokens) / max(bucket.rate, 1e-6)
+                    else:
+                        # Our turn depends on callers ahead of us; they notify on exit.
+                        wait_for = 1.0
+
+                    # Fail fast when the provider told us to back off for longer than we may wait.
+                    if now + wait_for > deadline and (bucket.blocked_until > deadline or at_head):
+                        bucket.timeouts += 1
+                        raise RateLimitTimeout(provider, model, max(wait_for, bucket.blocked_until - now))
+                    if now >= deadline:
+                        bucket.timeouts += 1
+                        raise RateLimitTimeout(provider, model, wait_for)
+                    self._cond.wait(timeout=max(0.01, min(wait_for, deadline - now)))
+            finally:
+                try:
+                    bucket.queue.remove(ticket)
+                except ValueError:
+                    pass
+                self._cond.notify_all()
+
+    def record_throttle(self, provider: str, model: str, api_key: str, retry_after: float | None) -> float:
+        """Halve the bucket's rate and pause it. Returns the pause applied (seconds)."""
+        now = time.monotonic()
+        with self._cond:
+            bucket = self._bucket_locked(provider, model, api_key, now)
+            bucket.throttled += 1
+            bucket.consecutive_throttles += 1
+            bucket.rate = max(bucket.ceiling * _MIN_RATE_FRACTION, bucket.rate * 0.5)
+            bucket.tokens = 0.0
+            if retry_after is None:
+                # Exponential backoff with jitter when the provider gives no hint.
+                retry_after = min(60.0, 2.0 ** bucket.consecutive_throttles) * random.uniform(0.8, 1.2)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            self._cond.notify_all()
+        logger.warning(
+            "rate limited by %s (model=%s, key=%s): pausing %.1fs, rate now %.2f rpm",
+            provider,
+            model,
+            key_fingerprint(api_key),
+            retry_after,
+            bucket.rate * 60.0,
+        )
+        return retry_after
+
+    def record_success(self, provider: str, model: str, api_key: str) -> None:
+        now = time.monotonic()
+        with self._cond:
+            bucket = self._bucket_locked(provider, model, api_key, now)
+            bucket.consecutive_throttles = 0
+            if bucket.rate < bucket.ceiling:
+                bucket.rate = min(bucket.ceiling, bucket.rate + bucket.ceiling * _RECOVERY_FRACTION)
+
+    def cooldown_remaining(self, provider: str, api_key: str) -> float:
+        """Longest pause currently applied to any model bucket of this key."""
+        fingerprint = key_fingerprint(api_key)
+        now = time.monotonic()
+        with self._lock:
+            return max(
+                (
+                    b.blocked_until - now
+                    for (p, _m, f), b in self._buckets.items()
+                    if p == provider and f == fingerprint and b.blocked_until > now
+                ),
+                default=0.0,
+            )
+
+    def queued(self, provider: str, model: str) -> int:
+        """Callers currently waiting for a token on any key of provider/model."""
+        with self._lock:
+            return sum(
+                len(b.queue) for (p, m, _f), b in self._buckets.items() if p == provider and m == (model or "")
+            )
+
+    def run(
+        self,
+        provider: str,
+        model: str,
+        api_key: str,
+        fn: Callable[[], T],
+        *,
+        attempts: int = MAX_ATTEMPTS,
+    ) -> T:
+        """Call `fn` under the bucket, retrying 429s after the learned backoff."""
+        for attempt in range(max(1, attempts)):
+            self.acquire(provider, model, api_key)
+            try:
+                result = fn()
+            except Exception as exc:
+                if not is_rate_limit_error(exc):
+                    raise
+                self.record_throttle(provider, model, api_key, retry_after_seconds(exc))
+                if attempt + 1 >= attempts:
+                    raise
+                continue
+            self.record_success(provider, model, api_key)
+            return result
+        raise AssertionError("unreachable")
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            out: list[dict[str, Any]] = []
+            for (provider, model, fingerprint), b in self._buckets.items():
+                b.refill(now)
+                out.append(
+                    {
+                        "provider": provider,
+                        "model": model,
+                        "key": fingerprint,
+                        "rpm_limit": round(b.ceiling * 60.0, 2),
+                        "rpm_current": round(b.rate * 60.0, 2),
+                        "tokens": round(b.tokens, 2),
+                        "queued": len(b.queue),
+                        "paused_seconds": round(max(0.0, b.blocked_until - now), 1),
+                        "granted": b.granted,
+                        "throttled": b.throttled,
+                        "timeouts": b.timeouts,
+                        "avg_wait_seconds": round(b.total_wait_seconds / b.granted, 3) if b.granted else 0.0,
+                    }
+                )
+            return out
+
+
+limiter = ProviderRateLimiter(rpm=PROVIDER_RPM, burst=BURST, max_wait_seconds=MAX_WAIT_SECONDS)
@@ -0,0 +1,142 @@
+"""
+Persistent exact-match cache of AI results (smart-text captions, GIF and range descriptions).
+
+Keys are the content hash of the input plus the normalized options, stored in
+SQLite in the data directory with a TTL and an LRU size bound:
+
+    key = make_key("smart-text", file_digest(path), {"t": 65, "options": options_key})
+    hit = cache.get(key)          # dict, or None
+    cache.put(key, {"text": text})
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from env_config import env_flag, env_int, truthy
+
+logger = logging.getLogger("clipbuilder.result_cache")
+
+
+ENABLED = env_flag("CLIPBUILDER_RESULT_CACHE", True)
+TTL_SECONDS = env_int("CLIPBUILDER_RESULT_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+MAX_ENTRIES = env_int("CLIPBUILDER_RESULT_CACHE_MAX_ENTRIES", 5000)
+BYPASS_HEADER = "X-Cache-Bypass"
+# Expired and least recently used rows are pruned at most this often (not on every write).
+EVICT_INTERVAL_SECONDS = 300.0
+
+
+def bypass_requested(value: str | None) -> bool:
+    return truthy(value)
+
+
+_digest_lock = threading.Lock()
+_digests: dict[str, tuple[int, int, str]] = {}
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a file's content, computed once per file version (mtime, size)."""
+    stat = path.stat()
+    with _digest_lock:
+        cached = _digests.get(str(path))
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    value = digest.hexdigest()
+    with _digest_lock:
+        _digests[str(path)] = (stat.st_mtime_ns, stat.st_size, value)
+    return value
+
+
+def bytes_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(kind: str, content_digest: str, options: dict[str, Any]) -> str:
+    raw = json.dumps({"kind": kind, "content": content_digest, "options": options}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed key -> JSON value store with TTL and LRU size bound (blocking: call it from a worker thread)."""
+
+    def __init__(self, path: Path, *, ttl_seconds: int, max_entries: int) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._last_evicted = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        return self._conn
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                row = db.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttl_seconds:
+                    if row is not None:
+                        db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return json.loads(row[0])
+            except (sqlite3.Error, ValueError) as exc:
+                logger.warning("result cache read failed: %s", exc)
+                return None
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now, now),
+                )
+                if now - self._last_evicted >= EVICT_INTERVAL_SECONDS:
+                    self._last_evicted = now
+                    self._evict(db, now)
+            except sqlite3.Error as exc:
+                logger.warning("result cache write failed: %s", exc)
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        """Drop expired rows, then the least recently used beyond max_entries."""
+        db.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        db.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            try:
+                entries = self._db().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
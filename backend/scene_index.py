@@ -0,0 +1,289 @@
+"""
+Local scene-change index for step detection.
+
+Proposing tutorial steps needs to know where the screen changes, not what it
+shows, so this never calls a provider. The video is decoded once at low fps
+and low resolution (grayscale, CLIPBUILDER_SCENE_WIDTH px wide), split into
+segments that are decoded and diffed in parallel in a process pool, and the
+per-frame change scores are kept so different step counts/gaps can be
+proposed from the same index.
+
+    info = probe(path)                       # cached; done once at ingest
+    index = build_index(path, ffmpeg=..., info=info)
+    steps = propose_steps(index, max_steps=20, min_gap_seconds=8)
+
+The change score of a frame is the fraction of pixels that changed noticeably
+since the previous sampled frame: a dialog opening or a page navigation
+scores high, cursor motion and video noise stay near zero.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from env_config import env_float, env_int
+
+logger = logging.getLogger("clipbuilder.scene_index")
+
+
+SAMPLE_FPS = env_float("CLIPBUILDER_SCENE_FPS", 2.0)
+FRAME_WIDTH = env_int("CLIPBUILDER_SCENE_WIDTH", 160)
+SEGMENT_SECONDS = env_int("CLIPBUILDER_SCENE_SEGMENT_SECONDS", 120)
+WORKERS = env_int("CLIPBUILDER_SCENE_WORKERS", min(4, os.cpu_count() or 1))
+# Per-pixel gray-level delta that counts as "changed" (0-255).
+PIXEL_DELTA = 24
+# A frame is a change candidate when this fraction of pixels changed...
+MIN_CHANGE_FRACTION = 0.02
+# ...and the screen then stays stable for this long (seconds) before the step is placed.
+SETTLE_SECONDS = 1.0
+
+
+class SceneIndexError(RuntimeError):
+    """ffmpeg/ffprobe could not decode the video."""
+
+
+@dataclass(frozen=True)
+class VideoInfo:
+    duration: float
+    width: int
+    height: int
+    fps: float
+
+
+@dataclass(frozen=True)
+class SceneIndex:
+    fps: float
+    times: list[float]  # seconds of each scored frame
+    scores: list[float]  # fraction of pixels changed vs. the previous sampled frame
+
+
+@dataclass(frozen=True)
+class StepCandidate:
+    seconds: float
+    score: float
+
+
+_probe_lock = threading.Lock()
+_probe_cache: dict[str, tuple[tuple[int, int], VideoInfo]] = {}
+
+
+def _parse_rate(raw: str | None) -> float:
+    try:
+        num, _, den = str(raw or "").partition("/")
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+    return value if value > 0 else 0.0
+
+
+def probe(path: Path) -> VideoInfo | None:
+    """Duration, size and frame rate of a video (ffprobe), cached per file version.
+
+    Called once at ingest; frame/audio extraction and the scene index reuse
+    the cached result. Returns None when the file cannot be probed.
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    key = str(path.resolve())
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _probe_lock:
+        cached = _probe_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+    ffprobe = shutil.which("ffprobe") or "ffprobe"
+    cmd = [
+        ffprobe,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "format=duration:stream=width,height,avg_frame_rate,r_frame_rate",
+        "-of", "json",
+        str(path),
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        data: dict[str, Any] = json.loads(proc.stdout or "{}")
+    except Exception as exc:
+        logger.warning("probe failed for %s: %s", path.name, exc)
+        return None
+
+    stream = (data.get("streams") or [{}])[0]
+    try:
+        duration = float((data.get("format") or {}).get("duration") or 0.0)
+    except (TypeError, ValueError):
+        duration = 0.0
+    if duration <= 0:
+        return None
+    info = VideoInfo(
+        duration=duration,
+        width=int(stream.get("width") or 0),
+        height=int(stream.get("height") or 0),
+        fps=_parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate")),
+    )
+    with _probe_lock:
+        _probe_cache[key] = (version, info)
+    return info
+
+
+def forget(path: Path) -> None:
+    with _probe_lock:
+        _probe_cache.pop(str(path.resolve()), None)
+
+
+def _frame_height(info: VideoInfo) -> int:
+    if info.width > 0 and info.height > 0:
+        height = round(FRAME_WIDTH * info.height / info.width)
+    else:
+        height = round(FRAME_WIDTH * 9 / 16)
+    return max(2, height - height % 2)
+
+
+def _score_segment(
+    ffmpeg: str, path: str, start: float, length: float, fps: float, width: int, height: int
+) -> tuple[float, list[float]]:
+    """Decode one segment (gray, downscaled) and score every frame against the previous one.
+
+    Runs in a worker process. The segment starts one sample early so its first
+    frame is diffed against the end of the previous segment.
+    """
+    import numpy as np
+
+    lead = 1.0 / fps if start > 0 else 0.0
+    cmd = [
+        ffmpeg,
+        "-hide_banner", "-nostats", "-loglevel", "error",
+        "-ss", f"{max(0.0, start - lead):.3f}",
+        "-t", f"{length + lead:.3f}",
+        "-i", path,
+        "-an", "-sn",
+        "-vf", f"fps={fps},scale={width}:{height}:flags=area,format=gray",
+        "-f", "rawvideo", "-pix_fmt", "gray",
+        "-threads", "1",
+        "-",
+    ]
+    proc = subprocess.run(cmd, capture_output=True)
+    if proc.returncode != 0 and not proc.stdout:
+        tail = "\n".join(proc.stderr.decode(errors="replace").strip().splitlines()[-5:])
+        raise SceneIndexError(f"ffmpeg falhou no trecho {start:.0f}s: {tail}")
+
+    frame_size = width * height
+    count = len(proc.stdout) // frame_size
+    if count < 2:
+        return start, []
+    frames = np.frombuffer(proc.stdout, dtype=np.uint8, count=count * frame_size).reshape(count, height, width)
+    # int16 avoids uint8 wrap-around; one vectorized pass over the whole segment.
+    delta = np.abs(np.diff(frames.astype(np.int16), axis=0))
+    changed = (delta > PIXEL_DELTA).mean(axis=(1, 2))
+    return start, changed.astype(float).tolist()
+
+
+_pool_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: workers only import this module, not the FastAPI app and its threads.
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def build_index(path: Path, *, ffmpeg: str, info: VideoInfo) -> SceneIndex:
+    """Scan the whole video in parallel segments and return per-frame change scores."""
+    fps = SAMPLE_FPS
+    width, height = FRAME_WIDTH - FRAME_WIDTH % 2, _frame_height(info)
+    starts: list[float] = []
+    position = 0.0
+    while position < info.duration:
+        starts.append(position)
+        position += SEGMENT_SECONDS
+
+    pool = _get_pool()
+    futures = [
+        pool.submit(
+            _score_segment, ffmpeg, str(path), start, min(SEGMENT_SECONDS, info.duration - start), fps, width, height
+        )
+        for start in starts
+    ]
+    times: list[float] = []
+    scores: list[float] = []
+    for future in futures:
+        try:
+            start, segment_scores = future.result()
+        except BrokenProcessPool as exc:
+            _reset_pool(pool)
+            raise SceneIndexError("Processo de análise de cenas encerrado inesperadamente.") from exc
+        # Frame i of the segment (i >= 1) is at start - lead + i / fps; with the lead that is start + (i - 1) / fps.
+        offset = start if start > 0 else 1.0 / fps
+        for i, score in enumerate(segment_scores):
+            times.append(round(offset + i / fps, 3))
+            scores.append(score)
+    logger.info(
+        "scene index: %s (%.0fs) -> %s frames in %s segments", path.name, info.duration, len(scores), len(starts)
+    )
+    return SceneIndex(fps=fps, times=times, scores=scores)
+
+
+def propose_steps(index: SceneIndex, *, max_steps: int, min_gap_seconds: float) -> list[StepCandidate]:
+    """Pick step moments: strong changes, placed once the screen settles, at least min_gap apart."""
+    import numpy as np
+
+    if not index.scores:
+        return []
+    scores = np.asarray(index.scores)
+    times = np.asarray(index.times)
+    # Adaptive threshold: busy recordings (video playback, scrolling) need a higher bar.
+    median = float(np.median(scores))
+    mad = float(np.median(np.abs(scores - median)))
+    threshold = max(MIN_CHANGE_FRACTION, median + 6.0 * mad)
+    peaks = np.flatnonzero(scores >= threshold)
+
+    settle_frames = max(1, int(round(SETTLE_SECONDS * index.fps)))
+    candidates: list[StepCandidate] = []
+    for i in peaks.tolist():
+        if candidates and times[i] - candidates[-1].seconds < min_gap_seconds:
+            # Same burst of changes: keep the strongest one.
+            if scores[i] > candidates[-1].score:
+                candidates[-1] = StepCandidate(seconds=float(times[i]), score=float(scores[i]))
+            continue
+        candidates.append(StepCandidate(seconds=float(times[i]), score=float(scores[i])))
+
+    placed: list[StepCandidate] = []
+    last_time = float(times[-1])
+    for candidate in candidates:
+        # Move forward to the first frame after which the screen is stable (animations finished).
+        i = int(np.searchsorted(times, candidate.seconds))
+        j = i + 1
+        while j < len(scores) and j - i < 4 * settle_frames:
+            if scores[j : j + settle_frames].max(initial=0.0) < threshold / 2:
+                break
+            j += 1
+        seconds = min(last_time, float(times[min(j, len(times) - 1)]) + SETTLE_SECONDS / 2)
+        placed.append(StepCandidate(seconds=round(seconds, 2), score=round(candidate.score, 4)))
+
+    if len(placed) > max_steps:
+        placed = sorted(placed, key=lambda c: c.score, reverse=True)[:max_steps]
+    return sorted(placed, key=lambda c: c.seconds)
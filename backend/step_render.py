@@ -0,0 +1,227 @@
+"""
+Animated steps rendered server-side from a range of an uploaded video.
+
+ffmpeg renders [start, end] as GIF (palettegen/paletteuse), animated WebP or
+MP4 (H.264); renders are cached next to the video (at most
+CLIPBUILDER_STEP_RENDER_MAX_PER_VIDEO, least recently used dropped first) and
+removed with it. Width and fps snap to a few presets and the range to 0.1 s,
+so arbitrary query values map onto a small set of files.
+`analysis_frames` returns small grayscale frames for keyframe selection and
+`transcode_gif` converts GIF steps for /export.
+
+    path = render(video_path, 12.0, 18.5, fmt="webp")
+"""
+
+from __future__ import annotations
+
+import logging
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from env_config import env_int
+
+logger = logging.getLogger("clipbuilder.step_render")
+
+
+class StepRenderError(RuntimeError):
+    pass
+
+
+FORMATS = {"gif": "image/gif", "webp": "image/webp", "mp4": "video/mp4"}
+WIDTH = env_int("CLIPBUILDER_STEP_RENDER_WIDTH", 960)
+FPS = env_int("CLIPBUILDER_STEP_RENDER_FPS", 10)
+MAX_SECONDS = env_int("CLIPBUILDER_STEP_RENDER_MAX_SECONDS", 60)
+MAX_PER_VIDEO = env_int("CLIPBUILDER_STEP_RENDER_MAX_PER_VIDEO", 8)
+MAX_WIDTH = 1920
+WIDTH_PRESETS = (480, 640, 960, 1280, MAX_WIDTH)
+FPS_PRESETS = (5, 10, 15)
+RANGE_STEP_SECONDS = 0.1
+
+
+def _encode_args(fmt: str, width: int, fps: int | None) -> list[str]:
+    """ffmpeg output options; fps=None keeps the source timing (GIF frame delays)."""
+    # Even width: libx264 with yuv420p rejects odd dimensions (height is already even via -2).
+    scale = f"scale='trunc(min(iw,{width})/2)*2':-2:flags=lanczos"
+    if fps is not None:
+        scale = f"fps={fps},{scale}"
+    if fmt == "gif":
+        return [
+            "-filter_complex",
+            f"[0:v]{scale},split[a][b];[a]palettegen=stats_mode=diff[p];"
+            "[b][p]paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle",
+            "-loop", "0",
+            "-f", "gif",
+        ]
+    if fmt == "webp":
+        return [
+            "-vf", scale,
+            "-c:v", "libwebp",
+            "-lossless", "0",
+            "-q:v", "70",
+            "-compression_level", "4",
+            "-loop", "0",
+            "-f", "webp",
+        ]
+    return [
+        "-vf", scale,
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", "28",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        "-f", "mp4",
+    ]
+
+
+def _run(cmd: list[str]) -> subprocess.CompletedProcess:
+    try:
+        return subprocess.run(cmd, capture_output=True)
+    except OSError as exc:  # ffmpeg not installed
+        raise StepRenderError(f"ffmpeg indisponível: {exc}") from exc
+
+
+def output_path(video_path: Path, start: float, end: float, fmt: str, width: int, fps: int) -> Path:
+    return video_path.with_name(
+        f"{video_path.stem}.step_{int(round(start * 1000))}_{int(round(end * 1000))}_{width}w{fps}.{fmt}"
+    )
+
+
+def _nearest(value: float, presets: tuple[int, ...]) -> int:
+    return min(presets, key=lambda preset: (abs(preset - value), preset))
+
+
+def snap(start: float, end: float, width: int, fps: int) -> tuple[float, float, int, int]:
+    """Range rounded to RANGE_STEP_SECONDS (never empty), width and fps moved to the nearest preset."""
+    start = round(round(start / RANGE_STEP_SECONDS) * RANGE_STEP_SECONDS, 1)
+    end = round(max(round(end / RANGE_STEP_SECONDS) * RANGE_STEP_SECONDS, start + RANGE_STEP_SECONDS), 1)
+    return start, end, _nearest(width, WIDTH_PRESETS), _nearest(fps, FPS_PRESETS)
+
+
+def _prune(video_path: Path, keep: Path) -> None:
+    """Drop the least recently used renders of the video beyond MAX_PER_VIDEO (`keep` is never removed)."""
+    renders = []
+    for path in video_path.parent.glob(f"{video_path.stem}.step_*"):
+        if path == keep or ".tmp." in path.name:
+            continue
+        try:
+            renders.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    renders.sort(reverse=True)
+    for _mtime, path in renders[max(0, MAX_PER_VIDEO - 1):]:
+        path.unlink(missing_ok=True)
+        logger.info("step render evicted: %s", path.name)
+
+
+# path -> (lock, requests using it); entries are dropped when the last request finishes.
+_render_locks_lock = threading.Lock()
+_render_locks: dict[str, tuple[threading.Lock, int]] = {}
+
+
+def render(
+    video_path: Path,
+    start: float,
+    end: float,
+    *,
+    fmt: str = "gif",
+    width: int = WIDTH,
+    fps: int = FPS,
+    ffmpeg: str = "ffmpeg",
+) -> Path:
+    """Render [start, end] as an animated `fmt` file (cached); raises StepRenderError."""
+    if fmt not in FORMATS:
+        raise StepRenderError(f"formato não suportado: {fmt}")
+    start, end, width, fps = snap(start, end, width, fps)
+    path = output_path(video_path, start, end, fmt, width, fps)
+    key = str(path)
+    with _render_locks_lock:
+        lock, users = _render_locks.get(key, (threading.Lock(), 0))
+        _render_locks[key] = (lock, users + 1)
+    try:
+        with lock:  # concurrent requests for the same range render it once
+            return _render_locked(video_path, path, start, end, fmt=fmt, width=width, fps=fps, ffmpeg=ffmpeg)
+    finally:
+        with _render_locks_lock:
+            lock, users = _render_locks[key]
+            if users <= 1:
+                del _render_locks[key]
+            else:
+                _render_locks[key] = (lock, users - 1)
+
+
+def _render_locked(
+    video_path: Path, path: Path, start: float, end: float, *, fmt: str, width: int, fps: int, ffmpeg: str
+) -> Path:
+    if path.exists() and path.stat().st_size > 0:
+        path.touch()  # mtime marks it as recently used for _prune
+        return path
+    tmp = path.with_name(f"{path.stem}.tmp.{fmt}")
+    cmd = [
+        ffmpeg,
+        "-v", "error",
+        "-y",
+        "-ss", str(start),
+        "-t", str(end - start),
+        "-i", str(video_path),
+        "-an", "-sn",
+        *_encode_args(fmt, width, fps),
+        str(tmp),
+    ]
+    proc = _run(cmd)
+    if proc.returncode != 0 or not tmp.exists() or tmp.stat().st_size == 0:
+        tmp.unlink(missing_ok=True)
+        tail = "\n".join(proc.stderr.decode(errors="replace").strip().splitlines()[-5:])
+        raise StepRenderError(f"ffmpeg falhou ao gerar {fmt}: {tail}")
+    tmp.replace(path)
+    logger.info("step render: %s (%s bytes)", path.name, path.stat().st_size)
+    _prune(video_path, keep=path)
+    return path
+
+
+def transcode_gif(gif_bytes: bytes, fmt: str, *, width: int = MAX_WIDTH, ffmpeg: str = "ffmpeg") -> bytes:
+    """Animated GIF -> animated WebP or MP4 (same timing, at most `width` px wide); raises StepRenderError."""
+    if fmt not in ("webp", "mp4"):
+        raise StepRenderError(f"formato não suportado: {fmt}")
+    with tempfile.TemporaryDirectory(prefix="clipbuilder_anim_") as tmp_dir:
+        src = Path(tmp_dir) / "step.gif"
+        dst = Path(tmp_dir) / f"step.{fmt}"
+        src.write_bytes(gif_bytes)
+        cmd = [ffmpeg, "-v", "error", "-y", "-i", str(src), "-an", *_encode_args(fmt, width, None), str(dst)]
+        proc = _run(cmd)
+        if proc.returncode != 0 or not dst.exists() or dst.stat().st_size == 0:
+            tail = "\n".join(proc.stderr.decode(errors="replace").strip().splitlines()[-5:])
+            raise StepRenderError(f"ffmpeg falhou ao converter GIF para {fmt}: {tail}")
+        return dst.read_bytes()
+
+
+def analysis_frames(
+    video_path: Path, start: float, end: float, *, fps: int, width: int, height: int, ffmpeg: str = "ffmpeg"
+) -> np.ndarray:
+    """Small grayscale frames of [start, end] at `fps`: shape (n, height, width) uint8."""
+    cmd = [
+        ffmpeg,
+        "-v", "error",
+        "-ss", str(start),
+        "-t", str(end - start),
+        "-i", str(video_path),
+        "-an", "-sn",
+        "-vf", f"fps={fps},scale={width}:{height}:flags=area,format=gray",
+        "-f", "rawvideo", "-pix_fmt", "gray",
+        "-",
+    ]
+    proc = _run(cmd)
+    frame_size = width * height
+    count = len(proc.stdout) // frame_size
+    if count == 0:
+        tail = "\n".join(proc.stderr.decode(errors="replace").strip().splitlines()[-5:])
+        raise StepRenderError(f"ffmpeg não extraiu quadros do trecho: {tail}")
+    return np.frombuffer(proc.stdout[: count * frame_size], dtype=np.uint8).reshape(count, height, width)
+
+
+def remove_all(video_path: Path) -> None:
+    for path in video_path.parent.glob(f"{video_path.stem}.step_*"):
+        path.unlink(missing_ok=True)
@@ -0,0 +1,51 @@
+"""YouTube imports get the whole-video transcript once the download is ready."""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("CLIPBUILDER_DATA_DIR", tempfile.mkdtemp(prefix="clipbuilder_test_"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import key_pool  # noqa: E402
+import main  # noqa: E402
+import scene_index  # noqa: E402
+import transcript  # noqa: E402
+
+
+def test_youtube_import_builds_ingest_transcript(monkeypatch):
+    def fake_download(*, url: str, out_path: Path) -> None:
+        out_path.write_bytes(b"video")
+
+    info = scene_index.VideoInfo(duration=30.0, width=1280, height=720, fps=30.0)
+    monkeypatch.setattr(main, "_download_youtube_video", fake_download)
+    monkeypatch.setattr(main.scene_index, "probe", lambda path: info)
+    monkeypatch.setattr(
+        main,
+        "_transcribe_chunk",
+        lambda video_path, start, length, api_key: [transcript.Segment(start=start, end=start + length, text="olá")],
+    )
+    monkeypatch.setattr(transcript, "ON_INGEST", True)
+    monkeypatch.setattr(main.audio_codec, "TRACK_ON_INGEST", False)
+    monkeypatch.setattr(main, "PRECAPTION_ON_INGEST", False)
+    monkeypatch.setitem(key_pool.pools, "gemini", key_pool.KeyPool("gemini", key_pool.parse_keys("gemini-test")))
+    monkeypatch.setitem(key_pool.pools, "groq", key_pool.KeyPool("groq", key_pool.parse_keys("gsk-test")))
+
+    with TestClient(main.app) as client:
+        response = client.post("/videos/youtube", json={"url": "https://youtu.be/dQw4w9WgXcQ"})
+        assert response.status_code == 200
+        video_id = response.json()["video_id"]
+        main._transcript_pool.submit(lambda: None).result(timeout=10)  # one worker: runs after the ingest job
+
+        status = client.get(f"/videos/{video_id}/status").json()
+        assert status["status"] == "ready"
+        assert status["transcript"] == "done"
+
+    saved = transcript.load(main.DATA_DIR / f"video_{video_id}.mp4")
+    assert saved is not None
+    assert saved.window(0, 30) == "olá"
@@ -0,0 +1,128 @@
+"""
+Whole-video timestamped transcripts, built once after ingest.
+
+The audio is transcribed in parallel chunks (with retries) and stored as a JSON
+sidecar next to the video; captions slice the window they need:
+
+    tr = load(video_path)
+    text = tr.window(start, end) if tr else None   # None (gap, not transcribed) -> Whisper on demand
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from env_config import env_flag, env_int
+
+logger = logging.getLogger("clipbuilder.transcript")
+
+
+ON_INGEST = env_flag("CLIPBUILDER_TRANSCRIPT_ON_INGEST", True)
+# 16 kHz mono WAV: ~1.9 MB per minute, so 5-minute chunks stay far below Whisper's upload limit.
+CHUNK_SECONDS = env_int("CLIPBUILDER_TRANSCRIPT_CHUNK_SECONDS", 300)
+CONCURRENCY = env_int("CLIPBUILDER_TRANSCRIPT_CONCURRENCY", 3)
+RETRIES = env_int("CLIPBUILDER_TRANSCRIPT_RETRIES", 3)
+_VERSION = 1
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    text: str
+
+
+@dataclass
+class Transcript:
+    duration: float
+    segments: list[Segment] = field(default_factory=list)
+    gaps: list[tuple[float, float]] = field(default_factory=list)  # chunks that could not be transcribed
+    model: str = ""
+
+    def window(self, start: float, end: float) -> str | None:
+        """Text spoken in [start, end], or None when that range was not (fully) transcribed."""
+        if end > self.duration + 1.0:
+            end = self.duration
+        if any(gap_start < end and start < gap_end for gap_start, gap_end in self.gaps):
+            return None
+        return " ".join(s.text.strip() for s in self.segments if s.start < end and start < s.end and s.text.strip())
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "version": _VERSION,
+            "model": self.model,
+            "duration": self.duration,
+            "segments": [{"start": s.start, "end": s.end, "text": s.text} for s in self.segments],
+            "gaps": [list(gap) for gap in self.gaps],
+        }
+
+
+def sidecar_path(video_path: Path) -> Path:
+    return video_path.with_name(f"{video_path.stem}.transcript.json")
+
+
+def chunk_ranges(duration: float, chunk_seconds: int = CHUNK_SECONDS) -> list[tuple[float, float]]:
+    """[(start, length)] covering the whole duration."""
+    out: list[tuple[float, float]] = []
+    start = 0.0
+    while start < duration:
+        out.append((start, min(float(chunk_seconds), duration - start)))
+        start += chunk_seconds
+    return out
+
+
+_cache_lock = threading.Lock()
+_cache: dict[str, tuple[int, Transcript]] = {}
+
+
+def save(video_path: Path, transcript: Transcript) -> None:
+    path = sidecar_path(video_path)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(transcript.to_json(), ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+    with _cache_lock:
+        _cache.pop(str(path), None)
+
+
+def load(video_path: Path) -> Transcript | None:
+    """Transcript from the sidecar (cached per file version), or None if there is none yet."""
+    path = sidecar_path(video_path)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    with _cache_lock:
+        cached = _cache.get(str(path))
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("version") != _VERSION:
+            return None
+        transcript = Transcript(
+            duration=float(data.get("duration") or 0.0),
+            segments=[
+                Segment(start=float(s["start"]), end=float(s["end"]), text=str(s.get("text") or ""))
+                for s in data.get("segments") or []
+            ],
+            gaps=[(float(g[0]), float(g[1])) for g in data.get("gaps") or []],
+            model=str(data.get("model") or ""),
+        )
+    except Exception as exc:
+        logger.warning("transcript sidecar unreadable (%s): %s", path.name, exc)
+        return None
+    with _cache_lock:
+        _cache[str(path)] = (mtime, transcript)
+    return transcript
+
+
+def remove(video_path: Path) -> None:
+    path = sidecar_path(video_path)
+    with _cache_lock:
+        _cache.pop(str(path), None)
+    path.unlink(missing_ok=True)
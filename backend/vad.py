@@ -0,0 +1,75 @@
+"""
+Energy-based voice activity detection for Whisper uploads.
+
+30 ms frames are voiced when they are louder than the window's noise floor
+(plus a margin) and most of their energy is in the speech band (300-3400 Hz).
+Windows without speech are skipped; otherwise leading and trailing silence is
+trimmed:
+
+    trimmed = trim_pcm(samples, 16000)   # None -> nothing to transcribe
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from env_config import env_flag, env_float
+
+
+ENABLED = env_flag("CLIPBUILDER_VAD", True)
+# Frames quieter than this are silence regardless of the noise floor.
+ABS_FLOOR_DB = env_float("CLIPBUILDER_VAD_FLOOR_DB", -50.0, allow_negative=True)
+MARGIN_DB = env_float("CLIPBUILDER_VAD_MARGIN_DB", 10.0)
+SPEECH_BAND_RATIO = env_float("CLIPBUILDER_VAD_SPEECH_BAND_RATIO", 0.35)
+MIN_SPEECH_SECONDS = env_float("CLIPBUILDER_VAD_MIN_SPEECH_SECONDS", 0.3)
+PAD_SECONDS = 0.3
+FRAME_SECONDS = 0.03
+
+
+@dataclass(frozen=True)
+class Trimmed:
+    samples: np.ndarray
+    offset_seconds: float  # where the trimmed audio starts in the original window
+    voiced_seconds: float
+
+
+def voiced_frames(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Boolean mask of voiced 30 ms frames."""
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    if count == 0:
+        return np.zeros(0, dtype=bool)
+    frames = samples[: count * frame].reshape(count, frame).astype(np.float32) / 32768.0
+
+    rms = np.sqrt(np.mean(frames * frames, axis=1)) + 1e-10
+    db = 20.0 * np.log10(rms)
+    noise_floor = float(np.percentile(db, 10))
+    loud = db > max(ABS_FLOOR_DB, noise_floor + MARGIN_DB)
+    if noise_floor > ABS_FLOOR_DB + MARGIN_DB:
+        # Continuous background (music, fan): the floor itself may be speech-level; rely on the band filter.
+        loud = db > ABS_FLOOR_DB
+
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frame, d=1.0 / sample_rate)
+    band = (freqs >= 300.0) & (freqs <= 3400.0)
+    ratio = spectrum[:, band].sum(axis=1) / (spectrum.sum(axis=1) + 1e-12)
+    return loud & (ratio >= SPEECH_BAND_RATIO)
+
+
+def trim_pcm(samples: np.ndarray, sample_rate: int) -> Trimmed | None:
+    """Trim leading/trailing silence; None when the window has (almost) no speech."""
+    mask = voiced_frames(samples, sample_rate)
+    if not mask.any() or mask.sum() * FRAME_SECONDS < MIN_SPEECH_SECONDS:
+        return None
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    voiced = np.flatnonzero(mask)
+    pad = int(PAD_SECONDS * sample_rate)
+    start = max(0, int(voiced[0]) * frame - pad)
+    end = min(len(samples), (int(voiced[-1]) + 1) * frame + pad)
+    return Trimmed(
+        samples=samples[start:end],
+        offset_seconds=start / sample_rate,
+        voiced_seconds=float(mask.sum() * FRAME_SECONDS),
+    )
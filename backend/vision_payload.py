@@ -0,0 +1,136 @@
+"""
+Compact image payloads for vision models.
+
+Images are resized to CLIPBUILDER_VISION_MAX_SIDE and re-encoded (JPEG or
+WebP), lowering quality and then size until the request fits its byte budget;
+an image already smaller in its original encoding is sent as-is:
+
+    urls = data_urls(frames)                  # list[bytes] -> ["data:image/jpeg;base64,...", ...]
+    urls = data_urls_from_b64(images_b64)     # client base64 (PNG/JPEG/...) -> data URLs
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import logging
+import os
+from typing import Any
+
+from env_config import env_int
+
+logger = logging.getLogger("clipbuilder.vision_payload")
+
+
+MAX_SIDE = env_int("CLIPBUILDER_VISION_MAX_SIDE", 1280)
+FORMAT = (os.getenv("CLIPBUILDER_VISION_FORMAT") or "jpeg").strip().lower()
+if FORMAT not in {"jpeg", "webp"}:
+    FORMAT = "jpeg"
+QUALITY = min(95, env_int("CLIPBUILDER_VISION_QUALITY", 80))
+# Total encoded bytes per request (base64 adds ~33% on top). Groq rejects base64 images over 4MB each.
+REQUEST_BUDGET_BYTES = env_int("CLIPBUILDER_VISION_REQUEST_BUDGET_BYTES", 3 * 1024 * 1024)
+
+_MIN_QUALITY = 50
+_MIN_SIDE = 512
+_MIME = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png", "gif": "image/gif"}
+
+
+def _encode(image: Any, *, max_side: int, quality: int) -> bytes:
+    from PIL import Image
+
+    if image.mode not in ("RGB", "L"):
+        # Flatten transparency on white: JPEG has no alpha and screenshots read best on white.
+        rgba = image.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.split()[-1])
+        image = flat
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    if FORMAT == "webp":
+        image.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def optimize(
+    images: list[bytes],
+    *,
+    max_side: int = MAX_SIDE,
+    budget_bytes: int = REQUEST_BUDGET_BYTES,
+) -> list[tuple[bytes, str]]:
+    """Re-encode images for a vision request; returns [(bytes, mime type)] in the same order."""
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning("Pillow not installed: sending images unoptimized")
+        return [(data, "image/png") for data in images]
+
+    decoded: list[tuple[bytes, Any | None, str]] = []
+    for data in images:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            decoded.append((data, image, _MIME.get(str(image.format or "").lower(), "image/png")))
+        except Exception:
+            decoded.append((data, None, "image/png"))  # let the provider report it
+
+    quality, side = QUALITY, max_side
+    while True:
+        out: list[tuple[bytes, str]] = []
+        for original, image, original_mime in decoded:
+            if image is None:
+                out.append((original, original_mime))
+                continue
+            encoded = _encode(image, max_side=side, quality=quality)
+            fits_as_is = max(image.size) <= side and original_mime in {"image/jpeg", "image/webp", "image/png"}
+            if fits_as_is and len(original) <= len(encoded):
+                out.append((original, original_mime))
+            else:
+                out.append((encoded, _MIME[FORMAT]))
+        total = sum(len(data) for data, _mime in out)
+        if total <= budget_bytes or (quality <= _MIN_QUALITY and side <= _MIN_SIDE):
+            break
+        if quality > _MIN_QUALITY:
+            quality = max(_MIN_QUALITY, quality - 10)
+        else:
+            side = max(_MIN_SIDE, int(side * 0.8))
+
+    before = sum(len(data) for data in images)
+    after = sum(len(data) for data, _mime in out)
+    logger.info(
+        "vision payload: %s images %s -> %s bytes (side<=%s, q=%s)", len(images), before, after, side, quality
+    )
+    return out
+
+
+def data_urls(images: list[bytes], **kwargs: Any) -> list[str]:
+    return [
+        f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}" for data, mime in optimize(images, **kwargs)
+    ]
+
+
+def data_urls_from_b64(images_b64: list[str], **kwargs: Any) -> list[str]:
+    """Client base64 images (optionally already data URLs) -> optimized data URLs.
+
+    Inputs that are not valid base64 are passed through unchanged (as a data
+    URL) so the provider reports them, instead of becoming empty images.
+    """
+    raw: list[bytes] = []
+    passthrough: dict[int, str] = {}
+    for index, b64_img in enumerate(images_b64):
+        text = str(b64_img or "")
+        payload = text.split(",", 1)[1] if text.startswith("data:") and "," in text else text
+        try:
+            data = base64.b64decode(payload)
+        except Exception:
+            data = b""
+        if data:
+            raw.append(data)
+        else:
+            logger.warning("vision payload: image %s is not valid base64, sending it unchanged", index)
+            passthrough[index] = text if text.startswith("data:") else f"data:image/png;base64,{text}"
+    optimized = iter(data_urls(raw, **kwargs) if raw else [])
+    return [passthrough[i] if i in passthrough else next(optimized) for i in range(len(images_b64))]
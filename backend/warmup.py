@@ -0,0 +1,109 @@
+"""
+Budgets for speculative clip warm-up.
+
+The player reports playhead/pause positions (POST /videos/{id}/warmup) and the
+backend prepares the Gemini clip tile covering that position before the user
+captures. Warm-ups are speculative, so they are capped:
+
+- per client: at most CLIPBUILDER_WARMUP_PER_CLIENT_PER_HOUR uploads per hour;
+- per video:  at most CLIPBUILDER_WARMUP_PER_VIDEO tiles in total;
+- globally:   CLIPBUILDER_WARMUP_CONCURRENCY uploads at a time (low priority:
+              skipped while real requests are queued for Gemini uploads).
+
+While playing (the player reports every few seconds), a tile is only warmed
+once the playhead has stayed in it for CLIPBUILDER_WARMUP_DWELL_SECONDS; a
+pause warms it right away.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from env_config import env_float
+
+logger = logging.getLogger("clipbuilder.warmup")
+
+
+PER_CLIENT_PER_HOUR = int(env_float("CLIPBUILDER_WARMUP_PER_CLIENT_PER_HOUR", 30))
+PER_VIDEO = int(env_float("CLIPBUILDER_WARMUP_PER_VIDEO", 12))
+CONCURRENCY = int(env_float("CLIPBUILDER_WARMUP_CONCURRENCY", 1))
+DWELL_SECONDS = env_float("CLIPBUILDER_WARMUP_DWELL_SECONDS", 3.0)
+_WINDOW_SECONDS = 3600.0
+
+
+class WarmupBudget:
+    """Thread-safe accounting of speculative uploads per client and per video."""
+
+    def __init__(self, *, per_client_per_hour: int, per_video: int, dwell_seconds: float) -> None:
+        self.per_client_per_hour = max(0, per_client_per_hour)
+        self.per_video = max(0, per_video)
+        self.dwell_seconds = dwell_seconds
+        self._lock = threading.Lock()
+        self._client_uses: dict[str, deque[float]] = {}
+        self._video_tiles: dict[str, set[int]] = {}
+        # (client, video) -> (tile, first seen while playing)
+        self._dwell: dict[tuple[str, str], tuple[int, float]] = {}
+        self.granted = 0
+        self.denied = 0
+
+    def dwelled(self, client_id: str, video_id: str, tile: int, *, paused: bool) -> bool:
+        """Record a playhead report; True once the position is worth warming."""
+        now = time.monotonic()
+        with self._lock:
+            key = (client_id, video_id)
+            current = self._dwell.get(key)
+            if current is None or current[0] != tile:
+                self._dwell[key] = (tile, now)
+                return paused
+            return paused or now - current[1] >= self.dwell_seconds
+
+    def reserve(self, client_id: str, video_id: str, tile: int) -> str | None:
+        """Reserve one warm-up; None when granted, otherwise why not ("already_scheduled" or a budget)."""
+        now = time.monotonic()
+        with self._lock:
+            tiles = self._video_tiles.setdefault(video_id, set())
+            if tile in tiles:
+                return "already_scheduled"
+            if len(tiles) >= self.per_video:
+                self.denied += 1
+                return "video_budget"
+            uses = self._client_uses.setdefault(client_id, deque())
+            while uses and now - uses[0] > _WINDOW_SECONDS:
+                uses.popleft()
+            if len(uses) >= self.per_client_per_hour:
+                self.denied += 1
+                return "client_budget"
+            uses.append(now)
+            tiles.add(tile)
+            self.granted += 1
+            return None
+
+    def release(self, video_id: str, tile: int) -> None:
+        """Give a tile back (warm-up skipped or failed) so it can be retried later."""
+        with self._lock:
+            self._video_tiles.get(video_id, set()).discard(tile)
+
+    def forget_video(self, video_id: str) -> None:
+        with self._lock:
+            self._video_tiles.pop(video_id, None)
+            for key in [k for k in self._dwell if k[1] == video_id]:
+                self._dwell.pop(key, None)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "granted": self.granted,
+                "denied": self.denied,
+                "videos": {video_id: len(tiles) for video_id, tiles in self._video_tiles.items()},
+            }
+
+
+budget = WarmupBudget(
+    per_client_per_hour=PER_CLIENT_PER_HOUR,
+    per_video=PER_VIDEO,
+    dwell_seconds=DWELL_SECONDS,
+)
@@ -91,6 +91,7 @@ export default function Dashboard() {
   const youtubePollRef = useRef(null)
   const gifEncoderRef = useRef(null)
   const gifFrameIntervalRef = useRef(null)
+  const gifRangeRef = useRef(null) // { start, end } em segundos quando o GIF é gerado no servidor
 
   const [videoUrl, setVideoUrl] = useState(null)
   const [videoId, setVideoId] = useState(null)
@@ -238,6 +239,42 @@ export default function Dashboard() {
     return () => document.removeEventListener('mousedown', handleClickOutside)
   }, [docProDropdownOpen])
 
+  // Report pause/seek positions (and, throttled, the playhead while playing) so the backend can
+  // prepare the Gemini clip before the next capture; it warms a tile once playback dwells in it.
+  useEffect(() => {
+    const video = videoRef.current
+    if (!video || !videoId || aiStatus !== 'ready' || !aiFillEnabled) return
+    if (!geminiModel.startsWith('models/gemini')) return
+    let timer = null
+    let lastPlayingReport = 0
+    function send(paused) {
+      const t = Math.max(0, Number(video.currentTime) || 0)
+      api.post(`/videos/${videoId}/warmup`, { t, paused }).catch(() => {})
+    }
+    function report(paused) {
+      clearTimeout(timer)
+      timer = setTimeout(() => send(paused), paused ? 300 : 1500)
+    }
+    const onPause = () => report(true)
+    const onSeeked = () => report(video.paused)
+    const onTimeUpdate = () => {
+      if (video.paused || video.seeking) return
+      const now = Date.now()
+      if (now - lastPlayingReport < 2000) return
+      lastPlayingReport = now
+      send(false)
+    }
+    video.addEventListener('pause', onPause)
+    video.addEventListener('seeked', onSeeked)
+    video.addEventListener('timeupdate', onTimeUpdate)
+    return () => {
+      clearTimeout(timer)
+      video.removeEventListener('pause', onPause)
+      video.removeEventListener('seeked', onSeeked)
+      video.removeEventListener('timeupdate', onTimeUpdate)
+    }
+  }, [videoId, videoUrl, aiStatus, aiFillEnabled, geminiModel])
+
   function onPickVideo(file) {
     setError('')
     setAiError('')
@@ -862,11 +899,16 @@ export default function Dashboard() {
       )
       form.append('image_name_prefix', prefix)
       form.append('output_format', 'markdown')
+      // Passos em GIF são convertidos no backend para WebP animado (bem menor que o GIF).
+      form.append('animation_format', 'webp')
 
       // Only send images for steps that actually have them.
       steps.forEach((s, idx) => {
         if (!s?.blob || !s?.has_image) return
-        const file = new File([s.blob], `${prefix}${String(idx + 1).padStart(2, '0')}.png`, { type: 'image/png' })
+        const name = `${prefix}${String(idx + 1).padStart(2, '0')}`
+        const file = s.is_gif
+          ? new File([s.blob], `${name}.gif`, { type: 'image/gif' })
+          : new File([s.blob], `${name}.png`, { type: 'image/png' })
         form.append('images', file)
       })
 
@@ -947,6 +989,17 @@ export default function Dashboard() {
     const video = videoRef.current
     const canvas = canvasRef.current
 
+    // Vídeo já está no servidor: só marcar o intervalo; o GIF é gerado pelo ffmpeg no backend.
+    if (videoId && aiStatus === 'ready') {
+      gifEncoderRef.current = null
+      gifRangeRef.current = { start: Math.max(0, Number(video.currentTime) || 0), end: null }
+      if (video.paused) {
+        video.play().catch(() => { })
+      }
+      return
+    }
+    gifRangeRef.current = null
+
     // Configurar canvas com tamanho do vídeo
     canvas.width = video.videoWidth
     canvas.height = video.videoHeight
@@ -993,6 +1046,28 @@ export default function Dashboard() {
       videoRef.current.pause()
     }
 
+    const range = gifRangeRef.current
+    if (range && videoId) {
+      range.end = Math.max(range.start + 0.5, Number(videoRef.current?.currentTime) || 0)
+      setIsGeneratingGif(true)
+      setGifPreviewOpen(true)
+      api.get(`/videos/${videoId}/animation`, {
+        params: { start: range.start, end: range.end, output_format: 'gif' },
+        responseType: 'blob'
+      })
+        .then((res) => {
+          setGifBlob(res.data)
+          setGifUrl(URL.createObjectURL(res.data))
+          setGifProgress(1)
+        })
+        .catch(() => {
+          setError('Não foi possível gerar o GIF no servidor.')
+          setGifPreviewOpen(false)
+        })
+        .finally(() => setIsGeneratingGif(false))
+      return
+    }
+
     const gif = gifEncoderRef.current
     if (!gif) return
 
@@ -1044,9 +1119,17 @@ export default function Dashboard() {
       // Se falhar, thumbnailUrl fica null e o GifStepPreview tentará extrair
     }
 
+    // GIF gerado no servidor: descrever direto do vídeo, sem reenviar o GIF.
+    const range = gifRangeRef.current && gifRangeRef.current.end !== null ? gifRangeRef.current : null
+
     try {
       const form = new FormData()
-      form.append('file', new File([gifBlob], 'clipbuilder.gif', { type: 'image/gif' }))
+      if (range && videoId) {
+        form.append('start', String(range.start))
+        form.append('end', String(range.end))
+      } else {
+        form.append('file', new File([gifBlob], 'clipbuilder.gif', { type: 'image/gif' }))
+      }
       if (documentTitle && documentTitle.trim()) {
         form.append('document_title', documentTitle.trim())
       }
@@ -1063,7 +1146,8 @@ export default function Dashboard() {
         form.append('document_context', contextParts.join('\n'))
       }
 
-      const res = await api.post('/describe-gif', form, {
+      const endpoint = range && videoId ? `/videos/${videoId}/describe-range` : '/describe-gif'
+      const res = await api.post(endpoint, form, {
         headers: { 'Content-Type': 'multipart/form-data' }
       })
       const text = res?.data?.description
@@ -1090,7 +1174,8 @@ export default function Dashboard() {
         timestamp,
         seconds,
         has_image: true,
-        is_gif: true
+        is_gif: true,
+        gif_range: range ? { start: range.start, end: range.end } : null
       }
     ])
     setSelectedStepId(id)
@@ -1104,6 +1189,7 @@ export default function Dashboard() {
 
   function closeGifPreview() {
     setGifPreviewOpen(false)
+    gifRangeRef.current = null
     setGifBlob(null)
     if (gifUrl) {
       URL.revokeObjectURL(gifUrl)